@@ -0,0 +1,86 @@
+"""
+Admission control for check-in bursts.
+
+A global token bucket caps how many check-ins per second the process lets
+through to the database, and a bucket per session stops one 400-seat lecture
+from starving the others. A check-in that finds either bucket empty is
+rejected straight away with the time until a token frees up, which the client
+uses as its Retry-After, so latency stays bounded instead of every request
+queueing behind SQLite.
+"""
+import threading
+import time
+
+
+class TokenBucket:
+    """Refills at rate tokens per second up to burst tokens"""
+    
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+    
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self):
+        """Seconds until one token is available (0 if one is available now)"""
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """Global and per-session token buckets in front of the check-in endpoint"""
+    
+    def __init__(self, app=None):
+        self.app = None
+        self._global = None
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('CHECKIN_GLOBAL_RATE', 200)
+        app.config.setdefault('CHECKIN_GLOBAL_BURST', 400)
+        app.config.setdefault('CHECKIN_SESSION_RATE', 50)
+        app.config.setdefault('CHECKIN_SESSION_BURST', 100)
+        app.extensions['admission'] = self
+        self.app = app
+        self._global = TokenBucket(app.config['CHECKIN_GLOBAL_RATE'], app.config['CHECKIN_GLOBAL_BURST'])
+    
+    def admit(self, session_id):
+        """
+        Take a token from the global and the session bucket. Returns 0 if the
+        check-in is admitted, otherwise the seconds to wait before retrying.
+        A token is only taken when both buckets have one.
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._sessions.get(session_id)
+            if bucket is None:
+                bucket = self._sessions[session_id] = TokenBucket(
+                    self.app.config['CHECKIN_SESSION_RATE'], self.app.config['CHECKIN_SESSION_BURST']
+                )
+            self._global.refill(now)
+            bucket.refill(now)
+            wait = max(self._global.wait_time(), bucket.wait_time())
+            if wait == 0:
+                self._global.tokens -= 1
+                bucket.tokens -= 1
+            self._prune(now)
+        return wait
+    
+    def _prune(self, now):
+        # Buckets that have refilled completely carry no state worth keeping
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        for session_id, bucket in list(self._sessions.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self._sessions[session_id]
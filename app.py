@@ -1,9 +1,33 @@
-from flask import Flask, render_template, request, jsonify, session as flask_session, redirect, url_for, flash, send_file
+from flask import (Flask, Response, render_template, request, jsonify, session as flask_session, redirect, url_for,
+                   flash)
 from flask_cors import CORS
 from datetime import datetime, timedelta
-from database import db, User, Admin, Lecturer, Student, Course, Session as SessionModel, Attendance, RemovalRequest
+from database import (db, User, Admin, Lecturer, Student, Course, Session as SessionModel, Attendance, RemovalRequest,
+                      Notification)
+from attendance_queue import AttendanceWriteQueue
+from attendance_feed import AttendanceFeed, mark_event
+from attendance_summary import summaries_for
+from session_cache import GeofenceCache
+from cidr_registry import CIDRRegistry, load_campus_networks
+from session_locator import SessionLocator
+from session_lifecycle import SessionLifecycle
+from session_reminders import ReminderScheduler
+from notifications import NotificationOutbox
+from admission import AdmissionController
+from search_index import SearchIndex, KINDS as SEARCH_KINDS
+from user_import import UserImporter
+from csv_export import csv_response, EXPORT_BATCH_SIZE
+from archive_export import AttendanceArchive
+from db_config import configure_database, install_sqlite_pragmas
+from migrations import migrate
+from queries import (course_report_rows, course_report_query, student_attendance_query, attendance_record_query,
+                     top_students, encode_cursor, decode_cursor, lecturer_courses,
+                     lecturer_active_sessions, lecturer_for_user, USER_SORTS, COURSE_SORTS, user_page,
+                     course_page, removal_request_page, removal_request_count, recent_processed_requests,
+                     available_students, course_roster, course_roster_ids)
 import secrets
-import ipaddress
+import os
+import math
 import csv
 import io
 from datetime import datetime, timedelta
@@ -11,15 +35,161 @@ from io import BytesIO
 import csv
 
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)
+# Set SECRET_KEY so logins survive restarts and are shared with the ASGI check-in service
+app.secret_key = os.environ.get('SECRET_KEY') or secrets.token_hex(16)
 CORS(app)
 
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///trackademia.db'
+# Database configuration (DATABASE_URL and TRACKADEMIA_DB_PROFILE, see db_config.py)
+configure_database(app)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Named campus networks sessions can reference in allowed_ip_range
+# (TRACKADEMIA_CAMPUS_NETWORKS, see cidr_registry.py)
+app.config['CAMPUS_NETWORKS'] = load_campus_networks()
+
 # Initialize the database with the app
 db.init_app(app)
+install_sqlite_pragmas(app, db)
+
+# Committed attendance marks, streamed live to the lecturer's session report
+attendance_feed = AttendanceFeed(app)
+
+# Attendance marks are written in group commits by a background writer
+attendance_queue = AttendanceWriteQueue(app, feed=attendance_feed)
+
+# Campus network ranges, compiled once into prefix tries
+cidr_registry = CIDRRegistry(app)
+
+# Verification parameters of active sessions, kept in memory
+geofence_cache = GeofenceCache(app, networks=cidr_registry)
+
+# Grid index of active session locations for check-in by coordinates
+session_locator = SessionLocator(app, geofences=geofence_cache)
+
+# Moves sessions upcoming -> active -> past on a background schedule
+session_lifecycle = SessionLifecycle(app, geofences=geofence_cache, locator=session_locator)
+
+# Outbox of notifications to users, delivered in batches by worker threads
+notification_outbox = NotificationOutbox(app)
+
+# Reminds enrolled students shortly before each session starts
+session_reminders = ReminderScheduler(app, outbox=notification_outbox)
+
+# Token buckets limiting how fast check-ins reach the database
+admission = AdmissionController(app)
+
+# Full-text index behind the user, student and course typeahead
+search_index = SearchIndex(app)
+
+# Batched CSV import of users, with passwords hashed in a process pool
+user_importer = UserImporter(app, search=search_index)
+
+# Parquet archive of attendance for analytics (python archive_export.py)
+attendance_archive = AttendanceArchive(app)
+
+class CheckInRefused(Exception):
+    """A check-in turned down, with the HTTP status and JSON body to answer it with"""
+    
+    def __init__(self, status, body):
+        super().__init__(body['message'])
+        self.status = status
+        self.body = body
+
+def queue_check_in(student_id, geofence, data, client_ip):
+    """
+    Verify a check-in by a known student to a known session and queue its
+    mark. Returns (mark, distance) or raises CheckInRefused. Shared by
+    mark_attendance_api and the ASGI check-in service (asgi_ingest.py).
+    """
+    # Shed load before queueing a mark when check-ins arrive faster than we can store them.
+    # Only real sessions get a bucket, so made-up session ids cannot grow the bucket table
+    retry_after = admission.admit(str(geofence.session_id))
+    if retry_after:
+        raise CheckInRefused(429, {
+            'success': False,
+            'message': 'Check-in is busy right now. Retrying shortly...',
+            'retry_after': round(retry_after, 2)
+        })
+    
+    # 1. Get student's location from browser
+    student_lat = data.get('latitude')
+    student_lon = data.get('longitude')
+    accuracy = data.get('accuracy')
+    
+    if not student_lat or not student_lon:
+        raise CheckInRefused(400, {
+            'success': False,
+            'message': 'Could not get your location. Please enable location services.'
+        })
+    
+    # 2. Check location - make sure session has coordinates
+    if not geofence.has_location:
+        raise CheckInRefused(400, {
+            'success': False,
+            'message': 'This session does not have location data configured.'
+        })
+    
+    is_within_range, distance = geofence.check_location(student_lat, student_lon, accuracy)
+    
+    # 3. Optional: Check network (simplified)
+    ip_valid = geofence.check_network(client_ip)
+    
+    if not (is_within_range and ip_valid):
+        raise CheckInRefused(403, {
+            'success': False,
+            'message': f'Cannot mark attendance: {"Too far from lecture room" if not is_within_range else "Not on campus network"}',
+            'distance': distance,
+            'max_allowed': geofence.allowed_distance_meters,
+            'within_range': is_within_range,
+            'network_valid': ip_valid
+        })
+    
+    # 4. Queue the mark; a mark already waiting for its commit means this is a double-tap
+    mark = attendance_queue.submit(student_id, geofence.session_id, student_lat, student_lon)
+    if mark is None:
+        raise CheckInRefused(400, {
+            'success': False,
+            'message': 'You have already marked attendance for this session.'
+        })
+    return mark, distance
+
+def check_in_result(mark, distance):
+    """(status, body) answering a queued check-in, once its mark is resolved or the wait timed out"""
+    if not mark.done:
+        return 503, {
+            'success': False,
+            'message': 'Your attendance is still being recorded. Please check again shortly.'
+        }
+    if mark.error:
+        return 500, {
+            'success': False,
+            'message': 'Could not record attendance. Please try again.'
+        }
+    # The insert skips existing (student, session) rows, so retries are safe
+    if not mark.inserted:
+        return 400, {
+            'success': False,
+            'message': 'You have already marked attendance for this session.'
+        }
+    return 200, {
+        'success': True,
+        'message': f'Attendance marked! You were {distance:.1f}m from the lecture room.',
+        'distance': distance,
+        'timestamp': mark.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+def check_in_refused_response(refused):
+    """Response for a refused check-in, telling the client how long to back off when it was shed"""
+    response = jsonify(refused.body)
+    response.status_code = refused.status
+    if refused.status == 429:
+        response.headers['Retry-After'] = str(max(1, math.ceil(refused.body['retry_after'])))
+    return response
+
+def sessions_changed(*session_objs):
+    """Refresh in-memory session data after sessions were edited or changed status"""
+    geofence_cache.invalidate(*(s.id for s in session_objs))
+    session_locator.update(*session_objs)
 
 # Authentication middleware
 @app.before_request
@@ -37,6 +207,17 @@ def inject_pending_requests():
         return dict(pending_requests_count=pending_count)
     return dict(pending_requests_count=0)
 
+def list_page_size(default=50):
+    """Rows per page for the admin lists, from ?per_page= (capped at 200)"""
+    return min(max(request.args.get('per_page', default, type=int), 1), 200)
+
+def page_args(filters):
+    """Query string arguments that keep a list's filters on its page links"""
+    args = {key: value for key, value in filters.items() if value}
+    if 'per_page' in request.args:
+        args['per_page'] = list_page_size()
+    return args
+
 # Check admin access
 def require_admin():
     if flask_session.get('user_type') != 'admin':
@@ -129,8 +310,29 @@ def admin_users():
         flash('Access denied. Admin privileges required.', 'error')
         return redirect(url_for('login'))
     
-    users = db.session.query(User).order_by(User.user_type, User.name).all()
-    return render_template('admin_users.html', users=users)
+    # Filters and sort order come from the query string so page links keep them
+    filters = {
+        'q': request.args.get('q', '').strip(),
+        'type': request.args.get('type', ''),
+        'status': request.args.get('status', ''),
+        'sort': request.args.get('sort', 'type'),
+        'order': request.args.get('order', 'asc'),
+    }
+    if filters['sort'] not in USER_SORTS:
+        filters['sort'] = 'type'
+    
+    users, next_cursor = user_page(
+        cursor=request.args.get('cursor'),
+        limit=list_page_size(),
+        search=filters['q'] or None,
+        user_type=filters['type'] or None,
+        status=filters['status'] or None,
+        sort=filters['sort'],
+        descending=filters['order'] == 'desc'
+    )
+    return render_template('admin_users.html', users=users, next_cursor=next_cursor,
+                           filters=filters, is_first_page=not request.args.get('cursor'),
+                           page_args=page_args(filters))
 
 @app.route('/admin/users/create', methods=['GET', 'POST'])
 def admin_create_user():
@@ -285,64 +487,33 @@ def admin_import_users():
             return redirect(request.url)  # Removed extra return
         
         if file and file.filename.endswith('.csv'):
+            dry_run = bool(request.form.get('dry_run'))
             try:
-                stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-                csv_input = csv.DictReader(stream)
-                
-                imported_count = 0
-                for row in csv_input:
-                    # Check if username exists
-                    existing_user = db.session.query(User).filter_by(username=row.get('username')).first()
-                    if existing_user:
-                        flash(f"Username {row.get('username')} already exists", 'warning')
-                        continue
-                    
-                    # Create user
-                    user = User(
-                        username=row.get('username'),
-                        name=row.get('name'),
-                        email=row.get('email'),
-                        user_type=row.get('user_type'),
-                        is_active=True
-                    )
-                    user.set_password(row.get('password', 'password123'))
-                    db.session.add(user)
-                    db.session.commit()  # Commit to get user.id
-                    
-                    # Create profile
-                    if user.user_type == 'student':
-                        student = Student(
-                            user_id=user.id,
-                            student_id=row.get('student_id'),
-                            enrollment_year=row.get('enrollment_year'),
-                            major=row.get('major')
-                        )
-                        db.session.add(student)
-                    elif user.user_type == 'lecturer':
-                        lecturer = Lecturer(
-                            user_id=user.id,
-                            department=row.get('department'),
-                            employee_id=row.get('employee_id'),
-                            office_location=row.get('office_location'),
-                            office_hours=row.get('office_hours')
-                        )
-                        db.session.add(lecturer)
-                    elif user.user_type == 'admin':
-                        admin = Admin(
-                            user_id=user.id,
-                            role=row.get('role', 'administrator')
-                        )
-                        db.session.add(admin)
-                    
-                    imported_count += 1
-                
-                db.session.commit()
-                flash(f'Successfully imported {imported_count} users', 'success')
-                return redirect(url_for('admin_users'))
-                
-            except Exception as e:
+                # Read the upload as a stream rather than into memory
+                stream = io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline='')
+                report = user_importer.import_csv(stream, dry_run=dry_run)
+            except (ValueError, csv.Error) as e:
                 flash(f'Error importing CSV: {str(e)}', 'error')
                 return redirect(request.url)
+            
+            if report.aborted:
+                # Batches before the failed one are already in the database
+                flash(f'Import stopped by an error: {report.aborted}. '
+                      f'{report.imported_count} users {"would have been" if dry_run else "were"} imported before it, '
+                      f'{report.error_count} rows were skipped and {report.failed} rows failed.', 'error')
+                return render_template('admin_import_users.html', report=report)
+            if dry_run:
+                flash(f'Dry run: {report.imported_count} of {report.rows} users would be imported', 'info')
+            else:
+                flash(f'Successfully imported {report.imported_count} users', 'success')
+            if report.error_count:
+                flash(f'{report.error_count} rows were skipped', 'warning')
+            elif not dry_run:
+                return redirect(url_for('admin_users'))
+            return render_template('admin_import_users.html', report=report)
+        
+        flash('Please upload a .csv file', 'error')
+        return redirect(request.url)
     
     return render_template('admin_import_users.html')
 
@@ -352,8 +523,29 @@ def admin_courses():
         flash('Access denied. Admin privileges required.', 'error')
         return redirect(url_for('login'))
     
-    courses = db.session.query(Course).order_by(Course.code).all()
-    return render_template('admin_courses.html', courses=courses)
+    # Filters and sort order come from the query string so page links keep them
+    filters = {
+        'q': request.args.get('q', '').strip(),
+        'status': request.args.get('status', ''),
+        'semester': request.args.get('semester', '').strip(),
+        'sort': request.args.get('sort', 'code'),
+        'order': request.args.get('order', 'asc'),
+    }
+    if filters['sort'] not in COURSE_SORTS:
+        filters['sort'] = 'code'
+    
+    courses, next_cursor = course_page(
+        cursor=request.args.get('cursor'),
+        limit=list_page_size(),
+        search=filters['q'] or None,
+        status=filters['status'] or None,
+        semester=filters['semester'] or None,
+        sort=filters['sort'],
+        descending=filters['order'] == 'desc'
+    )
+    return render_template('admin_courses.html', courses=courses, next_cursor=next_cursor,
+                           filters=filters, is_first_page=not request.args.get('cursor'),
+                           page_args=page_args(filters))
 
 @app.route('/admin/courses/create', methods=['GET', 'POST'])
 def admin_create_course():
@@ -422,14 +614,10 @@ def admin_course_enrollments(course_id):
         flash('Course not found', 'error')
         return redirect(url_for('admin_courses'))
     
-    all_students = db.session.query(Student).all()
-    enrolled_students = course.students
-    available_students = [s for s in all_students if s not in enrolled_students]
-    
+    # Students who can be added are loaded page by page from /api/courses/<id>/available-students
     return render_template('admin_course_enrollments.html',
                          course=course,
-                         enrolled_students=enrolled_students,
-                         available_students=available_students)
+                         enrolled_students=course.students)
 
 @app.route('/admin/courses/enroll', methods=['POST'])
 def admin_enroll_student():
@@ -514,16 +702,33 @@ def admin_removal_requests():
         flash('Access denied. Admin privileges required.', 'error')
         return redirect(url_for('login'))
     
-    # Get all requests
-    all_requests = db.session.query(RemovalRequest).order_by(RemovalRequest.created_at.desc()).all()
-    
-    # Separate pending and processed requests
-    pending_requests = [r for r in all_requests if r.status == 'pending']
-    recent_requests = [r for r in all_requests if r.status != 'pending'][:10]  # Last 10 processed
+    filters = {
+        'status': request.args.get('status', 'pending'),
+        'course_id': request.args.get('course_id', type=int),
+        'order': request.args.get('order', 'desc'),
+    }
+    if filters['status'] not in ('pending', 'approved', 'rejected'):
+        filters['status'] = 'pending'
+    
+    # One page of requests with the selected status
+    listed_requests, next_cursor = removal_request_page(
+        cursor=request.args.get('cursor'),
+        limit=list_page_size(25),
+        status=filters['status'],
+        course_id=filters['course_id'],
+        oldest_first=filters['order'] == 'asc'
+    )
+    request_count = removal_request_count(filters['status'], filters['course_id'])
+    recent_requests = recent_processed_requests(10)  # Last 10 processed
     
     return render_template('admin_removal_requests.html', 
-                         pending_requests=pending_requests,
-                         recent_requests=recent_requests)
+                         listed_requests=listed_requests,
+                         recent_requests=recent_requests,
+                         request_count=request_count,
+                         next_cursor=next_cursor,
+                         filters=filters,
+                         is_first_page=not request.args.get('cursor'),
+                         page_args=page_args(filters))
 
 # API endpoints for removal requests
 @app.route('/api/removal-request/details/<int:request_id>')
@@ -664,15 +869,10 @@ def admin_reports():
     total_attendance = db.session.query(Attendance).count()
     attendance_by_course = {}
     
-    courses = db.session.query(Course).all()
-    for course in courses:
-        course_sessions = len(course.sessions)
-        course_attendance = 0
-        for session in course.sessions:
-            course_attendance += len(session.attendance_records)
+    for course in course_report_rows():
         attendance_by_course[course.name] = {
-            'sessions': course_sessions,
-            'attendance': course_attendance
+            'sessions': course.sessions,
+            'attendance': course.attendance
         }
     
     # Get statistics for the template
@@ -694,54 +894,50 @@ def api_top_students():
     if flask_session.get('user_type') != 'admin':
         return jsonify({'success': False, 'message': 'Access denied'}), 403
     
-    # Get pagination parameters
-    page = request.args.get('page', 1, type=int)
-    limit = request.args.get('limit', 10, type=int)
-    offset = (page - 1) * limit
+    # Get pagination parameters; cursor (from next_cursor) takes precedence over page
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    cursor = request.args.get('cursor')
+    try:
+        cursor = decode_cursor(cursor, 2) if cursor else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+    
+    # Optional filters
+    course_id = request.args.get('course_id', type=int)
+    semester = request.args.get('semester') or None
+    threshold = request.args.get('threshold', type=float)
+    
+    # Ranked, filtered and paginated in the database
+    rows, total, next_cursor = top_students(
+        limit,
+        cursor=cursor,
+        offset=(page - 1) * limit,
+        course_id=course_id,
+        semester=semester,
+        threshold=threshold
+    )
     
-    # Get all students with their attendance statistics
-    students = db.session.query(Student).all()
     student_data = []
-    
-    for student in students:
-        # Calculate attendance statistics
-        total_sessions = 0
-        attended_sessions = 0
-        
-        for course in student.courses:
-            total_sessions += len([s for s in course.sessions if s.status == 'past'])
-            attended_sessions += db.session.query(Attendance).filter_by(
-                student_id=student.id,
-                status='present'
-            ).join(SessionModel).filter(SessionModel.course_id == course.id).count()
-        
-        attendance_rate = 0
-        if total_sessions > 0:
-            attendance_rate = round((attended_sessions / total_sessions) * 100, 1)
-        
+    for row in rows:
         student_data.append({
-            'id': student.id,
-            'student_id': student.student_id,
-            'name': student.user.name,
-            'courses_count': len(student.courses),
-            'total_sessions': total_sessions,
-            'attended_sessions': attended_sessions,
-            'attendance_rate': attendance_rate,
-            'is_active': student.user.is_active
+            'id': row.id,
+            'student_id': row.student_id,
+            'name': row.name,
+            'courses_count': row.courses_count,
+            'total_sessions': row.total_sessions,
+            'attended_sessions': row.attended_sessions,
+            'attendance_rate': row.attendance_rate if row.total_sessions > 0 else 0,
+            'is_active': row.is_active
         })
     
-    # Sort by attendance rate (highest first)
-    student_data.sort(key=lambda x: x['attendance_rate'], reverse=True)
-    
-    # Apply pagination
-    paginated_data = student_data[offset:offset + limit]
-    
     return jsonify({
         'success': True,
-        'students': paginated_data,
-        'total': len(student_data),
+        'students': student_data,
+        'total': total,
         'page': page,
-        'total_pages': (len(student_data) + limit - 1) // limit
+        'total_pages': (total + limit - 1) // limit,
+        'next_cursor': encode_cursor(*next_cursor) if next_cursor else None
     })
 
 @app.route('/api/reports/export-all')
@@ -749,42 +945,27 @@ def export_all_reports():
     if flask_session.get('user_type') != 'admin':
         return jsonify({'success': False, 'message': 'Access denied'}), 403
     
-    # Create CSV data
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow(['Course Code', 'Course Name', 'Lecturer', 'Enrolled', 'Sessions', 'Attendance', 'Attendance Rate'])
-    
-    # Write data
-    courses = db.session.query(Course).all()
-    for course in courses:
-        course_sessions = len(course.sessions)
-        course_attendance = 0
-        for session in course.sessions:
-            course_attendance += len(session.attendance_records)
-        
-        attendance_rate = 0
-        if course_sessions > 0 and len(course.students) > 0:
-            attendance_rate = round((course_attendance / (course_sessions * len(course.students))) * 100, 1)
-        
-        writer.writerow([
-            course.code,
-            course.name,
-            course.lecturer.user.name if course.lecturer else 'N/A',
-            len(course.students),
-            course_sessions,
-            course_attendance,
-            f"{attendance_rate}%"
-        ])
-    
-    # Return CSV file
-    output.seek(0)
-    return send_file(
-        io.BytesIO(output.getvalue().encode('utf-8')),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name='trackademia_reports.csv'
+    def rows():
+        for course in course_report_query().yield_per(EXPORT_BATCH_SIZE):
+            attendance_rate = 0
+            if course.sessions > 0 and course.enrolled > 0:
+                attendance_rate = round((course.attendance / (course.sessions * course.enrolled)) * 100, 1)
+            
+            yield [
+                course.code,
+                course.name,
+                course.lecturer_name or 'N/A',
+                course.enrolled,
+                course.sessions,
+                course.attendance,
+                f"{attendance_rate}%"
+            ]
+    
+    # Streamed as it is read
+    return csv_response(
+        'trackademia_reports.csv',
+        rows(),
+        header=['Course Code', 'Course Name', 'Lecturer', 'Enrolled', 'Sessions', 'Attendance', 'Attendance Rate']
     )
 
 @app.route('/admin/reports/export')
@@ -793,57 +974,92 @@ def export_reports():
         flash('Access denied. Admin privileges required.', 'error')
         return redirect(url_for('login'))
     
-    # Create CSV data
-    output = io.StringIO()  # Changed from BytesIO to StringIO
-    writer = csv.writer(output, delimiter=',')
-    
-    # Write header
-    writer.writerow(['Course Name', 'Sessions', 'Attendance Records', 'Average Attendance'])
+    # scope: courses (default), students (per student and course) or attendance (every mark)
+    scope = request.args.get('scope', 'courses')
     
-    # Get all courses
-    courses = db.session.query(Course).all()
-    
-    # Write data for each course
-    for course in courses:
-        course_sessions = len(course.sessions)
-        course_attendance = 0
+    if scope == 'students':
+        query = student_attendance_query()
         
-        for session in course.sessions:
-            course_attendance += len(session.attendance_records)
+        def student_rows():
+            for row in query.yield_per(EXPORT_BATCH_SIZE):
+                rate = round(row.attended / row.total * 100, 1) if row.total > 0 else 0
+                yield [row.student_id, row.name, row.code, row.course_name,
+                       row.total, row.attended, row.excused, f"{rate}%"]
         
-        # Calculate average attendance per session
-        avg_attendance = 0
-        if course_sessions > 0:
-            avg_attendance = course_attendance / course_sessions
-        
-        writer.writerow([
-            course.name,
-            course_sessions,
-            course_attendance,
-            f"{avg_attendance:.1f}"
-        ])
-    
-    # Add summary row
-    writer.writerow([])  # Empty row
-    writer.writerow(['SUMMARY', '', '', ''])
-    total_sessions = db.session.query(SessionModel).count()  # Fixed: SessionModel instead of session
-    total_attendance = db.session.query(Attendance).count()
-    writer.writerow(['Total Sessions', total_sessions, '', ''])
-    writer.writerow(['Total Attendance Records', total_attendance, '', ''])
+        return csv_response(
+            'trackademia_student_attendance.csv',
+            student_rows(),
+            header=['Student ID', 'Student Name', 'Course Code', 'Course Name',
+                    'Past Sessions', 'Attended', 'Excused', 'Attendance Rate']
+        )
     
-    # Prepare response
-    output.seek(0)
+    if scope == 'attendance':
+        try:
+            date_from = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else None
+            date_to = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else None
+        except ValueError:
+            flash('Dates must be given as YYYY-MM-DD', 'error')
+            return redirect(url_for('admin_reports'))
+        query = attendance_record_query(
+            course_id=request.args.get('course_id', type=int),
+            date_from=date_from,
+            date_to=date_to
+        )
+        
+        def attendance_rows():
+            for row in query.yield_per(EXPORT_BATCH_SIZE):
+                yield [
+                    row.date.isoformat() if row.date else '',
+                    row.start_time.strftime('%H:%M') if row.start_time else '',
+                    row.code,
+                    row.session_name,
+                    row.student_id,
+                    row.student_name,
+                    row.status,
+                    row.timestamp.strftime('%Y-%m-%d %H:%M:%S') if row.timestamp else '',
+                    row.verified_by or ''
+                ]
+        
+        return csv_response(
+            'trackademia_attendance.csv',
+            attendance_rows(),
+            header=['Date', 'Start Time', 'Course Code', 'Session', 'Student ID', 'Student Name',
+                    'Status', 'Checked In', 'Verified By']
+        )
     
-    # Convert to bytes
-    csv_bytes = output.getvalue().encode('utf-8')
+    if scope != 'courses':
+        flash(f'Unknown export: {scope}', 'error')
+        return redirect(url_for('admin_reports'))
     
-    return send_file(
-        io.BytesIO(csv_bytes),
-        as_attachment=True,
-        download_name='trackademia_reports.csv',
-        mimetype='text/csv'
+    def course_rows():
+        # Write data for each course
+        for course in course_report_query().yield_per(EXPORT_BATCH_SIZE):
+            course_sessions = course.sessions
+            course_attendance = course.attendance
+            
+            # Calculate average attendance per session
+            avg_attendance = 0
+            if course_sessions > 0:
+                avg_attendance = course_attendance / course_sessions
+            
+            yield [
+                course.name,
+                course_sessions,
+                course_attendance,
+                f"{avg_attendance:.1f}"
+            ]
+        
+        # Add summary row
+        yield []  # Empty row
+        yield ['SUMMARY', '', '', '']
+        yield ['Total Sessions', db.session.query(SessionModel).count(), '', '']
+        yield ['Total Attendance Records', db.session.query(Attendance).count(), '', '']
+    
+    return csv_response(
+        'trackademia_reports.csv',
+        course_rows(),
+        header=['Course Name', 'Sessions', 'Attendance Records', 'Average Attendance']
     )
-    
 
 @app.route('/api/reports/custom')
 def custom_report():
@@ -867,23 +1083,20 @@ def custom_report():
 @app.route('/lecturer/dashboard')
 def lecturer_dashboard():
     lecturer_id = flask_session.get('user_id')
-    lecturer = db.session.query(Lecturer).filter_by(user_id=lecturer_id).first()
+    lecturer = lecturer_for_user(lecturer_id)
     
     if not lecturer:
         flask_session.clear()
         return redirect(url_for('login'))
     
-    courses = db.session.query(Course).filter_by(lecturer_id=lecturer.id).all()
+    courses = lecturer_courses(lecturer.id)
     total_sessions = db.session.query(SessionModel).filter_by(lecturer_id=lecturer.id).count()
     
     total_students = 0
     for course in courses:
         total_students += len(course.students)
     
-    active_sessions = db.session.query(SessionModel).filter_by(
-        lecturer_id=lecturer.id, 
-        status='active'
-    ).all()
+    active_sessions = lecturer_active_sessions(lecturer.id)
     
     return render_template('lecturer_dashboard.html', 
                          lecturer=lecturer,
@@ -920,7 +1133,22 @@ def create_session():
             flash('Please capture the lecture room location first', 'error')
             return render_template('create_session.html', 
                                  courses=courses,
+                                 campus_networks=cidr_registry.names(),
                                  error='Please capture the lecture room location first')
+        
+        # Reject unknown network names and malformed ranges now, not at check-in
+        if allowed_ip_range:
+            ip_range_error = cidr_registry.validate(allowed_ip_range)
+            max_length = SessionModel.allowed_ip_range.type.length
+            if not ip_range_error and len(allowed_ip_range) > max_length:
+                ip_range_error = (f'the list is longer than {max_length} characters; '
+                                  f'register the ranges as a campus network and use its name')
+            if ip_range_error:
+                flash(f'Invalid allowed network: {ip_range_error}', 'error')
+                return render_template('create_session.html', 
+                                     courses=courses,
+                                     campus_networks=cidr_registry.names(),
+                                     error=f'Invalid allowed network: {ip_range_error}')
 
         new_session = SessionModel(
             course_id=int(course_id),
@@ -942,7 +1170,7 @@ def create_session():
         flash('Session created successfully', 'success')
         return redirect(url_for('my_sessions'))
     
-    return render_template('create_session.html', courses=courses)
+    return render_template('create_session.html', courses=courses, campus_networks=cidr_registry.names())
 
 @app.route('/lecturer/my-sessions')
 def my_sessions():
@@ -956,28 +1184,13 @@ def my_sessions():
     # Get all sessions for this lecturer
     sessions = db.session.query(SessionModel).filter_by(lecturer_id=lecturer.id).order_by(SessionModel.date.desc(), SessionModel.start_time.desc()).all()
     
-    # Categorize sessions
-    now = datetime.now()
-    for session_obj in sessions:
-        session_datetime = datetime.combine(session_obj.date, session_obj.start_time)
-        end_datetime = session_datetime + timedelta(minutes=session_obj.duration_minutes)
-        
-        if session_obj.status == 'active':
-            if now > end_datetime:
-                session_obj.status = 'past'
-                db.session.commit()
-        elif session_obj.status == 'upcoming':
-            if session_datetime <= now <= end_datetime:
-                session_obj.status = 'active'
-                db.session.commit()
-            elif now > end_datetime:
-                session_obj.status = 'past'
-                db.session.commit()
-    
+    # Statuses are kept current by session_lifecycle; this page only reads them
     return render_template('my_sessions.html', sessions=sessions)
 
 @app.route('/lecturer/attendance-report/<int:session_id>')
 def attendance_report(session_id):
+    # The live stream replays marks from here on, so none fall between render and connect
+    stream_since = datetime.now()
     lecturer_id = flask_session.get('user_id')
     lecturer = db.session.query(Lecturer).filter_by(user_id=lecturer_id).first()
     
@@ -997,7 +1210,7 @@ def attendance_report(session_id):
         return redirect(url_for('my_sessions'))
     
     # Get all students enrolled in the course
-    course_students = session_obj.course.students
+    course_students = course_roster(session_obj.course_id)
     
     # Get attendance records for this session
     attendance_records = db.session.query(Attendance).filter_by(session_id=session_id).all()
@@ -1026,13 +1239,69 @@ def attendance_report(session_id):
     absent_count = total_students - present_count
     attendance_rate = (present_count / total_students * 100) if total_students > 0 else 0
     
+    # Not passed as 'session', which base.html uses for the login session
     return render_template('attendance_report.html',
-                         session=session_obj,
+                         report_session=session_obj,
                          report_data=report_data,
                          total_students=total_students,
                          present_count=present_count,
                          absent_count=absent_count,
-                         attendance_rate=round(attendance_rate, 1))
+                         attendance_rate=round(attendance_rate, 1),
+                         stream_since=stream_since.isoformat())
+
+# Each open stream holds a worker thread for as long as the report page is
+# open, so a threaded WSGI server with N threads has N minus the open streams
+# left for every other request. ATTENDANCE_FEED_MAX_STREAMS caps the streams
+# per session; size the server's thread pool for the reports watched at once.
+@app.route('/api/sessions/<int:session_id>/attendance-stream')
+def attendance_stream(session_id):
+    """Server-Sent Events of a session's attendance marks for its lecturer's report page"""
+    lecturer = lecturer_for_user(flask_session.get('user_id'))
+    session_obj = db.session.get(SessionModel, session_id)
+    if not session_obj:
+        return jsonify({'success': False, 'message': 'Session not found'}), 404
+    if not lecturer or session_obj.lecturer_id != lecturer.id:
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    # A reconnecting browser resumes from the last mark it saw, a new page from when it was rendered
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        since = datetime.fromisoformat(since) if since else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid since timestamp'}), 400
+    
+    # Only the enrolled students have rows on the report, so only their marks are sent
+    roster = course_roster_ids(session_obj.course_id)
+    
+    # Subscribe before reading the backlog so no mark can fall between the two
+    subscription = attendance_feed.subscribe(session_id, roster, session_obj.course_id)
+    if subscription is None:
+        return jsonify({
+            'success': False,
+            'message': 'This report is already open in too many windows. Close one to get live updates.'
+        }), 429
+    backlog = []
+    if since is not None:
+        # Timestamps are taken when a mark is queued, up to the ack timeout before it is committed
+        since -= timedelta(seconds=app.config['ATTENDANCE_ACK_TIMEOUT'])
+        try:
+            backlog = [mark_event(*row) for row in db.session.query(
+                Attendance.student_id, Attendance.status, Attendance.timestamp, Attendance.latitude, Attendance.longitude
+            ).filter(
+                Attendance.session_id == session_id, Attendance.timestamp >= since, Attendance.student_id.in_(roster)
+            ).order_by(Attendance.timestamp)]
+        except Exception:
+            attendance_feed.unsubscribe(subscription)
+            raise
+    # The stream can stay open for the whole session; it must not hold a connection
+    db.session.close()
+    
+    response = Response(attendance_feed.stream(subscription, backlog), mimetype='text/event-stream')
+    # Free the stream's slot even if the client goes away before the first byte is sent
+    response.call_on_close(lambda: attendance_feed.unsubscribe(subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/api/session/update-status', methods=['POST'])
 def update_session_status():
@@ -1043,10 +1312,73 @@ def update_session_status():
     if session_obj:
         session_obj.status = new_status
         db.session.commit()
+        sessions_changed(session_obj)
         return jsonify({'success': True})
     
     return jsonify({'success': False}), 400
 
+@app.route('/api/sessions/advance', methods=['POST'])
+def advance_sessions():
+    """Bring every session's status up to date now instead of at the next scheduled run"""
+    if flask_session.get('user_type') not in ('admin', 'lecturer'):
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    started, ended = session_lifecycle.advance()
+    return jsonify({'success': True, 'started': started, 'ended': ended})
+
+@app.route('/api/notifications')
+def api_notifications():
+    """The current user's latest in-app notifications and how many are unread"""
+    user_id = flask_session.get('user_id')
+    delivered = db.session.query(Notification).filter(
+        Notification.user_id == user_id,
+        Notification.channel == 'in_app',
+        Notification.status == 'sent'
+    )
+    latest = delivered.order_by(Notification.id.desc()).limit(min(request.args.get('limit', 20, type=int), 100)).all()
+    return jsonify({
+        'success': True,
+        'unread': delivered.filter(Notification.read_at.is_(None)).count(),
+        'notifications': [{
+            'id': notification.id,
+            'kind': notification.kind,
+            'subject': notification.subject,
+            'body': notification.body,
+            'session_id': notification.session_id,
+            'created_at': notification.created_at.isoformat(),
+            'read': notification.read_at is not None
+        } for notification in latest]
+    })
+
+@app.route('/api/notifications/read', methods=['POST'])
+def api_notifications_read():
+    """Mark the given in-app notifications read, or all of them when no ids are sent"""
+    data = request.get_json(silent=True)
+    if data is None and not request.get_data():
+        data = {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'Request body must be a JSON object'}), 400
+    ids = data.get('ids')
+    if ids is not None and (not isinstance(ids, list) or
+                            not all(isinstance(i, int) and not isinstance(i, bool) for i in ids)):
+        return jsonify({'success': False, 'message': 'ids must be a list of notification ids'}), 400
+    unread = db.session.query(Notification).filter(
+        Notification.user_id == flask_session.get('user_id'),
+        Notification.channel == 'in_app',
+        Notification.read_at.is_(None)
+    )
+    if ids:
+        unread = unread.filter(Notification.id.in_(ids))
+    marked = unread.update({'read_at': datetime.now()}, synchronize_session=False)
+    db.session.commit()
+    return jsonify({'success': True, 'marked': marked})
+
+@app.route('/api/admin/notifications/metrics')
+def api_notification_metrics():
+    if flask_session.get('user_type') != 'admin':
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    return jsonify({'success': True, **notification_outbox.metrics()})
+
 @app.route('/lecturer/manage-students/<int:course_id>')
 def manage_students(course_id):
     lecturer_id = flask_session.get('user_id')
@@ -1063,14 +1395,37 @@ def manage_students(course_id):
         flash('You do not have permission to manage this course', 'error')
         return redirect(url_for('lecturer_dashboard'))
     
-    all_students = db.session.query(Student).all()
-    
-    # Get students not in this course
-    available_students = [s for s in all_students if s not in course.students]
+    # Students who can be added are loaded page by page from /api/courses/<id>/available-students
+    return render_template('manage_students.html', course=course)
+
+@app.route('/api/courses/<int:course_id>/available-students')
+def api_available_students(course_id):
+    course = db.session.get(Course, course_id)
+    if not course:
+        return jsonify({'success': False, 'message': 'Course not found'}), 404
     
-    return render_template('manage_students.html', 
-                         course=course,
-                         available_students=available_students)
+    # Admins, and the lecturer who teaches the course
+    if flask_session.get('user_type') != 'admin':
+        lecturer = lecturer_for_user(flask_session.get('user_id'))
+        if not lecturer or course.lecturer_id != lecturer.id:
+            return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    students, next_cursor = available_students(
+        course_id,
+        cursor=request.args.get('cursor'),
+        limit=min(max(request.args.get('limit', 25, type=int), 1), 100),
+        matching=search_index.student_filter(request.args.get('q', ''))
+    )
+    return jsonify({
+        'success': True,
+        'students': [{
+            'id': student.id,
+            'student_id': student.student_id,
+            'name': user.name,
+            'major': student.major
+        } for student, user in students],
+        'next_cursor': next_cursor
+    })
 
 @app.route('/api/course/add-student', methods=['POST'])
 def add_student_to_course():
@@ -1196,8 +1551,8 @@ def mark_attendance():
     for course in student.courses:
         for session_obj in course.sessions:
             if session_obj.status == 'active':
-                # Check if already marked attendance
-                existing = db.session.query(Attendance).filter_by(
+                # Check if already marked attendance (a queued mark counts as marked)
+                existing = attendance_queue.pending(student.id, session_obj.id) or db.session.query(Attendance).filter_by(
                     student_id=student.id,
                     session_id=session_obj.id
                 ).first()
@@ -1241,21 +1596,63 @@ def api_student_details(student_id):
         }
     })
 
-from location_check import check_attendance_location
+@app.route('/api/search')
+def api_search():
+    user_type = flask_session.get('user_type')
+    if user_type not in ('admin', 'lecturer'):
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    # Lecturers may look up students and courses only
+    allowed = list(SEARCH_KINDS) if user_type == 'admin' else ['student', 'course']
+    kinds = [kind for kind in request.args.get('type', '').split(',') if kind]
+    if any(kind not in SEARCH_KINDS for kind in kinds):
+        return jsonify({'success': False, 'message': 'Invalid type'}), 400
+    if any(kind not in allowed for kind in kinds):
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    results = search_index.search(
+        request.args.get('q', ''),
+        kinds=kinds or allowed,
+        limit=max(request.args.get('limit', 0, type=int), 0) or None
+    )
+    return jsonify({'success': True, 'results': results})
 
 @app.route('/api/attendance/mark', methods=['POST'])
 def mark_attendance_api():
+    session_id = request.json.get('session_id')
+    
     student_id = flask_session.get('user_id')
     student = db.session.query(Student).filter_by(user_id=student_id).first()
-    session_id = request.json.get('session_id')
     
     if not student:
         return jsonify({'success': False, 'message': 'Access denied'}), 403
     
-    # Get session
-    session_obj = db.session.get(SessionModel, session_id)
+    # Get session verification parameters (cached while the session is active)
+    geofence = geofence_cache.get(session_id)
+    if not geofence:
+        return jsonify({'success': False, 'message': 'Session not found'}), 404
+    
+    try:
+        mark, distance = queue_check_in(student.id, geofence, request.json, request.remote_addr)
+    except CheckInRefused as refused:
+        return check_in_refused_response(refused)
+    
+    # Give the connection back to the pool so the writer is never starved of one,
+    # then only acknowledge once the group commit holding this mark is durable
+    db.session.close()
+    mark.wait(app.config['ATTENDANCE_ACK_TIMEOUT'])
+    status, body = check_in_result(mark, distance)
+    return jsonify(body), status
+
+@app.route('/api/attendance/locate', methods=['POST'])
+def locate_session_api():
+    """Find the active session a student is at from their coordinates alone"""
+    student_id = flask_session.get('user_id')
+    student = db.session.query(Student).filter_by(user_id=student_id).first()
+    
+    if not student:
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
     
-    # 1. Get student's location from browser
     student_lat = request.json.get('latitude')
     student_lon = request.json.get('longitude')
     accuracy = request.json.get('accuracy')
@@ -1266,71 +1663,30 @@ def mark_attendance_api():
             'message': 'Could not get your location. Please enable location services.'
         }), 400
     
-    # 2. Check location - make sure session has coordinates
-    if not session_obj.latitude or not session_obj.longitude:
+    if accuracy and float(accuracy) > app.config['LOCATE_MAX_ACCURACY']:
         return jsonify({
             'success': False,
-            'message': 'This session does not have location data configured.'
+            'message': 'Your location is too imprecise to find your session. Please pick it from the list.'
         }), 400
     
-    is_within_range, distance = check_attendance_location(
-        student_lat, student_lon,
-        session_obj.latitude, session_obj.longitude,
-        session_obj.allowed_distance_meters,
-        accuracy
-    )
-    
-    # 3. Optional: Check network (simplified)
-    ip_valid = True
-    if session_obj.allowed_ip_range:
-        client_ip = request.remote_addr
-        try:
-            network = ipaddress.ip_network(session_obj.allowed_ip_range)
-            ip_valid = ipaddress.ip_address(client_ip) in network
-        except:
-            ip_valid = False
-    
-    # 4. Mark attendance if valid
-    if is_within_range and ip_valid:
-        # Check if already marked attendance
-        existing = db.session.query(Attendance).filter_by(
-            student_id=student.id,
-            session_id=session_id
-        ).first()
-        
-        if existing:
-            return jsonify({
-                'success': False,
-                'message': 'You have already marked attendance for this session.'
-            }), 400
-        
-        attendance = Attendance(
-            student_id=student.id,
-            session_id=session_id,
-            latitude=student_lat,
-            longitude=student_lon,
-            status='present',
-            verified_by='system',
-            timestamp=datetime.now()  # Changed from datetime.utcnow()
-        )
-        db.session.add(attendance)
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'message': f'Attendance marked! You were {distance:.1f}m from the lecture room.',
-            'distance': distance,
-            'timestamp': attendance.timestamp.strftime('%Y-%m-%d %H:%M:%S')  # Add formatted timestamp
-        })
-    else:
+    geofence, distance = session_locator.locate(student.id, student_lat, student_lon, accuracy)
+    if not geofence:
         return jsonify({
             'success': False,
-            'message': f'Cannot mark attendance: {"Too far from lecture room" if not is_within_range else "Not on campus network"}',
-            'distance': distance,
-            'max_allowed': session_obj.allowed_distance_meters,
-            'within_range': is_within_range,
-            'network_valid': ip_valid
-        }), 403
+            'message': 'No active session of yours was found at your location.'
+        }), 404
+    
+    session_obj = db.session.get(SessionModel, geofence.session_id)
+    return jsonify({
+        'success': True,
+        'session': {
+            'id': session_obj.id,
+            'name': session_obj.name,
+            'course_name': session_obj.course.name,
+            'location': session_obj.location,
+            'distance': distance
+        }
+    })
 
 @app.route('/student/attendance-analytics')
 def attendance_analytics():
@@ -1341,17 +1697,14 @@ def attendance_analytics():
         flash('Please login as a student', 'error')
         return redirect(url_for('login'))
     
-    # Calculate attendance statistics
+    # Attendance statistics from the per-course summaries
     analytics = []
+    summaries = summaries_for(student.id, [course.id for course in student.courses])
     for course in student.courses:
+        summary = summaries.get(course.id)
         # Count only past sessions
-        past_sessions = [s for s in course.sessions if s.status == 'past']
-        total_sessions = len(past_sessions)
-        
-        attended_sessions = db.session.query(Attendance).filter_by(
-            student_id=student.id,
-            status='present'
-        ).join(SessionModel).filter(SessionModel.course_id == course.id).count()
+        total_sessions = summary.total if summary else 0
+        attended_sessions = summary.attended if summary else 0
         
         percentage = (attended_sessions / total_sessions * 100) if total_sessions > 0 else 0
         
@@ -1364,74 +1717,15 @@ def attendance_analytics():
     
     return render_template('attendance_analytics.html', analytics=analytics)
 
-import threading
-import time
-from datetime import datetime, timedelta
-
-def check_upcoming_sessions():
-    """Check for sessions starting in 15 minutes and send notifications"""
-    with app.app_context():
-        try:
-            now = datetime.now()
-            time_threshold = now + timedelta(minutes=15)
-            
-            # Find sessions starting within the next 15 minutes
-            upcoming_sessions = db.session.query(SessionModel).filter(
-                SessionModel.status == 'upcoming',
-                SessionModel.date == now.date(),
-                SessionModel.start_time.between(
-                    now.time(),
-                    time_threshold.time()
-                )
-            ).all()
-            
-            for session in upcoming_sessions:
-                # For each student in the course
-                for student in session.course.students:
-                    # Here you would implement actual notification logic
-                    # For now, we'll just log it
-                    print(f"NOTIFICATION: {student.user.name} - {session.course.name} starts in 15 minutes at {session.start_time}")
-                    
-                    # You could add this to a notifications table:
-                    # notification = Notification(
-                    #     user_id=student.user_id,
-                    #     message=f"Upcoming: {session.course.name} ({session.name}) starts in 15 minutes",
-                    #     type='reminder',
-                    #     created_at=datetime.utcnow()
-                    # )
-                    # db.session.add(notification)
-            
-            db.session.commit()
-            
-        except Exception as e:
-            print(f"Error checking upcoming sessions: {e}")
-
-# Add this to run the notification checker in a separate thread
-def start_notification_checker():
-    """Start background thread to check for notifications"""
-    def notification_loop():
-        while True:
-            check_upcoming_sessions()
-            time.sleep(60)  # Check every minute
-    
-    thread = threading.Thread(target=notification_loop, daemon=True)
-    thread.start()
-
-# Call this after app initialization in main
-if __name__ == '__main__':
-    start_notification_checker()  # Add this line
-    # ... rest of your code
-
 def initialize_database():
     """Initialize the database tables and data"""
     with app.app_context():
-        # Drop all tables (for development)
-        db.drop_all()
-        print("Dropped all tables")
-        
-        # Create all tables
+        # Create missing tables, then bring existing ones up to the current schema
         db.create_all()
-        print("Created all tables")
+        applied = migrate()
+        if applied:
+            print(f"Applied migrations: {', '.join(map(str, applied))}")
+        print("Database schema is up to date")
         
         # Check if we need to create demo data
         from database import create_demo_data
@@ -0,0 +1,327 @@
+"""
+Columnar attendance archive for analytics.
+
+Writes every attendance mark, joined with its session, course and student,
+to Parquet files under ARCHIVE_DIR laid out as a Hive-partitioned dataset:
+
+    attendance/semester=Fall%202024/course_code=COMP2140/part-000000000001-000000004096-000001.parquet
+
+so tools such as pyarrow.dataset, DuckDB, Spark or pandas read one term or
+one course, and only the columns they ask for, without scanning the rest.
+Partition values are URI-encoded in the path and are not repeated inside
+the files.
+
+Runs are incremental. attendance/_watermark.json records the highest
+attendance id archived, and each run appends the marks after it as new part
+files, reading them in id order with yield_per. Ids are handed out before
+commit, so with several writers (PostgreSQL workers, the ASGI check-in
+service) a lower id can commit after a higher one was archived. Every id
+below the watermark that had no row yet is kept in the watermark file as a
+gap and re-read on each run until its row shows up or ARCHIVE_GAP_TIMEOUT
+seconds have passed (the transaction rolled back, or the insert was skipped
+as a duplicate). Part files are written
+under a temporary name and renamed when complete, and the watermark moves
+only after every file of the run is in place; a failed run's leftovers are
+removed by the next one. The archive is append-only: marks edited or
+deleted after they were archived are not revisited, so rebuild with --full
+(e.g. at the end of term) for an exact copy.
+
+Requires pyarrow (pip install pyarrow).
+
+    python archive_export.py [--full]
+"""
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Only the archive needs pyarrow
+    pa = pq = None
+
+from sqlalchemy import and_, func, or_
+
+from csv_export import EXPORT_BATCH_SIZE
+from database import db, User, Student, Course, Session, Attendance
+
+DATASET = 'attendance'
+WATERMARK_FILE = '_watermark.json'
+
+# Hive's name for a partition whose value is NULL
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('The attendance archive requires pyarrow (pip install pyarrow)')
+    return pa
+
+
+def archive_schema():
+    """Columns of the archived files, in order"""
+    _require_pyarrow()
+    return pa.schema([
+        ('attendance_id', pa.int64()),
+        ('status', pa.string()),
+        ('checked_in_at', pa.timestamp('us')),
+        ('verified_by', pa.string()),
+        ('latitude', pa.float64()),
+        ('longitude', pa.float64()),
+        ('session_id', pa.int64()),
+        ('session_name', pa.string()),
+        ('session_date', pa.date32()),
+        ('session_start', pa.time64('us')),
+        ('duration_minutes', pa.int32()),
+        ('course_id', pa.int64()),
+        ('course_name', pa.string()),
+        ('student_id', pa.int64()),
+        ('student_number', pa.string()),
+        ('student_name', pa.string()),
+        ('major', pa.string()),
+        ('enrollment_year', pa.int32()),
+    ])
+
+
+def archive_rows(after_id, up_to_id, gaps=()):
+    """
+    Attendance marks with after_id < id <= up_to_id, or inside one of the
+    (first, last) id ranges in gaps, and their dimensions, in id order
+    """
+    ranges = [and_(Attendance.id > after_id, Attendance.id <= up_to_id)]
+    ranges += [Attendance.id.between(first, last) for first, last in gaps]
+    return db.session.query(
+        Attendance.id.label('attendance_id'),
+        Attendance.status,
+        Attendance.timestamp.label('checked_in_at'),
+        Attendance.verified_by,
+        Attendance.latitude,
+        Attendance.longitude,
+        Session.id.label('session_id'),
+        Session.name.label('session_name'),
+        Session.date.label('session_date'),
+        Session.start_time.label('session_start'),
+        Session.duration_minutes,
+        Course.id.label('course_id'),
+        Course.name.label('course_name'),
+        Student.id.label('student_id'),
+        Student.student_id.label('student_number'),
+        User.name.label('student_name'),
+        Student.major,
+        Student.enrollment_year,
+        # Partition keys
+        Course.semester,
+        Course.code
+    ).join(Session, Attendance.session_id == Session.id).join(
+        Course, Session.course_id == Course.id
+    ).join(Student, Attendance.student_id == Student.id).join(
+        User, Student.user_id == User.id
+    ).filter(or_(*ranges)).order_by(Attendance.id)
+
+
+def _partition_dir(root, semester, course_code):
+    def segment(name, value):
+        return f"{name}={quote(value, safe='') if value else NULL_PARTITION}"
+    
+    return os.path.join(root, segment('semester', semester), segment('course_code', course_code))
+
+
+class _PartitionWriter:
+    """Buffers one partition's rows and writes them to a part file in row groups"""
+    
+    def __init__(self, path, schema, row_group_size, compression):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.columns = {name: [] for name in schema.names}
+        self.rows = 0
+        self.buffered = 0
+        self._writer = None
+    
+    def append(self, row):
+        for name, values in self.columns.items():
+            values.append(row[name])
+        self.rows += 1
+        self.buffered += 1
+        if self.buffered >= self.row_group_size:
+            self.flush()
+    
+    def flush(self):
+        if not self.buffered:
+            return
+        if self._writer is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._writer = pq.ParquetWriter(self.tmp_path, self.schema, compression=self.compression)
+        self._writer.write_table(pa.table(self.columns, schema=self.schema))
+        self.columns = {name: [] for name in self.schema.names}
+        self.buffered = 0
+    
+    def close(self):
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+    
+    def commit(self):
+        os.replace(self.tmp_path, self.path)
+    
+    def discard(self):
+        if self._writer is not None:
+            self._writer.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class AttendanceArchive:
+    """Incremental Parquet export of attendance, partitioned by semester and course"""
+    
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('ARCHIVE_DIR', os.path.join(app.instance_path, 'archive'))
+        app.config.setdefault('ARCHIVE_ROW_GROUP_SIZE', 65536)
+        # Rows held in memory across all partitions before every partition is flushed
+        app.config.setdefault('ARCHIVE_MAX_BUFFERED_ROWS', 262144)
+        app.config.setdefault('ARCHIVE_COMPRESSION', 'zstd')
+        # Seconds an id below the watermark without a row is re-read before it is given up on
+        app.config.setdefault('ARCHIVE_GAP_TIMEOUT', 3600)
+        app.extensions['attendance_archive'] = self
+        self.app = app
+    
+    @property
+    def root(self):
+        return os.path.join(self.app.config['ARCHIVE_DIR'], DATASET)
+    
+    def _state(self):
+        try:
+            with open(os.path.join(self.root, WATERMARK_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'last_attendance_id': 0}
+    
+    def watermark(self):
+        """The last archived attendance id, 0 if nothing has been archived"""
+        return self._state()['last_attendance_id']
+    
+    def gaps(self):
+        """[first id, last id, first seen] of the id ranges below the watermark still waiting for rows"""
+        return self._state().get('gaps', [])
+    
+    def _save_watermark(self, run, last_id, gaps, rows):
+        path = os.path.join(self.root, WATERMARK_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({
+                'runs': run,
+                'last_attendance_id': last_id,
+                'gaps': gaps,
+                'rows_in_last_run': rows,
+                'updated_at': datetime.utcnow().isoformat()
+            }, f)
+        os.replace(path + '.tmp', path)
+    
+    def _remove_leftovers(self, run):
+        """Part files of an earlier attempt at this run that never moved the watermark"""
+        suffix = f'-{run:06d}.parquet'
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if (name.startswith('part-') and name.endswith(suffix)) or name.endswith('.parquet.tmp'):
+                    os.remove(os.path.join(directory, name))
+    
+    def export(self, full=False):
+        """
+        Archive attendance marks added since the last run (all of them with
+        full=True, replacing the archive). Returns the number of rows written.
+        """
+        _require_pyarrow()
+        config = self.app.config
+        if full and os.path.isdir(self.root):
+            shutil.rmtree(self.root)
+        os.makedirs(self.root, exist_ok=True)
+    
+        now = datetime.utcnow()
+        state = self._state()
+        after_id = state['last_attendance_id']
+        old_gaps = state.get('gaps', [])
+        # Marks added while the run is in progress are left for the next one
+        up_to_id = max(db.session.query(func.max(Attendance.id)).scalar() or 0, after_id)
+        if up_to_id == after_id and not old_gaps:
+            return 0
+        run = state.get('runs', 0) + 1
+        self._remove_leftovers(run)
+    
+        schema = archive_schema()
+        part_name = f'part-{after_id + 1:012d}-{up_to_id:012d}-{run:06d}.parquet'
+        writers = {}
+        buffered = 0
+        new_gaps = []
+        filled = set()
+        next_id = after_id + 1
+        try:
+            for row in archive_rows(after_id, up_to_id, [gap[:2] for gap in old_gaps]).yield_per(EXPORT_BATCH_SIZE):
+                if row.attendance_id <= after_id:
+                    filled.add(row.attendance_id)
+                else:
+                    if row.attendance_id > next_id:
+                        new_gaps.append([next_id, row.attendance_id - 1, now.isoformat()])
+                    next_id = row.attendance_id + 1
+                key = (row.semester, row.code)
+                writer = writers.get(key)
+                if writer is None:
+                    writer = writers[key] = _PartitionWriter(
+                        os.path.join(_partition_dir(self.root, *key), part_name),
+                        schema, config['ARCHIVE_ROW_GROUP_SIZE'], config['ARCHIVE_COMPRESSION']
+                    )
+                writer.append(row._mapping)
+                buffered += 1
+                if buffered >= config['ARCHIVE_MAX_BUFFERED_ROWS']:
+                    for writer in writers.values():
+                        writer.flush()
+                    buffered = 0
+            for writer in writers.values():
+                writer.close()
+        except BaseException:
+            for writer in writers.values():
+                writer.discard()
+            raise
+    
+        if next_id <= up_to_id:
+            new_gaps.append([next_id, up_to_id, now.isoformat()])
+    
+        for writer in writers.values():
+            writer.commit()
+        rows = sum(writer.rows for writer in writers.values())
+        gaps = _remaining_gaps(old_gaps, filled, now - timedelta(seconds=config['ARCHIVE_GAP_TIMEOUT'])) + new_gaps
+        self._save_watermark(run, up_to_id, gaps, rows)
+        return rows
+
+
+def _remaining_gaps(gaps, filled, expired_before):
+    """Gaps with the filled ids taken out, dropping those first seen before expired_before"""
+    remaining = []
+    for first, last, seen in gaps:
+        if datetime.fromisoformat(seen) < expired_before:
+            continue
+        for attendance_id in sorted(i for i in filled if first <= i <= last):
+            if attendance_id > first:
+                remaining.append([first, attendance_id - 1, seen])
+            first = attendance_id + 1
+        if first <= last:
+            remaining.append([first, last, seen])
+    return remaining
+
+
+if __name__ == '__main__':
+    import sys
+    
+    from app import app, attendance_archive
+    
+    with app.app_context():
+        written = attendance_archive.export(full='--full' in sys.argv[1:])
+        print(f"Archived {written} attendance rows to {attendance_archive.root} "
+              f"(up to id {attendance_archive.watermark()})")
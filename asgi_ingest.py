@@ -0,0 +1,194 @@
+"""
+Asyncio (ASGI) ingestion service for /api/attendance/mark.
+
+Runs next to the Flask app, which keeps serving the HTML pages and the rest of
+the API. Put both behind one reverse proxy and route only the check-in
+endpoint here, e.g. with nginx:
+
+    location = /api/attendance/mark { proxy_pass http://127.0.0.1:8001; }
+    location / { proxy_pass http://127.0.0.1:5000; }
+
+and start it with any ASGI server:
+
+    SECRET_KEY=... uvicorn asgi_ingest:application --port 8001
+
+Both processes must use the same SECRET_KEY so the Flask login cookie is
+accepted here. Check-ins go through the same checks as the Flask route
+(queue_check_in) and the same write-behind queue stores them in group
+commits; a check-in waits for its mark as a coroutine, so a burst of
+thousands of in-flight check-ins costs a coroutine each instead of a worker
+thread each.
+"""
+import asyncio
+import json
+import math
+import time
+from collections import OrderedDict
+from http.cookies import SimpleCookie
+
+from app import app as flask_app, geofence_cache, attendance_queue, queue_check_in, check_in_result, CheckInRefused
+from database import db, Student
+
+MARK_PATH = '/api/attendance/mark'
+MAX_BODY_BYTES = 64 * 1024
+
+
+class AttendanceIngestApp:
+    """ASGI application accepting check-ins and queueing them for the attendance writer"""
+    
+    def __init__(self, flask_app):
+        # Student ids of logged-in users, re-read after the TTL so deleted or changed students are noticed
+        flask_app.config.setdefault('INGEST_STUDENT_CACHE_TTL', 300)
+        flask_app.config.setdefault('INGEST_STUDENT_CACHE_SIZE', 10000)
+        self.flask_app = flask_app
+        self._students = OrderedDict()
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+    
+        if scope['path'] != MARK_PATH:
+            await self._respond(send, 404, {'success': False, 'message': 'Not found'})
+            return
+        if scope['method'] != 'POST':
+            await self._respond(send, 405, {'success': False, 'message': 'Method not allowed'})
+            return
+    
+        status, body = await self.mark_attendance(scope, receive)
+        headers = []
+        if status == 429:
+            headers.append((b'retry-after', str(max(1, math.ceil(body['retry_after']))).encode()))
+        await self._respond(send, status, body, headers)
+    
+    async def mark_attendance(self, scope, receive):
+        """Same checks and responses as the Flask mark_attendance_api route"""
+        user_id = self._session_user_id(scope)
+        student_id = await self._student_id(user_id) if user_id else None
+        if not student_id:
+            return 403, {'success': False, 'message': 'Access denied'}
+    
+        try:
+            data = json.loads(await self._read_body(receive) or b'{}')
+            session_id = int(data.get('session_id'))
+        except (ValueError, TypeError, AttributeError):
+            return 400, {'success': False, 'message': 'Invalid request'}
+    
+        # Get session verification parameters (cached while the session is active)
+        geofence = geofence_cache.cached(session_id)
+        if geofence is None:
+            geofence = await self._in_thread(geofence_cache.get, session_id)
+        if not geofence:
+            return 404, {'success': False, 'message': 'Session not found'}
+    
+        client = scope.get('client')
+        try:
+            mark, distance = queue_check_in(student_id, geofence, data, client[0] if client else None)
+        except CheckInRefused as refused:
+            return refused.status, refused.body
+    
+        # Wait for the group commit without holding a thread
+        loop = asyncio.get_running_loop()
+        resolved = loop.create_future()
+        mark.add_done_callback(lambda mark: _wake(loop, resolved))
+        try:
+            await asyncio.wait_for(resolved, self.flask_app.config['ATTENDANCE_ACK_TIMEOUT'])
+        except asyncio.TimeoutError:
+            pass
+        return check_in_result(mark, distance)
+    
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # Let the writer flush everything already queued
+                await asyncio.to_thread(attendance_queue.close)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    
+    def _session_user_id(self, scope):
+        """Read user_id from the Flask session cookie"""
+        cookie_name = self.flask_app.config['SESSION_COOKIE_NAME']
+        for name, value in scope.get('headers', []):
+            if name == b'cookie':
+                cookies = SimpleCookie(value.decode('latin-1'))
+                if cookie_name in cookies:
+                    serializer = self.flask_app.session_interface.get_signing_serializer(self.flask_app)
+                    try:
+                        data = serializer.loads(
+                            cookies[cookie_name].value,
+                            max_age=int(self.flask_app.permanent_session_lifetime.total_seconds())
+                        )
+                    except Exception:
+                        return None
+                    return data.get('user_id')
+        return None
+    
+    async def _student_id(self, user_id):
+        config = self.flask_app.config
+        entry = self._students.get(user_id)
+        if entry is not None and time.monotonic() - entry[1] < config['INGEST_STUDENT_CACHE_TTL']:
+            self._students.move_to_end(user_id)
+            return entry[0]
+    
+        def lookup():
+            row = db.session.query(Student.id).filter_by(user_id=user_id).first()
+            return row[0] if row else None
+        student_id = await self._in_thread(lookup)
+        if student_id is None:
+            self._students.pop(user_id, None)
+            return None
+        self._students[user_id] = (student_id, time.monotonic())
+        self._students.move_to_end(user_id)
+        # Least recently used first
+        while len(self._students) > config['INGEST_STUDENT_CACHE_SIZE']:
+            self._students.popitem(last=False)
+        return student_id
+    
+    async def _read_body(self, receive):
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if len(body) > MAX_BODY_BYTES:
+                raise ValueError('Request body too large')
+            if not message.get('more_body'):
+                return body
+    
+    async def _in_thread(self, func, *args):
+        """Run blocking database work in a worker thread inside an app context"""
+        def call():
+            with self.flask_app.app_context():
+                return func(*args)
+        return await asyncio.to_thread(call)
+    
+    async def _respond(self, send, status, body, headers=()):
+        payload = json.dumps(body).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(payload)).encode()),
+                *headers,
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': payload})
+
+
+def _wake(loop, future):
+    """Resolve a waiting check-in's future from the writer thread"""
+    def resolve():
+        if not future.done():
+            future.set_result(None)
+    try:
+        loop.call_soon_threadsafe(resolve)
+    except RuntimeError:  # The event loop has already shut down
+        pass
+
+
+application = AttendanceIngestApp(flask_app)
@@ -0,0 +1,172 @@
+"""
+Live attendance feed for the lecturer's session report.
+
+AttendanceFeed is an in-process publish/subscribe hub keyed by session id.
+The attendance write queue publishes every mark once its group commit is
+durable, and /api/sessions/<id>/attendance-stream relays a session's marks
+to the report page as Server-Sent Events, so the page updates row by row
+instead of being reloaded.
+
+Marks recorded between the page render and the stream connecting (or while
+the browser reconnects) are replayed from the database, starting from the
+since timestamp or the Last-Event-ID the browser sends; the page applies
+each mark idempotently. A stream only carries marks of the students on
+the course's roster. Students enrolled in this process while it is open are
+added to it, and the page reloads once to show their row.
+
+Marks are only published live to streams in the process whose writer
+recorded them; marks written by another process (such as the ASGI check-in
+service) show up when the browser next reconnects.
+"""
+import json
+import queue
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from database import db, Course
+
+
+class Subscription:
+    """One stream's queue of events; closed when it falls too far behind"""
+    
+    def __init__(self, session_id, size, student_ids=None, course_id=None):
+        self.session_id = session_id
+        self.course_id = course_id
+        self.student_ids = student_ids
+        self.events = queue.Queue(maxsize=size)
+        self.closed = False
+    
+    def wants(self, event):
+        return self.student_ids is None or event['student_id'] in self.student_ids
+    
+    def get(self, timeout):
+        """The next event, or None if none arrived within timeout seconds"""
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AttendanceFeed:
+    """Fans attendance marks out to the streams watching their session"""
+    
+    def __init__(self, app=None):
+        self.app = None
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        # Seconds between keep-alive comments on an idle stream
+        app.config.setdefault('ATTENDANCE_FEED_HEARTBEAT', 15)
+        # Events a stream may have waiting before it is dropped and the browser reconnects
+        app.config.setdefault('ATTENDANCE_FEED_BUFFER', 1000)
+        # Open streams allowed per session; each one holds a server worker thread
+        app.config.setdefault('ATTENDANCE_FEED_MAX_STREAMS', 5)
+        app.extensions['attendance_feed'] = self
+        event.listen(Course.students, 'append', self._enrolled)
+        event.listen(db.session, 'after_flush', self._flushed)
+        event.listen(db.session, 'after_commit', self._committed)
+        event.listen(db.session, 'after_rollback', self._rolled_back)
+        self.app = app
+    
+    def subscribe(self, session_id, student_ids=None, course_id=None):
+        """
+        Watch a session's marks, only those of student_ids if given; students
+        later enrolled in course_id are added. Returns None if the session
+        already has ATTENDANCE_FEED_MAX_STREAMS streams.
+        """
+        subscription = Subscription(int(session_id), self.app.config['ATTENDANCE_FEED_BUFFER'],
+                                    frozenset(student_ids) if student_ids is not None else None, course_id)
+        with self._lock:
+            subscriptions = self._subscriptions.setdefault(subscription.session_id, set())
+            if len(subscriptions) >= self.app.config['ATTENDANCE_FEED_MAX_STREAMS']:
+                return None
+            subscriptions.add(subscription)
+        return subscription
+    
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.session_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.session_id]
+    
+    def enroll(self, course_id, student_id):
+        """Let the course's open streams carry a newly enrolled student's marks"""
+        with self._lock:
+            for subscriptions in self._subscriptions.values():
+                for subscription in subscriptions:
+                    if subscription.course_id == course_id and subscription.student_ids is not None:
+                        subscription.student_ids = subscription.student_ids | {student_id}
+    
+    def _enrolled(self, course, student, initiator):
+        session = object_session(course) or object_session(student)
+        if session is not None:
+            session.info.setdefault('enrolled', []).append((course, student))
+    
+    def _flushed(self, session, flush_context):
+        # Ids of new courses and students are only known once they are flushed
+        enrolled = session.info.pop('enrolled', None)
+        if enrolled:
+            session.info.setdefault('enrolled_ids', []).extend((course.id, student.id) for course, student in enrolled)
+    
+    def _committed(self, session):
+        for course_id, student_id in session.info.pop('enrolled_ids', ()):
+            self.enroll(course_id, student_id)
+    
+    def _rolled_back(self, session):
+        session.info.pop('enrolled', None)
+        session.info.pop('enrolled_ids', None)
+    
+    def publish(self, session_id, event):
+        """Send an event to every stream of the session, without blocking on slow ones"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(int(session_id), ()))
+        for subscription in subscriptions:
+            if not subscription.wants(event):
+                continue
+            try:
+                subscription.events.put_nowait(event)
+            except queue.Full:
+                subscription.closed = True
+    
+    def publish_marks(self, marks):
+        """Publish committed PendingMarks to their sessions' streams"""
+        for mark in marks:
+            self.publish(mark.session_id, mark_event(
+                mark.student_id, 'present', mark.timestamp, mark.latitude, mark.longitude
+            ))
+    
+    def stream(self, subscription, backlog=()):
+        """SSE text for a subscription: the backlog first, then live events until the client goes away"""
+        heartbeat = self.app.config['ATTENDANCE_FEED_HEARTBEAT']
+        try:
+            yield 'retry: 2000\n\n'
+            for mark in backlog:
+                yield format_event(mark)
+            while not subscription.closed:
+                mark = subscription.get(heartbeat)
+                # A comment line keeps proxies from closing an idle connection
+                yield format_event(mark) if mark is not None else ': keep-alive\n\n'
+        finally:
+            self.unsubscribe(subscription)
+
+
+def mark_event(student_id, status, timestamp, latitude, longitude):
+    return {
+        'student_id': student_id,
+        'status': status,
+        'timestamp': timestamp.isoformat(),
+        'marked_time': timestamp.strftime('%I:%M:%S %p'),
+        'location': f"{float(latitude):.6f}, {float(longitude):.6f}" if latitude is not None and longitude is not None else 'N/A',
+    }
+
+
+def format_event(event):
+    # The id lets a reconnecting browser resume from the last mark it saw
+    return f"id: {event['timestamp']}\nevent: mark\ndata: {json.dumps(event)}\n\n"
@@ -0,0 +1,231 @@
+"""
+Write-behind queue for attendance marks.
+
+When a session opens, every enrolled student checks in within the same minute.
+Instead of one commit (and one fsync) per request, validated marks are queued
+here and a single writer thread flushes them in group commits. A request is
+only acknowledged once the batch holding its mark has been committed, so an
+acknowledged mark is always durable.
+"""
+import atexit
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from attendance_summary import marks_recorded
+from database import db, Attendance, insert_or_ignore
+
+
+class PendingMark:
+    """A validated attendance mark waiting for its group commit"""
+    
+    def __init__(self, student_id, session_id, latitude, longitude, timestamp):
+        self.student_id = student_id
+        self.session_id = session_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.timestamp = timestamp
+        self.inserted = False
+        self.error = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._callback_lock = threading.Lock()
+    
+    def wait(self, timeout=None):
+        """Block until the mark has been committed (or failed); False on timeout"""
+        return self._done.wait(timeout)
+    
+    @property
+    def done(self):
+        return self._done.is_set()
+    
+    def add_done_callback(self, callback):
+        """Call callback(mark) from the writer thread once the mark is resolved, or now if it already is"""
+        with self._callback_lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+    
+    def as_row(self):
+        return {
+            'student_id': self.student_id,
+            'session_id': self.session_id,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'status': 'present',
+            'verified_by': 'system',
+            'timestamp': self.timestamp,
+        }
+    
+    def _resolve(self, inserted, error=None):
+        self.inserted = inserted
+        self.error = error
+        with self._callback_lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class AttendanceWriteQueue:
+    """
+    Collects attendance marks and writes them in size/time bounded batches.
+    
+    A batch is flushed as soon as ATTENDANCE_BATCH_SIZE marks are waiting or
+    ATTENDANCE_BATCH_DELAY seconds after the first mark of the batch arrived,
+    whichever comes first.
+    """
+    
+    def __init__(self, app=None, feed=None):
+        self.app = None
+        self.feed = feed
+        self._marks = deque()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._writer = None
+        self._closed = False
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('ATTENDANCE_BATCH_SIZE', 200)
+        app.config.setdefault('ATTENDANCE_BATCH_DELAY', 0.05)
+        app.config.setdefault('ATTENDANCE_ACK_TIMEOUT', 5.0)
+        app.extensions['attendance_queue'] = self
+        self.app = app
+        atexit.register(self.close)
+    
+    def submit(self, student_id, session_id, latitude, longitude):
+        """
+        Queue a validated mark. Returns the PendingMark to wait on, or None if
+        a mark for the same student and session is already waiting.
+        """
+        key = (int(student_id), int(session_id))
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Attendance queue is closed')
+            if key in self._pending:
+                return None
+            mark = PendingMark(key[0], key[1], latitude, longitude, datetime.now())
+            self._pending[key] = mark
+            self._marks.append(mark)
+            self._start_writer()
+            if len(self._marks) == 1 or len(self._marks) >= self.app.config['ATTENDANCE_BATCH_SIZE']:
+                self._wakeup.notify()
+        return mark
+    
+    def pending(self, student_id, session_id):
+        """Return the queued mark for a student and session, if it is not committed yet"""
+        with self._lock:
+            return self._pending.get((int(student_id), int(session_id)))
+    
+    def close(self):
+        """Flush everything still queued and stop the writer"""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+            writer = self._writer
+        if writer is not None:
+            writer.join()
+    
+    def _start_writer(self):
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._run, name='attendance-writer', daemon=True)
+            self._writer.start()
+    
+    def _next_batch(self):
+        batch_size = self.app.config['ATTENDANCE_BATCH_SIZE']
+        delay = self.app.config['ATTENDANCE_BATCH_DELAY']
+        with self._lock:
+            while not self._marks and not self._closed:
+                self._wakeup.wait()
+            # Hold the batch open briefly so concurrent check-ins share one commit
+            deadline = time.monotonic() + delay
+            while len(self._marks) < batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._wakeup.wait(remaining)
+            count = min(batch_size, len(self._marks))
+            return [self._marks.popleft() for _ in range(count)]
+    
+    def _run(self):
+        try:
+            while True:
+                batch = self._next_batch()
+                if not batch:
+                    return
+                try:
+                    with self.app.app_context():
+                        self._write(batch)
+                except Exception as e:
+                    # One bad batch must not take the writer (and every later check-in) down with it
+                    self.app.logger.exception('Attendance batch of %d marks failed', len(batch))
+                    self._fail(batch, e)
+        finally:
+            with self._lock:
+                self._writer = None
+                if self._marks and not self._closed:
+                    self._start_writer()
+    
+    def _write(self, batch):
+        inserted, errors = write_marks(batch)
+        with self._lock:
+            for mark in batch:
+                self._pending.pop((mark.student_id, mark.session_id), None)
+        for mark in batch:
+            key = (mark.student_id, mark.session_id)
+            mark._resolve(key in inserted, errors.get(id(mark)))
+        if self.feed is not None:
+            self.feed.publish_marks([mark for mark in batch if mark.inserted])
+    
+    def _fail(self, batch, error):
+        """Resolve the marks of a failed batch that are still waiting, so their requests do not hang"""
+        with self._lock:
+            for mark in batch:
+                key = (mark.student_id, mark.session_id)
+                if self._pending.get(key) is mark:
+                    del self._pending[key]
+        for mark in batch:
+            if not mark._done.is_set():
+                mark._resolve(False, error)
+
+
+def write_marks(batch):
+    """
+    Insert a batch of PendingMarks in one transaction. Needs an app context.
+    
+    Uses a single INSERT .. ON CONFLICT DO NOTHING; the keys it returns tell
+    which marks were new and which were already recorded. The new marks are
+    counted in the attendance summaries in the same transaction. Returns the
+    set of inserted (student_id, session_id) keys and a dict of errors by
+    id(mark).
+    """
+    statement = insert_or_ignore(Attendance, 'student_id', 'session_id').returning(
+        Attendance.student_id, Attendance.session_id
+    )
+    inserted = set()
+    errors = {}
+    try:
+        result = db.session.execute(statement, [mark.as_row() for mark in batch])
+        inserted.update(tuple(row) for row in result)
+        marks_recorded(db.session.connection(), inserted)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        inserted.clear()
+        # Retry one by one so a single bad mark does not fail the whole batch
+        for mark in batch:
+            try:
+                result = db.session.execute(statement, [mark.as_row()])
+                keys = {tuple(row) for row in result}
+                marks_recorded(db.session.connection(), keys)
+                db.session.commit()
+                inserted.update(keys)
+            except Exception as e:
+                db.session.rollback()
+                errors[id(mark)] = e
+    return inserted, errors
@@ -0,0 +1,239 @@
+"""
+Incrementally maintained attendance summaries.
+
+attendance_summaries holds, for each (student, course), the number of present
+and excused marks in the course's sessions and the number of the course's
+sessions that are past. The analytics pages read these rows by primary key
+instead of counting attendance per course on every view.
+
+There is one row per enrollment, so reading them never writes. The
+migrations fill rows for existing enrollments (fill), rows are added and
+removed in the same transaction as enrollments made or dropped through the
+ORM (enrollments_changed), and existing rows are kept current by adjusting
+their counts in the same transaction as the change:
+
+* marks inserted by the check-in writer (marks_recorded, called by write_marks)
+* Attendance rows inserted, updated or deleted through the ORM
+* Session rows moving into or out of 'past' through the ORM, or in bulk
+  (course_totals_changed)
+
+Bulk statements that bypass the ORM elsewhere can leave rows stale; rebuild
+recomputes every row from scratch:
+
+    python attendance_summary.py
+"""
+from sqlalchemy import and_, bindparam, event, exists, func, inspect, select, update
+from sqlalchemy.orm import object_session
+
+from database import db, Student, Course, Session, Attendance, AttendanceSummary, enrollments, insert_or_ignore
+
+summaries = AttendanceSummary.__table__
+
+# Attendance status -> summary column it is counted in
+COUNTED_STATUSES = {'present': 'attended', 'excused': 'excused'}
+
+_bump_statement = update(summaries).where(
+    summaries.c.student_id == bindparam('b_student_id'),
+    summaries.c.course_id == select(Session.course_id).where(
+        Session.id == bindparam('b_session_id')
+    ).scalar_subquery()
+).values(
+    attended=summaries.c.attended + bindparam('b_attended'),
+    excused=summaries.c.excused + bindparam('b_excused')
+)
+
+
+def _bump(connection, changes):
+    """Apply (student_id, session_id, status, delta) changes to existing summary rows"""
+    rows = []
+    for student_id, session_id, status, delta in changes:
+        column = COUNTED_STATUSES.get(status)
+        if column is None or student_id is None or session_id is None:
+            continue
+        rows.append({
+            'b_student_id': student_id,
+            'b_session_id': session_id,
+            'b_attended': delta if column == 'attended' else 0,
+            'b_excused': delta if column == 'excused' else 0,
+        })
+    if rows:
+        connection.execute(_bump_statement, rows)
+
+
+def marks_recorded(connection, keys, status='present'):
+    """Count newly inserted (student_id, session_id) marks"""
+    _bump(connection, [(student_id, session_id, status, 1) for student_id, session_id in keys])
+
+
+def course_totals_changed(connection, deltas):
+    """Adjust the past-session total of every summary row of the given {course_id: delta}"""
+    rows = [{'b_course_id': course_id, 'b_delta': delta} for course_id, delta in deltas.items() if delta]
+    if rows:
+        connection.execute(
+            update(summaries).where(summaries.c.course_id == bindparam('b_course_id')).values(
+                total=summaries.c.total + bindparam('b_delta')
+            ),
+            rows
+        )
+
+
+def fill(connection, student_id=None, course_ids=None):
+    """
+    Compute missing summary rows for enrolled (student, course) pairs in one
+    INSERT .. SELECT. Optionally limited to one student and/or some courses.
+    """
+    enrollment = enrollments.alias('e')
+    
+    def count_marks(status):
+        return select(func.count(Attendance.id)).join(
+            Session, Attendance.session_id == Session.id
+        ).where(
+            Attendance.student_id == enrollment.c.student_id,
+            Session.course_id == enrollment.c.course_id,
+            Attendance.status == status
+        ).scalar_subquery()
+    
+    past_sessions = select(func.count(Session.id)).where(
+        Session.course_id == enrollment.c.course_id,
+        Session.status == 'past'
+    ).scalar_subquery()
+    
+    query = select(
+        enrollment.c.student_id,
+        enrollment.c.course_id,
+        count_marks('present'),
+        count_marks('excused'),
+        past_sessions
+    ).where(
+        enrollment.c.student_id.isnot(None),
+        enrollment.c.course_id.isnot(None),
+        ~exists().where(and_(
+            summaries.c.student_id == enrollment.c.student_id,
+            summaries.c.course_id == enrollment.c.course_id
+        ))
+    ).distinct()
+    if student_id is not None:
+        query = query.where(enrollment.c.student_id == student_id)
+    if course_ids is not None:
+        query = query.where(enrollment.c.course_id.in_(list(course_ids)))
+    
+    statement = insert_or_ignore(AttendanceSummary, 'student_id', 'course_id').from_select(
+        ['student_id', 'course_id', 'attended', 'excused', 'total'], query
+    )
+    connection.execute(statement)
+
+
+def enrollments_changed(connection, pairs):
+    """Recompute the rows of (student_id, course_id) pairs that were enrolled or unenrolled"""
+    by_student = {}
+    for student_id, course_id in pairs:
+        by_student.setdefault(student_id, set()).add(course_id)
+    for student_id, course_ids in by_student.items():
+        connection.execute(summaries.delete().where(
+            summaries.c.student_id == student_id,
+            summaries.c.course_id.in_(course_ids)
+        ))
+        # Only inserts rows for pairs that are still enrolled
+        fill(connection, student_id=student_id, course_ids=course_ids)
+
+
+def rebuild(connection):
+    """Recompute every summary row from the base tables"""
+    connection.execute(summaries.delete())
+    fill(connection)
+
+
+def summaries_for(student_id, course_ids):
+    """{course_id: AttendanceSummary} for a student's courses, read by primary key"""
+    course_ids = list(course_ids)
+    if not course_ids:
+        return {}
+    return {row.course_id: row for row in db.session.query(AttendanceSummary).filter(
+        AttendanceSummary.student_id == student_id,
+        AttendanceSummary.course_id.in_(course_ids)
+    )}
+
+
+def _before(target, attr):
+    """The value of attr before the pending flush"""
+    history = inspect(target).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(target, attr)
+
+
+@event.listens_for(Attendance, 'after_insert')
+def _attendance_inserted(mapper, connection, target):
+    _bump(connection, [(target.student_id, target.session_id, target.status, 1)])
+
+
+@event.listens_for(Attendance, 'after_update')
+def _attendance_updated(mapper, connection, target):
+    old = (_before(target, 'student_id'), _before(target, 'session_id'), _before(target, 'status'))
+    new = (target.student_id, target.session_id, target.status)
+    if old != new:
+        _bump(connection, [old + (-1,), new + (1,)])
+
+
+@event.listens_for(Attendance, 'after_delete')
+def _attendance_deleted(mapper, connection, target):
+    _bump(connection, [(target.student_id, target.session_id, target.status, -1)])
+
+
+@event.listens_for(Session, 'after_update')
+def _session_updated(mapper, connection, target):
+    deltas = {}
+    if _before(target, 'status') == 'past':
+        course_id = _before(target, 'course_id')
+        deltas[course_id] = deltas.get(course_id, 0) - 1
+    if target.status == 'past':
+        deltas[target.course_id] = deltas.get(target.course_id, 0) + 1
+    course_totals_changed(connection, deltas)
+
+
+@event.listens_for(Session, 'after_insert')
+def _session_inserted(mapper, connection, target):
+    if target.status == 'past':
+        course_totals_changed(connection, {target.course_id: 1})
+
+
+@event.listens_for(Session, 'after_delete')
+def _session_deleted(mapper, connection, target):
+    if target.status == 'past':
+        course_totals_changed(connection, {target.course_id: -1})
+
+
+@event.listens_for(Course.students, 'append')
+@event.listens_for(Course.students, 'remove')
+def _enrollment_changed(course, student, initiator):
+    session = object_session(course) or object_session(student)
+    if session is not None:
+        session.info.setdefault('enrollments_changed', []).append((course, student))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _enrollments_flushed(session, flush_context):
+    # The enrollment rows (and the ids of new students and courses) exist once flushed
+    changed = session.info.pop('enrollments_changed', None)
+    if changed:
+        enrollments_changed(session.connection(), {(student.id, course.id) for course, student in changed})
+
+
+@event.listens_for(Student, 'after_delete')
+def _student_deleted(mapper, connection, target):
+    connection.execute(summaries.delete().where(summaries.c.student_id == target.id))
+
+
+@event.listens_for(Course, 'after_delete')
+def _course_deleted(mapper, connection, target):
+    connection.execute(summaries.delete().where(summaries.c.course_id == target.id))
+
+
+if __name__ == '__main__':
+    from app import app
+    
+    with app.app_context():
+        with db.engine.begin() as connection:
+            rebuild(connection)
+        rows = db.session.query(AttendanceSummary).count()
+    print(f"Rebuilt {rows} attendance summary rows")
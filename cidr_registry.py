@@ -0,0 +1,162 @@
+"""
+Named campus network ranges, compiled into prefix tries.
+
+Campus networks are configured once under CAMPUS_NETWORKS, for example
+
+    app.config['CAMPUS_NETWORKS'] = {
+        'main-campus': ['10.10.0.0/16', '10.20.0.0/16', '2001:db8:10::/48'],
+        'science-block': '10.30.4.0/22, 10.30.8.0/22',
+    }
+
+Deployments set them from the environment instead of editing code, either as
+inline JSON or as the path to a JSON file with the same shape:
+
+    TRACKADEMIA_CAMPUS_NETWORKS='{"main-campus": ["10.10.0.0/16"]}'
+    TRACKADEMIA_CAMPUS_NETWORKS=/etc/trackademia/campus_networks.json
+
+A session's allowed_ip_range may name one or more of these networks and/or
+list literal CIDR blocks, separated by commas. Every range is parsed when the
+registry is configured or the session is saved, so a typo is reported then
+instead of silently rejecting every check-in.
+"""
+import ipaddress
+import json
+import os
+import threading
+
+
+def load_campus_networks():
+    """Read CAMPUS_NETWORKS from TRACKADEMIA_CAMPUS_NETWORKS; {} when it is not set"""
+    value = os.environ.get('TRACKADEMIA_CAMPUS_NETWORKS', '').strip()
+    if not value:
+        return {}
+    try:
+        if value.startswith('{'):
+            networks = json.loads(value)
+        else:
+            with open(value, encoding='utf-8') as f:
+                networks = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Cannot read TRACKADEMIA_CAMPUS_NETWORKS: {e}")
+    if not isinstance(networks, dict):
+        raise ValueError('TRACKADEMIA_CAMPUS_NETWORKS must map network names to ranges')
+    return networks
+
+
+class CIDRTrie:
+    """Binary prefix trie over IPv4 and IPv6 networks"""
+    
+    def __init__(self, networks=()):
+        # Each node is [child for bit 0, child for bit 1, network ending here]
+        self._roots = {4: [None, None, None], 6: [None, None, None]}
+        self.networks = []
+        for network in networks:
+            self.add(network)
+    
+    def add(self, network):
+        network = ipaddress.ip_network(network)
+        node = self._roots[network.version]
+        bits = int(network.network_address)
+        width = network.max_prefixlen
+        for i in range(network.prefixlen):
+            bit = (bits >> (width - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if node[2] is None:
+            node[2] = network
+        self.networks.append(network)
+    
+    def lookup(self, address):
+        """Return the shortest configured network containing address, or None"""
+        address = ipaddress.ip_address(address)
+        node = self._roots[address.version]
+        bits = int(address)
+        width = address.max_prefixlen
+        for i in range(width):
+            if node[2] is not None:
+                return node[2]
+            node = node[(bits >> (width - 1 - i)) & 1]
+            if node is None:
+                return None
+        return node[2]
+    
+    def __contains__(self, address):
+        try:
+            return self.lookup(address) is not None
+        except ValueError:
+            return False
+    
+    def __bool__(self):
+        return bool(self.networks)
+
+
+class CIDRRegistry:
+    """Named network ranges plus a cache of compiled allowed_ip_range specs"""
+    
+    def __init__(self, app=None):
+        self._named = {}
+        self._compiled = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('CAMPUS_NETWORKS', {})
+        for name, ranges in app.config['CAMPUS_NETWORKS'].items():
+            self.register(name, ranges)
+        app.extensions['cidr_registry'] = self
+    
+    def register(self, name, ranges):
+        """Add or replace a named network; raises ValueError for a bad range"""
+        if isinstance(ranges, str):
+            ranges = ranges.split(',')
+        networks = []
+        for cidr in ranges:
+            try:
+                networks.append(ipaddress.ip_network(cidr.strip()))
+            except ValueError as e:
+                raise ValueError(f"Invalid range {cidr.strip()!r} in campus network {name!r}: {e}")
+        with self._lock:
+            self._named[name] = networks
+            # Specs that referenced the old definition must be recompiled
+            self._compiled.clear()
+    
+    def names(self):
+        return sorted(self._named)
+    
+    def compile(self, spec):
+        """
+        Compile an allowed_ip_range spec into a CIDRTrie. The result is cached,
+        so each distinct spec is only parsed once. Raises ValueError if a part
+        is neither a registered name nor a valid CIDR block.
+        """
+        with self._lock:
+            trie = self._compiled.get(spec)
+            if trie is not None:
+                return trie
+            networks = []
+            for part in spec.split(','):
+                part = part.strip()
+                if not part:
+                    continue
+                if part in self._named:
+                    networks.extend(self._named[part])
+                    continue
+                try:
+                    networks.append(ipaddress.ip_network(part))
+                except ValueError:
+                    raise ValueError(f"{part!r} is not a campus network name or a valid IP range")
+            if not networks:
+                raise ValueError('No IP ranges given')
+            trie = CIDRTrie(networks)
+            self._compiled[spec] = trie
+            return trie
+    
+    def validate(self, spec):
+        """Return an error message for a bad spec, or None if it compiles"""
+        try:
+            self.compile(spec)
+        except ValueError as e:
+            return str(e)
+        return None
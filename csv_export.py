@@ -0,0 +1,41 @@
+"""
+Streaming CSV responses for the report exports.
+
+Rows come from a generator over a query read in batches (yield_per) and are
+written out a chunk at a time, so memory stays flat however large the export
+is, and the header goes out before the first row has been read.
+"""
+import csv
+import io
+
+from flask import Response, stream_with_context
+
+# Rows fetched per round trip, and written per response chunk
+EXPORT_BATCH_SIZE = 1000
+
+
+def csv_chunks(rows, header=None):
+    """Encode rows as CSV text, yielding every EXPORT_BATCH_SIZE rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(header)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def csv_response(filename, rows, header=None):
+    """A chunked text/csv download streamed from rows, inside the request context"""
+    response = Response(stream_with_context(csv_chunks(rows, header)), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, text
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, date, time, timedelta
 import sys
@@ -11,7 +12,9 @@ db = SQLAlchemy()
 enrollments = db.Table('enrollments',
     db.Column('id', db.Integer, primary_key=True),
     db.Column('student_id', db.Integer, db.ForeignKey('students.id')),
-    db.Column('course_id', db.Integer, db.ForeignKey('courses.id'))
+    db.Column('course_id', db.Integer, db.ForeignKey('courses.id')),
+    db.Index('ix_enrollments_course_student', 'course_id', 'student_id'),
+    db.Index('ix_enrollments_student_course', 'student_id', 'course_id')
 )
 
 class User(db.Model):
@@ -25,6 +28,13 @@ class User(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Sort orders of the admin user list
+    __table_args__ = (
+        db.Index('ix_users_type_name', 'user_type', 'name', 'id'),
+        db.Index('ix_users_name', 'name', 'id'),
+        db.Index('ix_users_created', 'created_at', 'id'),
+    )
+    
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
     
@@ -40,6 +50,10 @@ class Admin(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     role = db.Column(db.String(50), default='administrator')  # administrator, super_admin, etc.
     
+    __table_args__ = (
+        db.Index('ix_admins_user_id', 'user_id'),
+    )
+    
     # Relationship to User
     user = db.relationship('User', backref='admin_profile')
     
@@ -56,6 +70,10 @@ class Lecturer(db.Model):
     office_hours = db.Column(db.String(200))
     is_active = db.Column(db.Boolean, default=True)
     
+    __table_args__ = (
+        db.Index('ix_lecturers_user_id', 'user_id'),
+    )
+    
     # Relationship to User
     user = db.relationship('User', backref='lecturer_profile')
     
@@ -77,6 +95,10 @@ class Student(db.Model):
     major = db.Column(db.String(100))
     is_active = db.Column(db.Boolean, default=True)
     
+    __table_args__ = (
+        db.Index('ix_students_user_id', 'user_id'),
+    )
+    
     # Relationship to User
     user = db.relationship('User', backref='student_profile')
     
@@ -104,6 +126,11 @@ class Course(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_courses_lecturer_id', 'lecturer_id'),
+        db.Index('ix_courses_name', 'name', 'id'),
+    )
+    
     # Many-to-many relationship with Student
     students = db.relationship('Student',
                               secondary=enrollments,
@@ -134,6 +161,21 @@ class Session(db.Model):
     longitude = db.Column(db.Float)
     allowed_ip_range = db.Column(db.String(100), nullable=True)
     
+    # date + start_time and the end of the session, kept in step by schedule()
+    # so the lifecycle engine can find due sessions with an index range scan
+    starts_at = db.Column(db.DateTime)
+    ends_at = db.Column(db.DateTime)
+    # When the students were reminded that the session is about to start
+    reminder_sent_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_sessions_lecturer_date_start', 'lecturer_id', 'date', 'start_time'),
+        db.Index('ix_sessions_status_date_start', 'status', 'date', 'start_time'),
+        db.Index('ix_sessions_course_status', 'course_id', 'status'),
+        db.Index('ix_sessions_status_starts_at', 'status', 'starts_at'),
+        db.Index('ix_sessions_status_ends_at', 'status', 'ends_at'),
+    )
+    
     # Relationships
     attendance_records = db.relationship('Attendance', back_populates='session', cascade='all, delete-orphan')
     
@@ -155,6 +197,22 @@ class Session(db.Model):
         session_datetime = datetime.combine(self.date, self.start_time)
         end_datetime = session_datetime + timedelta(minutes=self.duration_minutes)
         return session_datetime <= now <= end_datetime
+    
+    def schedule(self):
+        """
+        Recompute starts_at and ends_at from date, start_time and
+        duration_minutes. Moving the start makes the session due a new reminder.
+        """
+        starts_at = datetime.combine(self.date, self.start_time) if self.date and self.start_time else None
+        if starts_at != self.starts_at:
+            self.reminder_sent_at = None
+        self.starts_at = starts_at
+        self.ends_at = starts_at + timedelta(minutes=self.duration_minutes or 0) if starts_at else None
+
+@event.listens_for(Session, 'before_insert')
+@event.listens_for(Session, 'before_update')
+def _schedule_session(mapper, connection, target):
+    target.schedule()
 
 class Attendance(db.Model):
     __tablename__ = 'attendances'
@@ -167,12 +225,30 @@ class Attendance(db.Model):
     status = db.Column(db.String(20), default='present')  # present, absent, excused
     verified_by = db.Column(db.String(50), nullable=True)  # system, admin, lecturer
     
+    # A student can only be marked once per session
+    __table_args__ = (
+        db.Index('uq_attendance_student_session', 'student_id', 'session_id', unique=True),
+        db.Index('ix_attendances_session_student', 'session_id', 'student_id'),
+    )
+    
     # Relationships
     session = db.relationship('Session', back_populates='attendance_records')
     
     def __repr__(self):
         return f'<Attendance {self.student_id} for Session {self.session_id}>'
 
+class AttendanceSummary(db.Model):
+    """Per-student, per-course attendance counts, maintained by attendance_summary.py"""
+    __tablename__ = 'attendance_summaries'
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id'), primary_key=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), primary_key=True)
+    attended = db.Column(db.Integer, nullable=False, default=0)  # present marks in the course's sessions
+    excused = db.Column(db.Integer, nullable=False, default=0)  # excused marks in the course's sessions
+    total = db.Column(db.Integer, nullable=False, default=0)  # past sessions of the course
+    
+    def __repr__(self):
+        return f'<AttendanceSummary {self.student_id} in Course {self.course_id}: {self.attended}/{self.total}>'
+
 class RemovalRequest(db.Model):
     __tablename__ = 'removal_requests'
     id = db.Column(db.Integer, primary_key=True)
@@ -186,6 +262,10 @@ class RemovalRequest(db.Model):
     reviewed_at = db.Column(db.DateTime, nullable=True)
     review_notes = db.Column(db.Text, nullable=True)
     
+    __table_args__ = (
+        db.Index('ix_removal_requests_status_created', 'status', 'created_at'),
+    )
+    
     # Relationships
     student = db.relationship('Student')
     course = db.relationship('Course')
@@ -195,11 +275,69 @@ class RemovalRequest(db.Model):
     def __repr__(self):
         return f'<RemovalRequest {self.id} - {self.status}>'
 
+class Notification(db.Model):
+    """Outbox of messages to users, one row per recipient and channel, drained by notifications.py"""
+    __tablename__ = 'notifications'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    session_id = db.Column(db.Integer, db.ForeignKey('sessions.id', ondelete='SET NULL'), nullable=True)
+    kind = db.Column(db.String(20), nullable=False)  # reminder
+    channel = db.Column(db.String(20), nullable=False)  # in_app, email, webhook
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # When a worker may next pick the row up: after a retry delay, or once a worker's claim lapses
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now())
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now())
+    sent_at = db.Column(db.DateTime, nullable=True)
+    read_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_notifications_channel_status_next', 'channel', 'status', 'next_attempt_at'),
+        db.Index('ix_notifications_user_channel', 'user_id', 'channel', 'id'),
+    )
+    
+    def __repr__(self):
+        return f'<Notification {self.id} {self.channel} to User {self.user_id} - {self.status}>'
+
+def insert_or_ignore(model, *conflict_columns):
+    """Build an INSERT that silently skips rows clashing with a unique constraint"""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model).on_conflict_do_nothing(index_elements=list(conflict_columns))
+
+def ensure_unique_attendance(connection):
+    """
+    Add the (student, session) unique index to an attendances table created
+    before it existed. insert_or_ignore needs it as its conflict target, so
+    where double-taps stored more than one mark the earliest one is kept.
+    """
+    inspector = inspect(connection)
+    columns = {'student_id', 'session_id'}
+    if any(set(constraint['column_names']) == columns
+           for constraint in inspector.get_unique_constraints('attendances')):
+        return
+    if any(index.get('unique') and set(index['column_names']) == columns
+           for index in inspector.get_indexes('attendances')):
+        return
+    connection.execute(text(
+        "DELETE FROM attendances WHERE id NOT IN "
+        "(SELECT MIN(id) FROM attendances GROUP BY student_id, session_id)"
+    ))
+    index = next(index for index in Attendance.__table__.indexes if index.name == 'uq_attendance_student_session')
+    index.create(bind=connection, checkfirst=True)
+
 def init_db(app):
     """Initialize database with app context"""
     with app.app_context():
-        # Create all tables
+        # Create all tables and apply pending schema migrations
         db.create_all()
+        from migrations import migrate
+        migrate()
         
         # Check if we need to create demo data
         if User.query.count() == 0:
@@ -0,0 +1,296 @@
+# load_test.py - Check-in storm load test
+"""
+Seeds a course with N enrolled students and an active session, logs every
+student in, then fires their check-ins at /api/attendance/mark concurrently
+and reports throughput, latency percentiles, error rates and duplicate rows.
+
+    python load_test.py --students 400 --concurrency 100
+    python load_test.py --url http://localhost:5000 --students 400
+
+Without --url the requests go through Flask's test client in this process,
+against a throwaway SQLite database unless DATABASE_URL is set. With --url
+they go over HTTP to a running server (Flask dev server or any WSGI server)
+that uses the same database, since seeding writes to it directly. Seeded
+rows are deleted again when the run ends, unless the database is the
+throwaway one. Clients honor 429 Retry-After like the browser does.
+"""
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# In-process runs get a scratch database unless one is configured; --url runs
+# must seed the database the server uses
+SCRATCH_DIR = None
+if 'DATABASE_URL' not in os.environ and not any(arg == '--url' or arg.startswith('--url=') for arg in sys.argv[1:]):
+    SCRATCH_DIR = tempfile.mkdtemp(prefix='trackademia-load-')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(SCRATCH_DIR, 'load_test.db')
+
+from werkzeug.security import generate_password_hash
+
+from app import app
+from database import db, User, Lecturer, Student, Course, Session, Attendance
+from migrations import migrate
+
+CAMPUS_LAT = 18.0060
+CAMPUS_LON = -76.7468
+PASSWORD = 'loadtest'
+MAX_ATTEMPTS = 6
+
+
+def seed(tag, students):
+    """Create a lecturer, a course with enrolled students and an active session"""
+    # Cheap hash so logging in hundreds of students does not dominate the run
+    password_hash = generate_password_hash(PASSWORD, method='pbkdf2:sha256:1000')
+    
+    with app.app_context():
+        db.create_all()
+        migrate()
+        lecturer_user = User(username=f'load_{tag}_lecturer', name='Load Test Lecturer',
+                             user_type='lecturer', password_hash=password_hash)
+        db.session.add(lecturer_user)
+        db.session.flush()
+        lecturer = Lecturer(user_id=lecturer_user.id, department='Load Test')
+        db.session.add(lecturer)
+        db.session.flush()
+    
+        course = Course(name=f'Load Test {tag}', code=f'LOAD{tag}', semester='Load Test',
+                        max_capacity=students, lecturer_id=lecturer.id)
+        db.session.add(course)
+    
+        usernames = []
+        for i in range(students):
+            username = f'load_{tag}_{i}'
+            user = User(username=username, name=f'Load Student {i}', user_type='student',
+                        password_hash=password_hash)
+            db.session.add(user)
+            db.session.flush()
+            student = Student(user_id=user.id, student_id=f'L{tag}{i:05d}')
+            db.session.add(student)
+            course.students.append(student)
+            usernames.append(username)
+    
+        now = datetime.now()
+        session_obj = Session(course=course, name='Load Test Session', date=now.date(),
+                              start_time=(now - timedelta(minutes=5)).time().replace(microsecond=0),
+                              duration_minutes=120, location='Load Test Hall',
+                              allowed_distance_meters=100, lecturer_id=lecturer.id,
+                              latitude=CAMPUS_LAT, longitude=CAMPUS_LON, status='active')
+        db.session.add(session_obj)
+        db.session.commit()
+        return usernames, session_obj.id
+
+
+def cleanup(tag):
+    """Delete everything seed() created for this run"""
+    with app.app_context():
+        users = User.query.filter(User.username.like(f'load_{tag}_%')).all()
+        user_ids = [user.id for user in users]
+        course = Course.query.filter_by(code=f'LOAD{tag}').first()
+        if course is not None:
+            # Deleting a session takes its attendance rows with it
+            for session_obj in Session.query.filter_by(course_id=course.id):
+                db.session.delete(session_obj)
+            course.students = []
+            db.session.flush()
+            db.session.delete(course)
+            db.session.flush()
+        for model in (Student, Lecturer):
+            for row in model.query.filter(model.user_id.in_(user_ids)):
+                db.session.delete(row)
+        db.session.flush()
+        for user in users:
+            db.session.delete(user)
+        db.session.commit()
+
+
+def check_in_payload(session_id, outside_rate):
+    """Coordinates scattered around the room; a few students are out of range"""
+    radius = random.uniform(150, 400) if random.random() < outside_rate else random.uniform(0, 60)
+    bearing = random.uniform(0, 2 * math.pi)
+    return {
+        'session_id': session_id,
+        'latitude': CAMPUS_LAT + radius * math.cos(bearing) / 111320,
+        'longitude': CAMPUS_LON + radius * math.sin(bearing) / (111320 * math.cos(math.radians(CAMPUS_LAT))),
+        'accuracy': random.uniform(5, 30)
+    }
+
+
+class TestClientStudent:
+    """A logged-in student talking to the app through Flask's test client"""
+    
+    def __init__(self, username):
+        self.client = app.test_client()
+        response = self.client.post('/login', data={'username': username, 'password': PASSWORD})
+        if response.status_code != 302:
+            raise RuntimeError(f'Login failed for {username}')
+    
+    def post(self, payload):
+        response = self.client.post('/api/attendance/mark', json=payload)
+        return response.status_code, response.headers.get('Retry-After'), response.get_json(silent=True) or {}
+
+
+class HTTPStudent:
+    """A logged-in student talking to a running server over HTTP"""
+    
+    def __init__(self, base_url, username):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            NoRedirect
+        )
+        data = urllib.parse.urlencode({'username': username, 'password': PASSWORD}).encode()
+        try:
+            self.opener.open(f'{self.base_url}/login', data)
+        except urllib.error.HTTPError as e:
+            if e.code != 302:
+                raise RuntimeError(f'Login failed for {username}: {e.code}')
+    
+    def post(self, payload):
+        request = urllib.request.Request(
+            f'{self.base_url}/api/attendance/mark',
+            data=json.dumps(payload).encode(),
+            headers={'Content-Type': 'application/json'}
+        )
+        try:
+            response = self.opener.open(request, timeout=60)
+            status, headers, body = response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            status, headers, body = e.code, e.headers, e.read()
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = {'message': body[:200].decode(errors='replace')}
+        return status, headers.get('Retry-After'), data
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def check_in(student, payload, results, lock):
+    """One student's check-in, retried on 429 like the browser client"""
+    started = time.perf_counter()
+    shed = 0
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            status, retry_header, data = student.post(payload)
+        except Exception as e:
+            status, retry_header, data = 'exception', None, {'message': str(e)}
+        if status != 429 or attempt + 1 == MAX_ATTEMPTS:
+            break
+        shed += 1
+        base = data.get('retry_after') or float(retry_header or 1)
+        time.sleep(base * (1 + random.random() * min(attempt + 1, 4)))
+    elapsed = time.perf_counter() - started
+    with lock:
+        results.append((status, elapsed, shed, data.get('message', '')))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def report(results, wall_time, session_id):
+    latencies = [elapsed for _, elapsed, _, _ in results]
+    by_status = {}
+    for status, _, _, _ in results:
+        by_status[status] = by_status.get(status, 0) + 1
+    shed = sum(s for _, _, s, _ in results)
+    lock_timeouts = sum(1 for status, _, _, message in results
+                        if status in (500, 503) or 'locked' in message.lower())
+    errors = sum(1 for status, _, _, _ in results if status == 'exception' or (isinstance(status, int) and status >= 500))
+    
+    with app.app_context():
+        duplicates = db.session.query(Attendance.student_id).filter_by(session_id=session_id).group_by(
+            Attendance.student_id
+        ).having(db.func.count(Attendance.id) > 1).count()
+        stored = db.session.query(Attendance).filter_by(session_id=session_id).count()
+    
+    total = len(results)
+    print("\n" + "="*50)
+    print(f"Check-ins:          {total} in {wall_time:.2f}s ({total / wall_time:.1f}/s)")
+    print(f"Latency p50/p95/p99: {percentile(latencies, 50) * 1000:.0f} / "
+          f"{percentile(latencies, 95) * 1000:.0f} / {percentile(latencies, 99) * 1000:.0f} ms "
+          f"(mean {statistics.mean(latencies) * 1000:.0f} ms)")
+    print(f"Responses:          {', '.join(f'{k}: {v}' for k, v in sorted(by_status.items(), key=str))}")
+    print(f"Error rate:         {errors / total:.2%}")
+    print(f"Lock/ack timeouts:  {lock_timeouts} ({lock_timeouts / total:.2%})")
+    print(f"Shed (429) retries: {shed}")
+    print(f"Rows stored:        {stored}")
+    print(f"Duplicate rows:     {duplicates}")
+    print("="*50)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check-in storm load test')
+    parser.add_argument('--students', type=int, default=400, help='students enrolled and checking in')
+    parser.add_argument('--concurrency', type=int, default=100, help='check-ins in flight at once')
+    parser.add_argument('--url', help='base URL of a running server (default: in-process test client)')
+    parser.add_argument('--outside-rate', type=float, default=0.05, help='fraction of students out of range')
+    parser.add_argument('--double-tap-rate', type=float, default=0.05, help='fraction of students submitting twice')
+    args = parser.parse_args()
+    
+    tag = datetime.now().strftime('%Y%m%d%H%M%S')
+    try:
+        run(args, tag)
+    finally:
+        if SCRATCH_DIR is not None:
+            with app.app_context():
+                db.engine.dispose()
+            shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+        else:
+            print("Removing seeded rows...")
+            cleanup(tag)
+
+
+def run(args, tag):
+    print(f"Seeding {args.students} students...")
+    usernames, session_id = seed(tag, args.students)
+    
+    print("Logging students in...")
+    with ThreadPoolExecutor(max_workers=min(args.concurrency, 32)) as pool:
+        if args.url:
+            students = list(pool.map(lambda u: HTTPStudent(args.url, u), usernames))
+        else:
+            students = list(pool.map(TestClientStudent, usernames))
+    
+    jobs = []
+    for student in students:
+        payload = check_in_payload(session_id, args.outside_rate)
+        jobs.append((student, payload))
+        if random.random() < args.double_tap_rate:
+            jobs.append((student, payload))
+    random.shuffle(jobs)
+    
+    print(f"Firing {len(jobs)} check-ins with {args.concurrency} in flight...")
+    results = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for student, payload in jobs:
+            pool.submit(check_in, student, payload, results, lock)
+    wall_time = time.perf_counter() - started
+    
+    report(results, wall_time, session_id)
+
+
+if __name__ == '__main__':
+    main()
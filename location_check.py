@@ -1,30 +1,93 @@
 import math
 import ipaddress
 
+try:
+    import numpy as np
+except ImportError:  # Only the batch functions need NumPy
+    np = None
+
+# Earth radius in meters
+EARTH_RADIUS_M = 6371000
+
+def _haversine(lat1, lon1, cos_lat1, lat2, lon2, cos_lat2):
+    """Haversine distance in meters between two points given in radians"""
+    # Differences
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    
+    # Haversine formula
+    a = math.sin(dlat/2)**2 + cos_lat1 * cos_lat2 * math.sin(dlon/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    
+    return EARTH_RADIUS_M * c
+
 def calculate_distance(lat1, lon1, lat2, lon2):
     """
     Simple distance calculation in meters using Haversine formula
     """
-    # Earth radius in meters
-    R = 6371000
-    
     # Convert to radians
     lat1 = math.radians(float(lat1))
     lon1 = math.radians(float(lon1))
     lat2 = math.radians(float(lat2))
     lon2 = math.radians(float(lon2))
     
-    # Differences
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    
-    # Haversine formula
-    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    
-    distance = R * c
+    return _haversine(lat1, lon1, math.cos(lat1), lat2, lon2, math.cos(lat2))
+
+def calculate_distance_to(lat, lon, target_lat_rad, target_lon_rad, target_cos_lat):
+    """
+    Distance in meters from a point to a target whose radians and cosine of
+    latitude are precomputed. Gives exactly the same result as calculate_distance.
+    """
+    lat = math.radians(float(lat))
+    lon = math.radians(float(lon))
+    return _haversine(lat, lon, math.cos(lat), target_lat_rad, target_lon_rad, target_cos_lat)
+
+def approximate_distance_to(lat, lon, target_lat_rad, target_lon_rad, target_cos_lat):
+    """
+    Equirectangular (planar) approximation of the distance in meters, using
+    the target's precomputed cos(lat). Accurate to well under 1% for points a
+    few kilometers apart away from the poles.
+    """
+    dlat = math.radians(float(lat)) - target_lat_rad
+    dlon = math.radians(float(lon)) - target_lon_rad
+    # Take the short way around across the antimeridian
+    if dlon > math.pi:
+        dlon -= 2 * math.pi
+    elif dlon < -math.pi:
+        dlon += 2 * math.pi
+    x = dlon * target_cos_lat
+    return EARTH_RADIUS_M * math.sqrt(x*x + dlat*dlat)
+
+# The planar approximation is only trusted for geofences up to this size and
+# this far from the poles, where its error stays below FAST_PATH_TOLERANCE
+FAST_PATH_MAX_DISTANCE = 5000
+FAST_PATH_MAX_LATITUDE = 80
+FAST_PATH_TOLERANCE = 0.01
+_FAST_PATH_MAX_LAT_RAD = math.radians(FAST_PATH_MAX_LATITUDE)
+
+def check_location_fast(student_lat, student_lon, target_lat_rad, target_lon_rad, target_cos_lat, max_distance, accuracy=None):
+    """
+    Same decision as check_attendance_location, using the planar approximation
+    when the student is clearly inside or outside the radius and falling back
+    to exact haversine within FAST_PATH_TOLERANCE (plus 1m) of it.
+    Returns (within_range, rounded distance, exact) where exact tells whether
+    the distance came from haversine.
+    """
+    limit = effective_max_distance(max_distance, accuracy)
+    if limit <= FAST_PATH_MAX_DISTANCE and abs(target_lat_rad) <= _FAST_PATH_MAX_LAT_RAD:
+        distance = approximate_distance_to(student_lat, student_lon, target_lat_rad, target_lon_rad, target_cos_lat)
+        if abs(distance - limit) > FAST_PATH_TOLERANCE * limit + 1.0:
+            return distance <= limit, round(distance, 2), False
     
-    return distance
+    distance = calculate_distance_to(student_lat, student_lon, target_lat_rad, target_lon_rad, target_cos_lat)
+    return distance <= limit, round(distance, 2), True
+
+def effective_max_distance(max_distance, accuracy=None):
+    """Allowed distance widened by the reported GPS accuracy"""
+    effective = float(max_distance)
+    if accuracy:
+        effective += float(accuracy)
+    return effective
 
 def check_attendance_location(student_lat, student_lon, session_lat, session_lon, max_distance, accuracy=None):
     """
@@ -39,8 +102,107 @@ def check_attendance_location(student_lat, student_lon, session_lat, session_lon
     )
     
     # Account for GPS accuracy
-    effective_max_distance = float(max_distance)
-    if accuracy:
-        effective_max_distance += float(accuracy)
+    return distance <= effective_max_distance(max_distance, accuracy), round(distance, 2)
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('Batch location checks require NumPy (pip install numpy)')
+    return np
+
+def calculate_distances(student_lats, student_lons, session_lats, session_lons):
+    """
+    Vectorized calculate_distance. Takes arrays of student coordinates and
+    either arrays (one session per row) or scalars for the session coordinates,
+    and returns an array of distances in meters.
+    """
+    np = _require_numpy()
+    lat1 = np.radians(np.asarray(student_lats, dtype=float))
+    lon1 = np.radians(np.asarray(student_lons, dtype=float))
+    lat2 = np.radians(np.asarray(session_lats, dtype=float))
+    lon2 = np.radians(np.asarray(session_lons, dtype=float))
+    
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+    
+    return EARTH_RADIUS_M * c
+
+def check_attendance_locations(student_lats, student_lons, session_lats, session_lons, max_distances, accuracies=None):
+    """
+    Vectorized check_attendance_location for bulk re-verification.
     
-    return distance <= effective_max_distance, round(distance, 2)
\ No newline at end of file
+    Session coordinates, allowed distances and accuracies may be arrays (one
+    value per row) or scalars. Missing session coordinates (None/NaN) fail with
+    a distance of 0, and missing accuracies are ignored, as in the scalar check.
+    Returns (within_range, distances) arrays that agree row for row with
+    check_attendance_location: NumPy's trigonometry can differ from math's in
+    the last bit, so rows sitting on the radius or on a rounding tie are
+    recomputed with the scalar function.
+    """
+    np = _require_numpy()
+    student_lats, student_lons, session_lats, session_lons, max_distances = np.broadcast_arrays(
+        np.asarray(student_lats, dtype=float), np.asarray(student_lons, dtype=float),
+        np.asarray(session_lats, dtype=float), np.asarray(session_lons, dtype=float),
+        np.asarray(max_distances, dtype=float)
+    )
+    
+    effective = max_distances.copy()
+    if accuracies is not None:
+        effective = effective + np.nan_to_num(np.asarray(accuracies, dtype=float), nan=0.0)
+    
+    distances = calculate_distances(student_lats, student_lons, session_lats, session_lons)
+    within_range = distances <= effective
+    rounded = np.round(distances, 2)
+    
+    # Rows where a last-bit difference could change the outcome
+    cents = distances * 100
+    near_tie = np.abs(cents - np.floor(cents) - 0.5) <= 1e-6
+    near_radius = np.abs(distances - effective) <= 1e-9 * np.maximum(effective, 1.0)
+    has_location = ~(np.isnan(session_lats) | np.isnan(session_lons))
+    for i in np.flatnonzero((near_tie | near_radius) & has_location):
+        distance = calculate_distance(student_lats[i], student_lons[i], session_lats[i], session_lons[i])
+        within_range[i] = distance <= effective[i]
+        rounded[i] = round(distance, 2)
+    
+    within_range &= has_location
+    rounded[~has_location] = 0
+    return within_range, rounded
+
+
+def _benchmark(checks=200000):
+    """Compare exact and fast-path checks for a 100m geofence"""
+    import random
+    import timeit
+    
+    lat_rad, lon_rad = math.radians(18.0060), math.radians(-76.7468)
+    cos_lat = math.cos(lat_rad)
+    points = [(18.0060 + random.uniform(-0.004, 0.004), -76.7468 + random.uniform(-0.004, 0.004))
+              for _ in range(checks)]
+    
+    def exact():
+        for lat, lon in points:
+            distance = calculate_distance_to(lat, lon, lat_rad, lon_rad, cos_lat)
+            distance <= effective_max_distance(100), round(distance, 2)
+    
+    def approximate():
+        for lat, lon in points:
+            approximate_distance_to(lat, lon, lat_rad, lon_rad, cos_lat)
+    
+    def fast():
+        for lat, lon in points:
+            check_location_fast(lat, lon, lat_rad, lon_rad, cos_lat, 100)
+    
+    exact_time = min(timeit.repeat(exact, number=1, repeat=3))
+    approximate_time = min(timeit.repeat(approximate, number=1, repeat=3))
+    fast_time = min(timeit.repeat(fast, number=1, repeat=3))
+    fallbacks = sum(check_location_fast(lat, lon, lat_rad, lon_rad, cos_lat, 100)[2] for lat, lon in points)
+    print(f"exact haversine: {exact_time / checks * 1e9:.0f} ns/check")
+    print(f"planar distance: {approximate_time / checks * 1e9:.0f} ns/check")
+    print(f"fast path:       {fast_time / checks * 1e9:.0f} ns/check ({fallbacks / checks:.1%} fell back to haversine)")
+    print(f"speedup:         {exact_time / fast_time:.2f}x")
+
+if __name__ == '__main__':
+    _benchmark()
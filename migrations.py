@@ -0,0 +1,189 @@
+"""
+Versioned schema migrations.
+
+db.create_all() creates missing tables but never touches tables that already
+exist, so every schema change to an existing table is also written here as a
+numbered migration. migrate() applies the migrations a database has not seen
+yet, in order, and records each one in the schema_version table, so a
+deployment picks up new indexes and columns on startup without reset_db.py
+wiping its data.
+
+Migrations must be safe to run against a database that create_all() has just
+built from the current models, since a fresh database goes through both.
+
+    python migrations.py
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, bindparam, inspect, select, text
+
+from database import db, ensure_unique_attendance
+
+schema_metadata = MetaData()
+
+schema_version = Table(
+    'schema_version', schema_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register a function(connection) as migration number version"""
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+def create_indexes(connection, *names):
+    """Create the named indexes declared on the models, skipping ones that exist"""
+    indexes = {index.name: index for table in db.metadata.tables.values() for index in table.indexes}
+    for name in names:
+        indexes[name].create(bind=connection, checkfirst=True)
+
+
+def create_tables(connection, *names):
+    """Create the named tables declared on the models, skipping ones that exist"""
+    for name in names:
+        db.metadata.tables[name].create(bind=connection, checkfirst=True)
+
+
+def add_columns(connection, table, *names):
+    """Add the named columns declared on a model's table, skipping ones that exist"""
+    existing = {column['name'] for column in inspect(connection).get_columns(table)}
+    for name in names:
+        if name in existing:
+            continue
+        column = db.metadata.tables[table].c[name]
+        column_type = column.type.compile(dialect=connection.dialect)
+        connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}'))
+
+
+@migration(1, 'One attendance row per student and session')
+def unique_attendance(connection):
+    ensure_unique_attendance(connection)
+
+
+@migration(2, 'Indexes for the hot query paths')
+def hot_path_indexes(connection):
+    create_indexes(
+        connection,
+        'ix_attendances_session_student',
+        'ix_sessions_lecturer_date_start',
+        'ix_sessions_status_date_start',
+        'ix_sessions_course_status',
+        'ix_courses_lecturer_id',
+        'ix_enrollments_course_student',
+        'ix_enrollments_student_course',
+        'ix_removal_requests_status_created',
+        'ix_students_user_id',
+        'ix_lecturers_user_id',
+        'ix_admins_user_id',
+    )
+
+
+@migration(3, 'Attendance summaries')
+def attendance_summaries(connection):
+    from attendance_summary import rebuild
+    
+    create_tables(connection, 'attendance_summaries')
+    rebuild(connection)
+
+
+@migration(4, 'Indexes for the admin list sort orders')
+def admin_list_indexes(connection):
+    create_indexes(connection, 'ix_users_type_name', 'ix_users_name', 'ix_users_created', 'ix_courses_name')
+
+
+@migration(5, 'Full-text search index')
+def search_index(connection):
+    from search_index import rebuild
+    
+    # Without FTS5 this records nothing to do; search falls back to LIKE
+    rebuild(connection)
+
+
+@migration(6, 'Session start and end timestamps for the lifecycle engine')
+def session_timestamps(connection):
+    from database import Session
+    
+    add_columns(connection, 'sessions', 'starts_at', 'ends_at')
+    sessions = Session.__table__
+    rows = connection.execute(
+        select(sessions.c.id, sessions.c.date, sessions.c.start_time, sessions.c.duration_minutes)
+        .where(sessions.c.starts_at.is_(None), sessions.c.date.isnot(None), sessions.c.start_time.isnot(None))
+    ).all()
+    for first in range(0, len(rows), 1000):
+        batch = []
+        for row in rows[first:first + 1000]:
+            starts_at = datetime.combine(row.date, row.start_time)
+            batch.append({
+                'b_id': row.id,
+                'b_starts_at': starts_at,
+                'b_ends_at': starts_at + timedelta(minutes=row.duration_minutes or 0),
+            })
+        connection.execute(
+            sessions.update().where(sessions.c.id == bindparam('b_id')).values(
+                starts_at=bindparam('b_starts_at'), ends_at=bindparam('b_ends_at')
+            ),
+            batch
+        )
+    create_indexes(connection, 'ix_sessions_status_starts_at', 'ix_sessions_status_ends_at')
+
+
+@migration(7, 'Session reminder claims')
+def session_reminders(connection):
+    add_columns(connection, 'sessions', 'reminder_sent_at')
+
+
+@migration(8, 'Notification outbox')
+def notification_outbox(connection):
+    create_tables(connection, 'notifications')
+
+
+@migration(9, 'Attendance summaries for every enrollment')
+def fill_attendance_summaries(connection):
+    # Summaries used to be filled on first read; they are now kept per enrollment
+    from attendance_summary import fill
+    
+    fill(connection)
+
+
+def current_version(connection):
+    schema_metadata.create_all(bind=connection)
+    return connection.execute(select(db.func.max(schema_version.c.version))).scalar() or 0
+
+
+def migrate():
+    """Apply pending migrations inside the current app context. Returns the versions applied."""
+    applied = []
+    for version, description, func in MIGRATIONS:
+        # One transaction per migration so a failure leaves earlier ones recorded
+        with db.engine.begin() as connection:
+            if version <= current_version(connection):
+                continue
+            func(connection)
+            connection.execute(schema_version.insert().values(
+                version=version, description=description, applied_at=datetime.utcnow()
+            ))
+        applied.append(version)
+    return applied
+
+
+if __name__ == '__main__':
+    from app import app
+    
+    with app.app_context():
+        db.create_all()
+        applied = migrate()
+        with db.engine.connect() as connection:
+            version = current_version(connection)
+    if applied:
+        print(f"Applied migrations {', '.join(map(str, applied))}; schema is at version {version}")
+    else:
+        print(f"Schema is up to date at version {version}")
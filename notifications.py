@@ -0,0 +1,360 @@
+"""
+Notification outbox and its delivery workers.
+
+A notification is a row in the notifications table, one per recipient and
+channel, written in the same transaction as whatever caused it.
+notify_enrolled() fans a message out to every student enrolled in a
+session's course with one INSERT ... SELECT per channel, so ten thousand
+reminders are queued in a few statements.
+
+NOTIFICATION_WORKERS background threads drain the outbox. A worker claims up
+to NOTIFICATION_BATCH_SIZE due rows of a channel with one UPDATE that moves
+their next_attempt_at NOTIFICATION_CLAIM_TIMEOUT seconds ahead, commits,
+hands the batch to the channel and then records the outcome. Rows a channel
+could not deliver are retried after NOTIFICATION_RETRY_DELAY seconds,
+doubling with every attempt, and marked failed after NOTIFICATION_MAX_ATTEMPTS.
+Rows claimed by a worker that died become due again when the claim runs out,
+so delivery is at least once.
+
+Channels, enabled by name in NOTIFICATION_CHANNELS:
+
+* in_app: the row itself is the notification, listed by /api/notifications
+* email: one SMTP connection per batch to MAIL_SERVER:MAIL_PORT, by default
+  a local stand-in such as  python -m aiosmtpd -n -l localhost:1025
+* webhook: each batch POSTed as one JSON document to NOTIFICATION_WEBHOOK_URL
+
+Other channels can be added with register_channel(). metrics() reports what
+each channel has delivered and how fast.
+
+    python notifications.py    # deliver everything that is due, then exit
+"""
+import atexit
+import json
+import random
+import smtplib
+import threading
+import time
+import urllib.request
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from sqlalchemy import event, func, insert, literal, select, update
+
+from database import db, User, Student, Session, Notification, enrollments
+
+
+class InAppChannel:
+    """Notifications shown inside the app; the stored row is all there is to deliver"""
+    
+    name = 'in_app'
+    
+    def deliver(self, notifications):
+        return {}
+
+
+class EmailChannel:
+    """Sends each notification as a plain text email over one SMTP connection per batch"""
+    
+    name = 'email'
+    
+    def __init__(self, app):
+        self.app = app
+    
+    def deliver(self, notifications):
+        config = self.app.config
+        errors = {}
+        with smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=config['MAIL_TIMEOUT']) as smtp:
+            for position, notification in enumerate(notifications):
+                message = EmailMessage()
+                message['From'] = config['MAIL_SENDER']
+                message['To'] = notification.email
+                message['Subject'] = notification.subject
+                message.set_content(notification.body)
+                try:
+                    smtp.send_message(message)
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                    errors[notification.id] = str(e)
+                except (smtplib.SMTPException, OSError) as e:
+                    # The connection is gone; this and the rest of the batch go round again
+                    for unsent in notifications[position:]:
+                        errors[unsent.id] = str(e)
+                    break
+        return errors
+
+
+class WebhookChannel:
+    """POSTs each batch as {"notifications": [...]} to NOTIFICATION_WEBHOOK_URL"""
+    
+    name = 'webhook'
+    
+    def __init__(self, app):
+        self.app = app
+    
+    def deliver(self, notifications):
+        payload = {'notifications': [{
+            'id': notification.id,
+            'user_id': notification.user_id,
+            'session_id': notification.session_id,
+            'kind': notification.kind,
+            'subject': notification.subject,
+            'body': notification.body,
+            'created_at': notification.created_at.isoformat(),
+        } for notification in notifications]}
+        request = urllib.request.Request(
+            self.app.config['NOTIFICATION_WEBHOOK_URL'], data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        # Anything but a 2xx raises, and the whole batch is retried
+        with urllib.request.urlopen(request, timeout=self.app.config['NOTIFICATION_WEBHOOK_TIMEOUT']):
+            pass
+        return {}
+
+
+class ChannelMetrics:
+    """Delivery counters of one channel since the process started"""
+    
+    def __init__(self):
+        self.batches = 0
+        self.delivered = 0
+        self.failed = 0
+        self.gave_up = 0
+        # Wall time spent on batches, from claim to recording the outcome
+        self.busy_seconds = 0.0
+    
+    def as_dict(self):
+        return {
+            'batches': self.batches,
+            'delivered': self.delivered,
+            'failed': self.failed,
+            'gave_up': self.gave_up,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'per_second': round(self.delivered / self.busy_seconds, 1) if self.busy_seconds else None,
+        }
+
+
+class NotificationOutbox:
+    """Queues notifications in the database and delivers them from a pool of worker threads"""
+    
+    def __init__(self, app=None):
+        self.app = None
+        self.channels = {}
+        self._metrics = {}
+        self._workers = []
+        self._wakes = 0
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('NOTIFICATION_CHANNELS', ('in_app',))
+        app.config.setdefault('NOTIFICATION_WORKERS', 2)
+        app.config.setdefault('NOTIFICATION_BATCH_SIZE', 500)
+        # Seconds between looks for retries and rows queued by other processes
+        app.config.setdefault('NOTIFICATION_POLL_INTERVAL', 5)
+        app.config.setdefault('NOTIFICATION_CLAIM_TIMEOUT', 300)
+        app.config.setdefault('NOTIFICATION_MAX_ATTEMPTS', 5)
+        app.config.setdefault('NOTIFICATION_RETRY_DELAY', 30)
+        app.config.setdefault('NOTIFICATION_WEBHOOK_URL', None)
+        app.config.setdefault('NOTIFICATION_WEBHOOK_TIMEOUT', 10)
+        app.config.setdefault('MAIL_SERVER', 'localhost')
+        app.config.setdefault('MAIL_PORT', 1025)
+        app.config.setdefault('MAIL_SENDER', 'trackademia@localhost')
+        app.config.setdefault('MAIL_TIMEOUT', 10)
+        app.extensions['notification_outbox'] = self
+        self.app = app
+        self.register_channel(InAppChannel())
+        self.register_channel(EmailChannel(app))
+        self.register_channel(WebhookChannel(app))
+        app.before_request(self._start_workers)
+        event.listen(db.session, 'after_commit', self._committed)
+        atexit.register(self.stop)
+    
+    def register_channel(self, channel):
+        """Add a delivery channel: an object with a name and deliver(notifications) -> {id: error}"""
+        self.channels[channel.name] = channel
+        self._metrics.setdefault(channel.name, ChannelMetrics())
+    
+    def enabled_channels(self):
+        return [name for name in self.app.config['NOTIFICATION_CHANNELS'] if name in self.channels]
+    
+    def notify_enrolled(self, session_id, kind, subject, body):
+        """
+        Queue a notification on every enabled channel for each student enrolled
+        in the session's course, in the current transaction. Returns the number
+        of rows queued.
+        """
+        now = datetime.now()
+        queued = 0
+        for channel in self.enabled_channels():
+            recipients = select(
+                User.id, literal(session_id), literal(kind), literal(channel), literal(subject), literal(body),
+                literal('pending'), literal(0), literal(now), literal(now)
+            ).select_from(Session).join(enrollments, enrollments.c.course_id == Session.course_id).join(
+                Student, enrollments.c.student_id == Student.id
+            ).join(User, Student.user_id == User.id).where(Session.id == session_id)
+            if channel == 'email':
+                recipients = recipients.where(User.email.isnot(None), User.email != '')
+            result = db.session.execute(insert(Notification).from_select([
+                'user_id', 'session_id', 'kind', 'channel', 'subject', 'body',
+                'status', 'attempts', 'next_attempt_at', 'created_at'
+            ], recipients))
+            queued += result.rowcount
+        if queued:
+            db.session.info['notifications_queued'] = True
+        return queued
+    
+    def _committed(self, session):
+        if session.info.pop('notifications_queued', False):
+            self.wake()
+    
+    def wake(self):
+        """Tell idle workers there are notifications to deliver"""
+        with self._lock:
+            self._wakes += 1
+            self._wakeup.notify_all()
+    
+    def _claim(self, channel, now):
+        config = self.app.config
+        due = select(Notification.id).where(
+            Notification.channel == channel,
+            Notification.status == 'pending',
+            Notification.next_attempt_at <= now
+        ).order_by(Notification.next_attempt_at).limit(config['NOTIFICATION_BATCH_SIZE'])
+        claimed = db.session.execute(
+            update(Notification).where(
+                Notification.id.in_(due),
+                Notification.status == 'pending',
+                Notification.next_attempt_at <= now
+            ).values(
+                next_attempt_at=now + timedelta(seconds=config['NOTIFICATION_CLAIM_TIMEOUT']),
+                attempts=Notification.attempts + 1
+            ).returning(Notification.id, Notification.attempts),
+            execution_options={'synchronize_session': False}
+        ).all()
+        if not claimed:
+            db.session.rollback()
+            return [], {}
+        notifications = db.session.execute(
+            select(Notification.id, Notification.user_id, Notification.session_id, Notification.kind,
+                   Notification.subject, Notification.body, Notification.created_at, User.email)
+            .join(User, Notification.user_id == User.id)
+            .where(Notification.id.in_([row.id for row in claimed]))
+            .order_by(Notification.id)
+        ).all()
+        db.session.commit()
+        return notifications, {row.id: row.attempts for row in claimed}
+    
+    def _record(self, channel, notifications, attempts, errors, now):
+        config = self.app.config
+        sent = [notification.id for notification in notifications if notification.id not in errors]
+        if sent:
+            db.session.execute(
+                update(Notification).where(Notification.id.in_(sent)).values(
+                    status='sent', sent_at=now, last_error=None
+                ),
+                execution_options={'synchronize_session': False}
+            )
+        gave_up = 0
+        for notification_id, error in errors.items():
+            attempt = attempts[notification_id]
+            final = attempt >= config['NOTIFICATION_MAX_ATTEMPTS']
+            gave_up += final
+            # Exponential backoff with jitter so a recovering channel is not hit all at once
+            delay = config['NOTIFICATION_RETRY_DELAY'] * 2 ** (attempt - 1) * random.uniform(0.75, 1.25)
+            db.session.execute(
+                update(Notification).where(Notification.id == notification_id).values(
+                    status='failed' if final else 'pending',
+                    next_attempt_at=now + timedelta(seconds=delay),
+                    last_error=str(error)[:1000]
+                ),
+                execution_options={'synchronize_session': False}
+            )
+        db.session.commit()
+        return len(sent), gave_up
+    
+    def deliver_batch(self, channel):
+        """Claim and deliver one batch of a channel's due notifications. Needs an app context. Returns the batch size."""
+        started = time.perf_counter()
+        notifications, attempts = self._claim(channel, datetime.now())
+        if not notifications:
+            return 0
+        try:
+            errors = self.channels[channel].deliver(notifications)
+        except Exception as e:
+            errors = {notification.id: e for notification in notifications}
+        delivered, gave_up = self._record(channel, notifications, attempts, errors, datetime.now())
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            metrics = self._metrics[channel]
+            metrics.batches += 1
+            metrics.delivered += delivered
+            metrics.failed += len(errors)
+            metrics.gave_up += gave_up
+            metrics.busy_seconds += elapsed
+        return len(notifications)
+    
+    def drain(self):
+        """Deliver batches until no channel has anything due. Needs an app context. Returns the rows handled."""
+        handled = 0
+        while True:
+            batch = sum(self.deliver_batch(channel) for channel in self.enabled_channels())
+            if not batch:
+                return handled
+            handled += batch
+    
+    def metrics(self):
+        """Per-channel delivery counters of this process, and the outbox rows by channel and status"""
+        with self._lock:
+            channels = {name: metrics.as_dict() for name, metrics in self._metrics.items()}
+        outbox = {}
+        for channel, status, count in db.session.query(
+            Notification.channel, Notification.status, func.count(Notification.id)
+        ).group_by(Notification.channel, Notification.status):
+            outbox.setdefault(channel, {})[status] = count
+        return {'channels': channels, 'outbox': outbox}
+    
+    def _start_workers(self):
+        if self._workers or not self.app.config['NOTIFICATION_WORKERS']:
+            return
+        with self._lock:
+            if not self._workers:
+                for number in range(self.app.config['NOTIFICATION_WORKERS']):
+                    worker = threading.Thread(target=self._run, name=f'notification-worker-{number}', daemon=True)
+                    worker.start()
+                    self._workers.append(worker)
+    
+    def stop(self):
+        """Stop the workers once they finish the batch in hand"""
+        with self._lock:
+            self._stopped = True
+            self._wakeup.notify_all()
+        for worker in self._workers:
+            worker.join()
+    
+    def _run(self):
+        while not self._stopped:
+            with self._lock:
+                wakes = self._wakes
+            with self.app.app_context():
+                try:
+                    handled = sum(self.deliver_batch(channel) for channel in self.enabled_channels())
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.warning('Notification delivery failed: %s', e)
+                    handled = 0
+            if not handled:
+                with self._lock:
+                    # Unless a wake() came in while this worker was busy
+                    if not self._stopped and self._wakes == wakes:
+                        self._wakeup.wait(self.app.config['NOTIFICATION_POLL_INTERVAL'])
+
+
+if __name__ == '__main__':
+    from app import app, notification_outbox
+    
+    with app.app_context():
+        handled = notification_outbox.drain()
+        print(f"Handled {handled} notifications")
+        print(json.dumps(notification_outbox.metrics(), indent=2))
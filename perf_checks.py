@@ -0,0 +1,267 @@
+# perf_checks.py - Query plan and statement budget checks for the hot paths
+"""
+Builds a throwaway SQLite database from the models and migrations, seeds it
+with the demo data and runs two checks:
+
+* Query plans: EXPLAIN QUERY PLAN for each hot query must use the index
+  declared for it, so a dropped index or a query rewritten so it can no
+  longer use one shows up before it reaches production.
+* Statement budgets: each report and dashboard route must stay within a
+  fixed number of SQL statements, and must issue the same number again after
+  the database has grown by an order of magnitude, so an N+1 loop creeping
+  back into a route fails here instead of in the middle of term.
+
+    python perf_checks.py
+
+Exits non-zero if any check fails.
+"""
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+from datetime import date, datetime, time, timedelta
+
+# Point the app at a scratch database before it is imported
+SCRATCH_DIR = tempfile.mkdtemp(prefix='trackademia-perf-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(SCRATCH_DIR, 'perf_checks.db')
+os.environ.setdefault('TRACKADEMIA_DB_PROFILE', 'testing')
+
+from sqlalchemy import and_, event, or_, select
+from werkzeug.security import generate_password_hash
+
+from app import app
+from database import (db, create_demo_data, User, Admin, Lecturer, Student, Course, Session, Attendance,
+                      RemovalRequest, Notification, enrollments)
+from migrations import migrate
+from session_lifecycle import end_due, start_due
+
+# Keep the background threads out of the statement counts
+app.config['SESSION_LIFECYCLE_INTERVAL'] = 0
+app.config['SESSION_REMINDERS_ENABLED'] = False
+app.config['NOTIFICATION_WORKERS'] = 0
+
+# (description, statement, index the plan must use, or a tuple of acceptable ones)
+HOT_QUERIES = [
+    ('attendance for a student in a session',
+     select(Attendance).where(Attendance.student_id == 1, Attendance.session_id == 1),
+     'uq_attendance_student_session'),
+    ('attendance report for a session',
+     select(Attendance).where(Attendance.session_id == 1),
+     'ix_attendances_session_student'),
+    ("lecturer's sessions, newest first",
+     select(Session).where(Session.lecturer_id == 1).order_by(Session.date.desc(), Session.start_time.desc()),
+     'ix_sessions_lecturer_date_start'),
+    ("lecturer's active sessions",
+     select(Session).where(Session.lecturer_id == 1, Session.status == 'active'),
+     ('ix_sessions_lecturer_date_start', 'ix_sessions_status_date_start', 'ix_sessions_status_starts_at',
+      'ix_sessions_status_ends_at')),
+    ('upcoming sessions due a reminder',
+     select(Session.id, Session.starts_at).where(Session.status == 'upcoming',
+                                                 Session.starts_at > datetime(2024, 1, 1, 9, 0),
+                                                 Session.starts_at <= datetime(2024, 1, 1, 10, 15),
+                                                 Session.reminder_sent_at.is_(None)),
+     'ix_sessions_status_starts_at'),
+    ('lifecycle: sessions that have ended',
+     end_due(datetime(2024, 1, 1, 9, 0)),
+     'ix_sessions_status_ends_at'),
+    ('lifecycle: sessions that have started',
+     start_due(datetime(2024, 1, 1, 9, 0)),
+     'ix_sessions_status_starts_at'),
+    ('notifications due for delivery on a channel',
+     select(Notification.id).where(Notification.channel == 'email', Notification.status == 'pending',
+                                   Notification.next_attempt_at <= datetime(2024, 1, 1, 9, 0))
+     .order_by(Notification.next_attempt_at).limit(500),
+     'ix_notifications_channel_status_next'),
+    ("user's in-app notifications, newest first",
+     select(Notification).where(Notification.user_id == 1, Notification.channel == 'in_app',
+                                Notification.status == 'sent').order_by(Notification.id.desc()).limit(20),
+     'ix_notifications_user_channel'),
+    ("course's sessions by status",
+     select(Session).where(Session.course_id == 1, Session.status == 'past'),
+     'ix_sessions_course_status'),
+    ("lecturer's courses",
+     select(Course).where(Course.lecturer_id == 1),
+     'ix_courses_lecturer_id'),
+    ("course's enrolled students",
+     select(enrollments.c.student_id).where(enrollments.c.course_id == 1),
+     'ix_enrollments_course_student'),
+    ("student's enrolled courses",
+     select(enrollments.c.course_id).where(enrollments.c.student_id == 1),
+     'ix_enrollments_student_course'),
+    ('pending removal requests, newest first',
+     select(RemovalRequest).where(RemovalRequest.status == 'pending').order_by(RemovalRequest.created_at.desc()),
+     'ix_removal_requests_status_created'),
+    ('student profile for a user',
+     select(Student).where(Student.user_id == 1),
+     'ix_students_user_id'),
+    ('lecturer profile for a user',
+     select(Lecturer).where(Lecturer.user_id == 1),
+     'ix_lecturers_user_id'),
+    ('admin profile for a user',
+     select(Admin).where(Admin.user_id == 1),
+     'ix_admins_user_id'),
+    ('admin user list, next page by type',
+     select(User).where(or_(User.user_type > 'lecturer', and_(User.user_type == 'lecturer', User.name > 'M')))
+     .order_by(User.user_type, User.name, User.id).limit(51),
+     'ix_users_type_name'),
+    ('admin user list, next page by creation date',
+     select(User).where(User.created_at > datetime(2024, 1, 1)).order_by(User.created_at, User.id).limit(51),
+     'ix_users_created'),
+    ('admin course list by name',
+     select(Course).order_by(Course.name, Course.id).limit(51),
+     'ix_courses_name'),
+]
+
+# (demo user, password, route, most SQL statements one request may issue)
+ROUTE_BUDGETS = [
+    ('admin', 'admin123', '/admin/reports', 7),
+    ('admin', 'admin123', '/api/reports/top-students', 2),
+    ('admin', 'admin123', '/api/reports/export-all', 1),
+    ('admin', 'admin123', '/admin/reports/export', 3),
+    ('admin', 'admin123', '/admin/reports/export?scope=students', 2),
+    ('admin', 'admin123', '/admin/reports/export?scope=attendance', 1),
+    ('lecturer', 'password123', '/lecturer/dashboard', 6),
+    ('lecturer', 'password123', '/lecturer/attendance-report/1', 5),
+    ('student', 'password123', '/student/attendance-analytics', 5),
+    ('admin', 'admin123', '/admin/users', 2),
+    ('admin', 'admin123', '/admin/courses', 2),
+    ('admin', 'admin123', '/admin/removal-requests', 5),
+    ('admin', 'admin123', '/api/search?q=perf stu', 1),
+    ('lecturer', 'password123', '/api/search?q=perf&type=student', 1),
+    ('admin', 'admin123', '/api/courses/1/available-students', 2),
+    ('lecturer', 'password123', '/api/courses/1/available-students?q=perf', 3),
+    ('student', 'password123', '/api/notifications', 2),
+]
+
+
+def explain(connection, statement):
+    """Return the EXPLAIN QUERY PLAN detail lines for a statement"""
+    sql = statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True})
+    rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}').fetchall()
+    return [row[-1] for row in rows]
+
+
+def check_query_plans():
+    """Returns a list of (description, index_name, passed, plan) for HOT_QUERIES"""
+    results = []
+    with db.engine.connect() as connection:
+        for description, statement, index_names in HOT_QUERIES:
+            if isinstance(index_names, str):
+                index_names = (index_names,)
+            plan = explain(connection, statement)
+            passed = any(f'INDEX {name}' in line for line in plan for name in index_names)
+            results.append((description, ' or '.join(index_names), passed, plan))
+    return results
+
+
+def count_statements(client, path):
+    """Number of SQL statements the app issues while serving one GET request"""
+    statements = []
+    
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(path)
+        # Streamed responses run their queries as the body is read
+        response.get_data()
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    if response.status_code != 200:
+        raise RuntimeError(f'GET {path} returned {response.status_code}')
+    return len(statements)
+
+
+def measure_routes():
+    """{route: statement count} for ROUTE_BUDGETS with the current data"""
+    clients = {}
+    counts = {}
+    for username, password, path, _ in ROUTE_BUDGETS:
+        if username not in clients:
+            clients[username] = app.test_client()
+            clients[username].post('/login', data={'username': username, 'password': password})
+        counts[path] = count_statements(clients[username], path)
+    return counts
+
+
+def grow(courses=20, students=300, sessions_per_course=12):
+    """Add courses, students, sessions and attendance for the demo lecturer"""
+    password_hash = generate_password_hash('perf', method='pbkdf2:sha256:1000')
+    today = date.today()
+    with app.app_context():
+        lecturer = db.session.query(Lecturer).join(User).filter(User.username == 'lecturer').one()
+        new_students = []
+        for i in range(students):
+            user = User(username=f'perf_student_{i}', name=f'Perf Student {i}', user_type='student',
+                        password_hash=password_hash)
+            new_students.append(Student(user=user, student_id=f'PERF{i:05d}'))
+        db.session.add_all(new_students)
+    
+        for c in range(courses):
+            course = Course(name=f'Perf Course {c}', code=f'PERF{c:03d}', semester='Perf Term',
+                            lecturer_id=lecturer.id, max_capacity=students)
+            course.students = random.sample(new_students, students // 2)
+            db.session.add(course)
+            for s in range(sessions_per_course):
+                session_obj = Session(course=course, name=f'Week {s + 1}', lecturer_id=lecturer.id,
+                                      date=today - timedelta(days=7 * (sessions_per_course - s)),
+                                      start_time=time(9, 0), duration_minutes=60, location='Perf Hall',
+                                      latitude=18.0060, longitude=-76.7468,
+                                      status='active' if s == sessions_per_course - 1 else 'past')
+                db.session.add(session_obj)
+                for student in random.sample(course.students, len(course.students) * 3 // 4):
+                    db.session.add(Attendance(student=student, session=session_obj, latitude=18.0060,
+                                              longitude=-76.7468, timestamp=datetime.now(), status='present'))
+        db.session.commit()
+
+
+def main():
+    try:
+        with app.app_context():
+            if db.engine.dialect.name != 'sqlite':
+                print(f"Query plan checks need SQLite; the configured database is {db.engine.dialect.name}")
+                return 0
+            db.create_all()
+            migrate()
+            with contextlib.redirect_stdout(io.StringIO()):
+                create_demo_data()
+            plans = check_query_plans()
+    
+        small = measure_routes()
+        grow()
+        large = measure_routes()
+        with app.app_context():
+            rows = db.session.query(Attendance).count()
+    finally:
+        with app.app_context():
+            db.engine.dispose()
+        shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+    
+    failures = 0
+    print("Query plans")
+    for description, index_name, passed, plan in plans:
+        print(f"  [{'ok' if passed else 'FAIL'}] {description} -> {index_name}")
+        if not passed:
+            failures += 1
+            for line in plan:
+                print(f"         {line}")
+    
+    print(f"Statement budgets (demo data / {rows} attendance rows)")
+    for _, _, path, budget in ROUTE_BUDGETS:
+        passed = small[path] <= budget and large[path] <= budget and small[path] == large[path]
+        failures += not passed
+        print(f"  [{'ok' if passed else 'FAIL'}] {path}: {small[path]} / {large[path]} statements (budget {budget})")
+    
+    checks = len(plans) + len(ROUTE_BUDGETS)
+    print(f"{checks - failures}/{checks} checks passed")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,390 @@
+"""
+Shared read queries for the report, dashboard and admin list routes.
+
+Each function loads everything its page needs in a fixed number of
+statements, either as a pre-joined projection of counts or as objects with
+their relationships eager-loaded, so the number of queries per request does
+not grow with the number of courses, sessions or students. List pages are
+read with keyset pagination (keyset_page), so each page costs the same
+however far into a large table it is.
+"""
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, case, exists, func, or_, select
+from sqlalchemy.orm import joinedload, selectinload
+
+from database import db, User, Admin, Lecturer, Student, Course, Session, Attendance, AttendanceSummary, RemovalRequest, enrollments
+
+
+def encode_cursor(*values):
+    """Opaque keyset cursor holding the sort values of the last row of a page"""
+    values = [{'datetime': v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, size):
+    """Sort values from encode_cursor; raises ValueError if the cursor is malformed"""
+    def restore(value):
+        if isinstance(value, dict) and set(value) == {'datetime'}:
+            return datetime.fromisoformat(value['datetime'])
+        return value
+    
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != size:
+            raise ValueError('Invalid cursor')
+        return tuple(restore(value) for value in values)
+    except (ValueError, TypeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def keyset_page(query, order, cursor, limit, scope):
+    """
+    One page of query in the given order, a list of (expression, descending)
+    pairs whose last expression is unique (normally the primary key).
+    
+    cursor is the next_cursor returned for the previous page, or None for the
+    first page. It is tagged with scope (typically the sort option), and a
+    cursor from another scope or a malformed one starts from the first page.
+    Returns (items, next_cursor) where next_cursor is None on the last page
+    and items are the query's entity, or tuples if it selects more than one.
+    """
+    values = None
+    if cursor:
+        try:
+            decoded = decode_cursor(cursor, len(order) + 1)
+        except ValueError:
+            decoded = None
+        if decoded and decoded[0] == scope:
+            values = decoded[1:]
+    
+    if values is not None:
+        # Rows after the cursor: equal on a prefix of the sort key and past it on the next column
+        after = []
+        for i, (expression, descending) in enumerate(order):
+            step = expression < values[i] if descending else expression > values[i]
+            after.append(and_(*[order[j][0] == values[j] for j in range(i)], step))
+        query = query.filter(or_(*after))
+    
+    keys = [expression.label(f'sort_{i}') for i, (expression, _) in enumerate(order)]
+    rows = query.add_columns(*keys).order_by(
+        *[expression.desc() if descending else expression.asc() for expression, descending in order]
+    ).limit(limit + 1).all()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(scope, *rows[-1][-len(order):])
+    width = len(rows[0]) - len(order) if rows else 0
+    items = [row[0] if width == 1 else tuple(row[:width]) for row in rows]
+    return items, next_cursor
+
+
+def course_report_rows():
+    """
+    One row per course with id, code, name, lecturer_name, enrolled,
+    sessions and attendance counts, in a single statement.
+    """
+    return course_report_query().all()
+
+
+def course_report_query():
+    """The query behind course_report_rows, for reading in batches"""
+    enrolled = select(func.count()).select_from(enrollments).where(
+        enrollments.c.course_id == Course.id
+    ).scalar_subquery()
+    sessions = select(func.count(Session.id)).where(Session.course_id == Course.id).scalar_subquery()
+    attendance = select(func.count(Attendance.id)).join(
+        Session, Attendance.session_id == Session.id
+    ).where(Session.course_id == Course.id).scalar_subquery()
+    
+    return db.session.query(
+        Course.id,
+        Course.code,
+        Course.name,
+        User.name.label('lecturer_name'),
+        enrolled.label('enrolled'),
+        sessions.label('sessions'),
+        attendance.label('attendance')
+    ).outerjoin(Lecturer, Course.lecturer_id == Lecturer.id).outerjoin(
+        User, Lecturer.user_id == User.id
+    ).order_by(Course.id)
+
+
+def student_attendance_query():
+    """
+    One row per enrolled (student, course) with student_id, name, code,
+    course_name and the attended, excused and total counts, read from the
+    attendance summaries.
+    """
+    return db.session.query(
+        Student.student_id,
+        User.name,
+        Course.code,
+        Course.name.label('course_name'),
+        AttendanceSummary.attended,
+        AttendanceSummary.excused,
+        AttendanceSummary.total
+    ).join(Student, AttendanceSummary.student_id == Student.id).join(
+        User, Student.user_id == User.id
+    ).join(Course, AttendanceSummary.course_id == Course.id).order_by(
+        AttendanceSummary.student_id, AttendanceSummary.course_id
+    )
+
+
+def attendance_record_query(course_id=None, date_from=None, date_to=None):
+    """
+    Every attendance mark with its session, course and student, optionally
+    limited to a course and a range of session dates. Ordered by session
+    along ix_attendances_session_student, so rows can be streamed without
+    sorting the whole table first.
+    """
+    query = db.session.query(
+        Session.date,
+        Session.start_time,
+        Course.code,
+        Session.name.label('session_name'),
+        Student.student_id,
+        User.name.label('student_name'),
+        Attendance.status,
+        Attendance.timestamp,
+        Attendance.verified_by
+    ).select_from(Attendance).join(Session, Attendance.session_id == Session.id).join(
+        Course, Session.course_id == Course.id
+    ).join(Student, Attendance.student_id == Student.id).join(User, Student.user_id == User.id)
+    if course_id:
+        query = query.filter(Session.course_id == course_id)
+    if date_from:
+        query = query.filter(Session.date >= date_from)
+    if date_to:
+        query = query.filter(Session.date <= date_to)
+    return query.order_by(Attendance.session_id, Attendance.student_id)
+
+
+def top_students(limit, cursor=None, offset=0, course_id=None, semester=None, threshold=None):
+    """
+    Students ranked by attendance rate (highest first, then by id), computed,
+    filtered, ordered and limited in one grouped query over the attendance
+    summaries.
+    
+    cursor is the (attendance_rate, id) of the last row of the previous page;
+    without one the first page starts at offset. course_id and semester
+    restrict the rate to matching courses (and the ranking to students
+    enrolled in them), threshold drops students below that rate.
+    
+    Returns (rows, total, next_cursor), where total counts every student
+    matching the filters and next_cursor is None on the last page.
+    """
+    summary = select(AttendanceSummary).where(exists().where(
+        enrollments.c.student_id == AttendanceSummary.student_id,
+        enrollments.c.course_id == AttendanceSummary.course_id
+    ))
+    filtered = course_id is not None or semester is not None
+    if filtered:
+        summary = summary.join(Course, Course.id == AttendanceSummary.course_id)
+        if course_id is not None:
+            summary = summary.where(Course.id == course_id)
+        if semester is not None:
+            summary = summary.where(Course.semester == semester)
+    summary = summary.subquery()
+    
+    total_sessions = func.coalesce(func.sum(summary.c.total), 0)
+    attended_sessions = func.coalesce(func.sum(summary.c.attended), 0)
+    rate = case(
+        (total_sessions > 0, func.round(attended_sessions * 100.0 / total_sessions, 1)),
+        else_=0.0
+    )
+    
+    ranked = select(
+        Student.id,
+        Student.student_id,
+        User.name,
+        User.is_active,
+        func.count(summary.c.course_id).label('courses_count'),
+        total_sessions.label('total_sessions'),
+        attended_sessions.label('attended_sessions'),
+        rate.label('attendance_rate'),
+        func.count().over().label('matches')
+    ).select_from(Student).join(User, User.id == Student.user_id).join(
+        summary, summary.c.student_id == Student.id, isouter=not filtered
+    ).group_by(Student.id, Student.student_id, User.name, User.is_active)
+    if threshold is not None:
+        ranked = ranked.having(rate >= threshold)
+    ranked = ranked.subquery()
+    
+    query = select(ranked).order_by(ranked.c.attendance_rate.desc(), ranked.c.id)
+    if cursor is not None:
+        cursor_rate, cursor_id = cursor
+        query = query.where(or_(
+            ranked.c.attendance_rate < cursor_rate,
+            and_(ranked.c.attendance_rate == cursor_rate, ranked.c.id > cursor_id)
+        ))
+    elif offset:
+        query = query.offset(offset)
+    # One extra row tells whether there is a next page
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1].attendance_rate, rows[-1].id)
+    if rows:
+        total = rows[0].matches
+    else:
+        # Past the last page the window count has no row to ride on
+        total = db.session.execute(select(func.count()).select_from(ranked)).scalar()
+    return rows, total, next_cursor
+
+
+def lecturer_courses(lecturer_id):
+    """A lecturer's courses with their students and sessions loaded"""
+    return db.session.query(Course).options(
+        selectinload(Course.students),
+        selectinload(Course.sessions)
+    ).filter_by(lecturer_id=lecturer_id).all()
+
+
+def lecturer_active_sessions(lecturer_id):
+    """A lecturer's active sessions with their course loaded"""
+    return db.session.query(Session).options(
+        joinedload(Session.course)
+    ).filter_by(lecturer_id=lecturer_id, status='active').all()
+
+
+def course_roster(course_id):
+    """A course's enrolled students with their users loaded"""
+    return db.session.query(Student).options(joinedload(Student.user)).join(
+        enrollments, enrollments.c.student_id == Student.id
+    ).filter(enrollments.c.course_id == course_id).all()
+
+
+def course_roster_ids(course_id):
+    """Ids of a course's enrolled students"""
+    return [student_id for student_id, in db.session.query(enrollments.c.student_id).filter(
+        enrollments.c.course_id == course_id
+    )]
+
+
+def lecturer_for_user(user_id):
+    """The lecturer profile for a user, with the user loaded"""
+    return db.session.query(Lecturer).options(joinedload(Lecturer.user)).filter_by(user_id=user_id).first()
+
+
+# Sort options for the admin list pages; the primary key is appended as a tie-breaker
+USER_SORTS = {
+    'type': (User.user_type, User.name),
+    'name': (User.name,),
+    'username': (User.username,),
+    'created': (User.created_at,),
+}
+
+COURSE_SORTS = {
+    'code': (func.coalesce(Course.code, ''),),
+    'name': (Course.name,),
+    'semester': (func.coalesce(Course.semester, ''), func.coalesce(Course.code, '')),
+}
+
+
+def user_page(cursor=None, limit=50, search=None, user_type=None, status=None, sort='type', descending=False):
+    """One page of users for the admin list; returns (users, next_cursor)"""
+    query = db.session.query(User)
+    if search:
+        query = query.filter(or_(
+            User.name.icontains(search, autoescape=True),
+            User.username.icontains(search, autoescape=True),
+            User.email.icontains(search, autoescape=True)
+        ))
+    if user_type:
+        query = query.filter(User.user_type == user_type)
+    if status:
+        query = query.filter(User.is_active == (status == 'active'))
+    
+    order = [(expression, descending) for expression in USER_SORTS[sort] + (User.id,)]
+    return keyset_page(query, order, cursor, limit, f"{sort}:{'desc' if descending else 'asc'}")
+
+
+def course_page(cursor=None, limit=50, search=None, status=None, semester=None, sort='code', descending=False):
+    """
+    One page of courses for the admin list with their lecturer loaded;
+    returns ([(course, enrolled), ...], next_cursor).
+    """
+    enrolled = select(func.count()).select_from(enrollments).where(
+        enrollments.c.course_id == Course.id
+    ).scalar_subquery()
+    query = db.session.query(Course, enrolled.label('enrolled')).options(
+        joinedload(Course.lecturer).joinedload(Lecturer.user)
+    )
+    if search:
+        query = query.filter(or_(
+            Course.code.icontains(search, autoescape=True),
+            Course.name.icontains(search, autoescape=True),
+            Course.semester.icontains(search, autoescape=True)
+        ))
+    if status:
+        query = query.filter(Course.is_active == (status == 'active'))
+    if semester:
+        query = query.filter(Course.semester == semester)
+    
+    order = [(expression, descending) for expression in COURSE_SORTS[sort] + (Course.id,)]
+    return keyset_page(query, order, cursor, limit, f"{sort}:{'desc' if descending else 'asc'}")
+
+
+def available_students(course_id, cursor=None, limit=25, matching=None):
+    """
+    One page of students not enrolled in a course, by name, found with an
+    anti-join on enrollments; matching is an optional filter clause on
+    Student (see SearchIndex.student_filter). Returns
+    ([(student, user), ...], next_cursor).
+    """
+    query = db.session.query(Student, User).join(User, Student.user_id == User.id).filter(
+        ~exists().where(enrollments.c.course_id == course_id, enrollments.c.student_id == Student.id)
+    )
+    if matching is not None:
+        query = query.filter(matching)
+    
+    order = [(User.name, False), (User.id, False), (Student.id, False)]
+    return keyset_page(query, order, cursor, limit, f'course:{course_id}')
+
+
+def _with_request_details(query):
+    return query.options(
+        joinedload(RemovalRequest.course),
+        joinedload(RemovalRequest.student).joinedload(Student.user),
+        joinedload(RemovalRequest.lecturer).joinedload(Lecturer.user),
+        joinedload(RemovalRequest.admin_reviewer).joinedload(Admin.user)
+    )
+
+
+def removal_request_page(cursor=None, limit=25, status='pending', course_id=None, oldest_first=False):
+    """One page of removal requests with one status; returns (requests, next_cursor)"""
+    query = _with_request_details(db.session.query(RemovalRequest)).filter(RemovalRequest.status == status)
+    if course_id:
+        query = query.filter(RemovalRequest.course_id == course_id)
+    
+    descending = not oldest_first
+    order = [(RemovalRequest.created_at, descending), (RemovalRequest.id, descending)]
+    return keyset_page(query, order, cursor, limit, f"{status}:{'asc' if oldest_first else 'desc'}")
+
+
+def removal_request_count(status='pending', course_id=None):
+    query = db.session.query(func.count(RemovalRequest.id)).filter(RemovalRequest.status == status)
+    if course_id:
+        query = query.filter(RemovalRequest.course_id == course_id)
+    return query.scalar()
+
+
+def recent_processed_requests(limit=10):
+    """
+    The most recently created approved or rejected requests. Each status is
+    read newest-first from its own index range, so this stays cheap however
+    many requests have been processed.
+    """
+    recent = []
+    for status in ('approved', 'rejected'):
+        recent.extend(_with_request_details(db.session.query(RemovalRequest)).filter(
+            RemovalRequest.status == status
+        ).order_by(RemovalRequest.created_at.desc(), RemovalRequest.id.desc()).limit(limit).all())
+    recent.sort(key=lambda r: (r.created_at, r.id), reverse=True)
+    return recent[:limit]
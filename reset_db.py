@@ -10,5 +10,11 @@ if os.path.exists(db_file):
 else:
     print(f"Database file not found: {db_file}")
 
+# WAL mode keeps recent writes next to the database; a stale log must not outlive it
+for suffix in ('-wal', '-shm'):
+    if os.path.exists(db_file + suffix):
+        os.remove(db_file + suffix)
+        print(f"Deleted database file: {db_file + suffix}")
+
 # Now just run the app to recreate everything
 print("Database reset. Run 'python app.py' to recreate the database with new schema.")
\ No newline at end of file
@@ -0,0 +1,264 @@
+"""
+Full-text search over users, students and courses.
+
+On SQLite the searchable text lives in an FTS5 table, search_index, with one
+row per user (name, username, email and, for students, student ID and
+major) and one per course (name, code and semester). Row ids are derived
+from the source row (user id * 2, course id * 2 + 1), so keeping a row in
+sync is a delete and insert by rowid whenever a User, Student or Course is
+created, edited or deleted through the ORM. Code that writes these tables
+with bulk statements calls index_users / index_courses itself, and
+
+    python search_index.py
+
+rebuilds the whole index. Where FTS5 is not available (another database, or
+an SQLite build without it) search falls back to prefix LIKE queries on the
+base tables.
+"""
+import re
+
+from sqlalchemy import Integer, and_, bindparam, event, or_, text
+from sqlalchemy.exc import OperationalError
+
+from database import db, User, Student, Course
+
+FTS_TABLE = 'search_index'
+
+# Column weights for bm25 in column order: title, subtitle, body
+RANK_WEIGHTS = (10.0, 5.0, 1.0)
+
+KINDS = ('admin', 'lecturer', 'student', 'course')
+
+_USER_ROWS = """
+    SELECT u.id * 2, u.user_type, u.id, s.id, u.name, u.username,
+           COALESCE(u.email, '') || ' ' || COALESCE(s.student_id, '') || ' ' || COALESCE(s.major, '')
+    FROM users u
+    LEFT JOIN students s ON s.id = (SELECT MIN(id) FROM students WHERE user_id = u.id)
+"""
+
+_COURSE_ROWS = """
+    SELECT c.id * 2 + 1, 'course', c.id, NULL, c.name, COALESCE(c.code, ''), COALESCE(c.semester, '')
+    FROM courses c
+"""
+
+_INSERT = f"INSERT INTO {FTS_TABLE} (rowid, kind, ref_id, profile_id, title, subtitle, body)"
+
+
+def create_table(connection):
+    """Create the FTS5 table. Returns False if this database cannot have one."""
+    if connection.dialect.name != 'sqlite':
+        return False
+    try:
+        connection.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "kind UNINDEXED, ref_id UNINDEXED, profile_id UNINDEXED, title, subtitle, body, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+    except OperationalError:
+        # SQLite compiled without FTS5
+        return False
+    return True
+
+
+def has_table(connection):
+    if connection.dialect.name != 'sqlite':
+        return False
+    return connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+    ).first() is not None
+
+
+def index_users(connection, user_ids):
+    """(Re)index the given users, dropping those that no longer exist"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    connection.execute(
+        text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN :rowids").bindparams(bindparam('rowids', expanding=True)),
+        {'rowids': [user_id * 2 for user_id in user_ids]}
+    )
+    connection.execute(
+        text(f"{_INSERT} {_USER_ROWS} WHERE u.id IN :ids").bindparams(bindparam('ids', expanding=True)),
+        {'ids': user_ids}
+    )
+
+
+def index_courses(connection, course_ids):
+    """(Re)index the given courses, dropping those that no longer exist"""
+    course_ids = list(course_ids)
+    if not course_ids:
+        return
+    connection.execute(
+        text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN :rowids").bindparams(bindparam('rowids', expanding=True)),
+        {'rowids': [course_id * 2 + 1 for course_id in course_ids]}
+    )
+    connection.execute(
+        text(f"{_INSERT} {_COURSE_ROWS} WHERE c.id IN :ids").bindparams(bindparam('ids', expanding=True)),
+        {'ids': course_ids}
+    )
+
+
+def rebuild(connection):
+    """Recreate every row of the index from the base tables"""
+    if not create_table(connection):
+        return False
+    connection.exec_driver_sql(f"DELETE FROM {FTS_TABLE}")
+    connection.exec_driver_sql(f"{_INSERT} {_USER_ROWS}")
+    connection.exec_driver_sql(f"{_INSERT} {_COURSE_ROWS}")
+    connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return True
+
+
+def query_terms(query):
+    """Words of a typed query, lower-cased"""
+    return re.findall(r'\w+', query.lower())
+
+
+def _match_expression(terms):
+    """FTS5 query matching every term as a prefix"""
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _user_term_clause(term):
+    """LIKE fallback: a word of a user's (and their student profile's) fields starts with term"""
+    return or_(
+        User.name.istartswith(term, autoescape=True),
+        User.name.icontains(' ' + term, autoescape=True),
+        User.username.istartswith(term, autoescape=True),
+        User.email.istartswith(term, autoescape=True),
+        Student.student_id.istartswith(term, autoescape=True),
+        Student.major.istartswith(term, autoescape=True)
+    )
+
+
+class SearchIndex:
+    """Keeps search_index in sync through ORM events and answers typeahead queries"""
+    
+    def __init__(self, app=None):
+        self.app = None
+        self._enabled = {}
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('SEARCH_MIN_QUERY_LENGTH', 2)
+        app.config.setdefault('SEARCH_MAX_RESULTS', 20)
+        app.extensions['search_index'] = self
+        self.app = app
+    
+        event.listen(User, 'after_insert', self._user_changed)
+        event.listen(User, 'after_update', self._user_changed)
+        event.listen(User, 'after_delete', self._user_changed)
+        event.listen(Student, 'after_insert', self._student_changed)
+        event.listen(Student, 'after_update', self._student_changed)
+        event.listen(Student, 'after_delete', self._student_changed)
+        event.listen(Course, 'after_insert', self._course_changed)
+        event.listen(Course, 'after_update', self._course_changed)
+        event.listen(Course, 'after_delete', self._course_changed)
+    
+    def enabled(self, connection):
+        """Whether the FTS table exists; only a positive answer is cached"""
+        key = str(connection.engine.url)
+        if not self._enabled.get(key):
+            self._enabled[key] = has_table(connection)
+        return self._enabled[key]
+    
+    def _user_changed(self, mapper, connection, target):
+        if self.enabled(connection):
+            index_users(connection, [target.id])
+    
+    def _student_changed(self, mapper, connection, target):
+        if self.enabled(connection) and target.user_id is not None:
+            index_users(connection, [target.user_id])
+    
+    def _course_changed(self, mapper, connection, target):
+        if self.enabled(connection):
+            index_courses(connection, [target.id])
+    
+    def search(self, query, kinds=None, limit=None):
+        """
+        Best matches for a typeahead query, every word matched as a prefix.
+        Returns a list of dicts with type, id (user or course id), profile_id
+        (the student id for students), title and subtitle.
+        """
+        terms = query_terms(query)
+        if not terms or len(''.join(terms)) < self.app.config['SEARCH_MIN_QUERY_LENGTH']:
+            return []
+        kinds = [kind for kind in (kinds or KINDS) if kind in KINDS]
+        limit = min(limit or self.app.config['SEARCH_MAX_RESULTS'], self.app.config['SEARCH_MAX_RESULTS'])
+    
+        connection = db.session.connection()
+        if self.enabled(connection):
+            return self._search_fts(connection, terms, kinds, limit)
+        return self._search_like(terms, kinds, limit)
+    
+    def student_filter(self, query):
+        """
+        Clause on Student (joined to its User) keeping students that match a
+        typed query, for narrowing other queries such as a student picker.
+        Returns None when the query has no words.
+        """
+        terms = query_terms(query)
+        if not terms:
+            return None
+        if self.enabled(db.session.connection()):
+            # Matching users by their even rowids needs no read of the rows themselves
+            matches = text(
+                f"SELECT rowid / 2 AS user_id FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match AND rowid % 2 = 0"
+            ).bindparams(match=_match_expression(terms)).columns(user_id=Integer)
+            return User.id.in_(matches)
+        return and_(*[_user_term_clause(term) for term in terms])
+    
+    def _search_fts(self, connection, terms, kinds, limit):
+        match = _match_expression(terms)
+        # Filtering on kind reads every matching row, so skip it when it would keep them all
+        kind_filter = "AND kind IN :kinds " if set(kinds) != set(KINDS) else ""
+        statement = text(
+            f"SELECT kind, ref_id, profile_id, title, subtitle FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH :match {kind_filter}"
+            f"ORDER BY bm25({FTS_TABLE}, {', '.join(map(str, RANK_WEIGHTS))}) LIMIT :limit"
+        )
+        params = {'match': match, 'limit': limit}
+        if kind_filter:
+            statement = statement.bindparams(bindparam('kinds', expanding=True))
+            params['kinds'] = kinds
+        rows = connection.execute(statement, params)
+        return [self._result(*row) for row in rows]
+    
+    def _search_like(self, terms, kinds, limit):
+        results = []
+        user_kinds = [kind for kind in kinds if kind != 'course']
+        if user_kinds:
+            query = db.session.query(User, Student).outerjoin(Student, Student.user_id == User.id).filter(
+                User.user_type.in_(user_kinds)
+            )
+            for term in terms:
+                query = query.filter(_user_term_clause(term))
+            for user, student in query.order_by(User.name, User.id).limit(limit):
+                results.append(self._result(user.user_type, user.id, student.id if student else None,
+                                            user.name, user.username))
+        if 'course' in kinds and len(results) < limit:
+            query = db.session.query(Course)
+            for term in terms:
+                query = query.filter(or_(
+                    Course.name.istartswith(term, autoescape=True),
+                    Course.name.icontains(' ' + term, autoescape=True),
+                    Course.code.istartswith(term, autoescape=True),
+                    Course.semester.istartswith(term, autoescape=True)
+                ))
+            for course in query.order_by(Course.code, Course.id).limit(limit - len(results)):
+                results.append(self._result('course', course.id, None, course.name, course.code or ''))
+        return results
+    
+    @staticmethod
+    def _result(kind, ref_id, profile_id, title, subtitle):
+        return {'type': kind, 'id': ref_id, 'profile_id': profile_id, 'title': title, 'subtitle': subtitle}
+
+
+if __name__ == '__main__':
+    from app import app
+    
+    with app.app_context():
+        with db.engine.begin() as connection:
+            built = rebuild(connection)
+    print("Rebuilt the search index" if built else "Full-text search is not available on this database")
@@ -0,0 +1,145 @@
+"""
+Process-local cache of active session verification parameters.
+
+Every check-in needs the session's coordinates, allowed distance and IP range.
+Those do not change while a lecture runs, so they are loaded once per session,
+with the radians/cosine and compiled network ranges precomputed, and kept
+until the session is edited or changes status.
+"""
+import math
+import threading
+import time
+
+from database import db, Session
+from location_check import calculate_distance_to, check_location_fast, effective_max_distance
+
+
+class SessionGeofence:
+    """Verification parameters of one session, precomputed for fast checks"""
+    
+    def __init__(self, session_obj, networks, fast_path=False):
+        self.session_id = session_obj.id
+        self.course_id = session_obj.course_id
+        self.status = session_obj.status
+        self.latitude = session_obj.latitude
+        self.longitude = session_obj.longitude
+        self.allowed_distance_meters = session_obj.allowed_distance_meters
+        self.allowed_ip_range = session_obj.allowed_ip_range
+        self.loaded_at = time.monotonic()
+        self.fast_path = fast_path
+    
+        self.has_location = bool(self.latitude) and bool(self.longitude)
+        if self.has_location:
+            self.lat_rad = math.radians(float(self.latitude))
+            self.lon_rad = math.radians(float(self.longitude))
+            self.cos_lat = math.cos(self.lat_rad)
+    
+        # An unparseable range rejects every address, as the uncached check did
+        self.network = None
+        self.network_invalid = False
+        if self.allowed_ip_range:
+            try:
+                self.network = networks.compile(self.allowed_ip_range)
+            except ValueError:
+                self.network_invalid = True
+    
+    def check_location(self, student_lat, student_lon, accuracy=None):
+        """
+        (within_range, distance) without recomputing the session side. The
+        decision is always the same as check_attendance_location's; on the
+        fast path the reported distance comes from the planar approximation
+        unless the student is close to the radius, so it can differ from the
+        haversine distance by up to FAST_PATH_TOLERANCE.
+        """
+        if not self.has_location:
+            return False, 0
+    
+        if self.fast_path:
+            within_range, distance, _ = check_location_fast(
+                student_lat, student_lon, self.lat_rad, self.lon_rad, self.cos_lat,
+                self.allowed_distance_meters, accuracy
+            )
+            return within_range, distance
+    
+        distance = calculate_distance_to(student_lat, student_lon, self.lat_rad, self.lon_rad, self.cos_lat)
+        return distance <= effective_max_distance(self.allowed_distance_meters, accuracy), round(distance, 2)
+    
+    def check_network(self, client_ip):
+        """True if the session has no IP restriction or the client is inside it"""
+        if not self.allowed_ip_range:
+            return True
+        if self.network_invalid:
+            return False
+        return client_ip in self.network
+
+
+class GeofenceCache:
+    """
+    Maps session id to SessionGeofence for active sessions.
+    
+    Only sessions with status 'active' are cached. Entries are dropped when
+    invalidate() is called for the session, and in any case after
+    GEOFENCE_CACHE_TTL seconds so edits made by other worker processes are
+    picked up.
+    
+    With GEOFENCE_FAST_PATH enabled, locations are checked with the planar
+    approximation and only fall back to haversine near the radius; the
+    decision is the same either way, but the distance shown to the student
+    may be the approximate one (off by under 1%).
+    """
+    
+    def __init__(self, app=None, networks=None):
+        self.app = None
+        self.networks = networks
+        self._entries = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('GEOFENCE_CACHE_TTL', 300)
+        app.config.setdefault('GEOFENCE_FAST_PATH', True)
+        app.extensions['geofence_cache'] = self
+        self.app = app
+    
+    def get(self, session_id):
+        """Return the SessionGeofence for a session, or None if it does not exist"""
+        try:
+            session_id = int(session_id)
+        except (TypeError, ValueError):
+            return None
+    
+        geofence = self.cached(session_id)
+        if geofence is not None:
+            return geofence
+    
+        session_obj = db.session.get(Session, session_id)
+        if session_obj is None:
+            return None
+        geofence = self.build(session_obj)
+        with self._lock:
+            if geofence.status == 'active':
+                self._entries[session_id] = geofence
+            else:
+                self._entries.pop(session_id, None)
+        return geofence
+    
+    def cached(self, session_id):
+        """Return the cached SessionGeofence if it is fresh, without touching the database"""
+        with self._lock:
+            geofence = self._entries.get(session_id)
+        if geofence is not None and time.monotonic() - geofence.loaded_at < self.app.config['GEOFENCE_CACHE_TTL']:
+            return geofence
+        return None
+    
+    def build(self, session_obj):
+        """Build a SessionGeofence for a loaded session without caching it"""
+        return SessionGeofence(session_obj, self.networks, self.app.config['GEOFENCE_FAST_PATH'])
+    
+    def invalidate(self, *session_ids):
+        """Forget the given sessions, or every session when called without ids"""
+        with self._lock:
+            if not session_ids:
+                self._entries.clear()
+            for session_id in session_ids:
+                self._entries.pop(int(session_id), None)
@@ -0,0 +1,130 @@
+"""
+Clock-driven session status changes.
+
+A session is 'upcoming' until it starts, 'active' while it runs and 'past'
+once it has ended. advance() moves every session that is due in two
+set-based UPDATEs on the indexed starts_at/ends_at timestamps:
+
+    upcoming, active -> past     ends_at < now
+    upcoming -> active           starts_at <= now
+
+and adjusts the attendance summaries and the in-memory session caches for
+the sessions it moved. Statuses only ever move forward, so a session a
+lecturer opened early or closed by hand is left alone.
+
+advance() runs every SESSION_LIFECYCLE_INTERVAL seconds on a background
+thread started with the first request (0 turns the thread off), from
+POST /api/sessions/advance, or from the command line, so pages that show
+session status only read it:
+
+    python session_lifecycle.py
+"""
+import atexit
+import threading
+from datetime import datetime
+
+from sqlalchemy import update
+
+from attendance_summary import course_totals_changed
+from database import db, Session
+
+
+def end_due(now):
+    """UPDATE moving sessions that have ended to 'past', returning their id and course"""
+    return update(Session).where(
+        Session.status.in_(('upcoming', 'active')),
+        Session.ends_at < now
+    ).values(status='past').returning(Session.id, Session.course_id)
+
+
+def start_due(now):
+    """
+    UPDATE moving upcoming sessions that have started to 'active', returning
+    their id. Run after end_due, which has already moved the ones that ended.
+    """
+    return update(Session).where(
+        Session.status == 'upcoming',
+        Session.starts_at <= now
+    ).values(status='active').returning(Session.id)
+
+
+class SessionLifecycle:
+    """Moves sessions between statuses as their start and end times pass"""
+    
+    def __init__(self, app=None, geofences=None, locator=None):
+        self.app = None
+        self.geofences = geofences
+        self.locator = locator
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('SESSION_LIFECYCLE_INTERVAL', 30)
+        app.extensions['session_lifecycle'] = self
+        app.before_request(self._start_scheduler)
+        self.app = app
+        atexit.register(self.stop)
+    
+    def advance(self, now=None):
+        """
+        Move every due session on as of now (default: the current local time)
+        in one transaction. Needs an app context. Returns the ids of the
+        sessions that became active and of those that became past.
+        """
+        now = now or datetime.now()
+        options = {'synchronize_session': False}
+        ended = db.session.execute(end_due(now), execution_options=options).all()
+        started = db.session.execute(start_due(now), execution_options=options).scalars().all()
+    
+        deltas = {}
+        for _, course_id in ended:
+            deltas[course_id] = deltas.get(course_id, 0) + 1
+        course_totals_changed(db.session.connection(), deltas)
+        db.session.commit()
+    
+        ended = [session_id for session_id, _ in ended]
+        self._refresh(started + ended)
+        return started, ended
+    
+    def _refresh(self, session_ids):
+        if not session_ids:
+            return
+        if self.geofences is not None:
+            self.geofences.invalidate(*session_ids)
+        if self.locator is not None:
+            self.locator.update(*db.session.query(Session).filter(Session.id.in_(session_ids)))
+    
+    def _start_scheduler(self):
+        if self._thread is not None or not self.app.config['SESSION_LIFECYCLE_INTERVAL']:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='session-lifecycle', daemon=True)
+                self._thread.start()
+    
+    def stop(self):
+        """Stop the background thread"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+    
+    def _run(self):
+        while not self._stopped.is_set():
+            with self.app.app_context():
+                try:
+                    self.advance()
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.warning('Session lifecycle run failed: %s', e)
+            self._stopped.wait(self.app.config['SESSION_LIFECYCLE_INTERVAL'])
+
+
+if __name__ == '__main__':
+    from app import app, session_lifecycle
+    
+    with app.app_context():
+        started, ended = session_lifecycle.advance()
+    print(f"{len(started)} sessions started, {len(ended)} sessions ended")
@@ -0,0 +1,125 @@
+"""
+Grid index of active session locations.
+
+Lets a student check in with just their coordinates: the grid narrows all
+active sessions on campus down to the few whose cells are within reach of the
+student, and only those are checked against the student's enrollments and
+geofences.
+"""
+import math
+import threading
+import time
+
+from database import db, Session, enrollments
+
+# Meters per degree of latitude, rounded down so the search never comes up short
+METERS_PER_DEGREE = 110000
+
+
+class SessionLocator:
+    """
+    Active sessions bucketed by (lat, lon) grid cell.
+    
+    The index is loaded on first use and then kept up to date incrementally by
+    update() whenever a session is created, edited or changes status. It is
+    reloaded from the database every SESSION_GRID_TTL seconds so changes made
+    by other worker processes are picked up.
+    """
+    
+    def __init__(self, app=None, geofences=None):
+        self.app = None
+        self.geofences = geofences
+        self._cells = {}
+        self._sessions = {}
+        self._max_radius = 0
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('SESSION_GRID_CELL_DEGREES', 0.01)
+        app.config.setdefault('SESSION_GRID_TTL', 60)
+        app.config.setdefault('LOCATE_MAX_ACCURACY', 500)
+        app.extensions['session_locator'] = self
+        self.app = app
+        self.cell_degrees = app.config['SESSION_GRID_CELL_DEGREES']
+        self._lon_cells = round(360 / self.cell_degrees)
+    
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees) % self._lon_cells
+    
+    def _add(self, geofence):
+        self._sessions[geofence.session_id] = geofence
+        self._cells.setdefault(self._cell(float(geofence.latitude), float(geofence.longitude)), set()).add(geofence.session_id)
+        self._max_radius = max(self._max_radius, geofence.allowed_distance_meters or 0)
+    
+    def _discard(self, session_id):
+        geofence = self._sessions.pop(session_id, None)
+        if geofence is not None:
+            cell = self._cell(float(geofence.latitude), float(geofence.longitude))
+            self._cells[cell].discard(session_id)
+            if not self._cells[cell]:
+                del self._cells[cell]
+    
+    def _ensure_loaded(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.app.config['SESSION_GRID_TTL']:
+            return
+        active = db.session.query(Session).filter(
+            Session.status == 'active',
+            Session.latitude.isnot(None),
+            Session.longitude.isnot(None)
+        ).all()
+        with self._lock:
+            self._cells = {}
+            self._sessions = {}
+            self._max_radius = 0
+            for session_obj in active:
+                self._add(self.geofences.build(session_obj))
+            self._loaded_at = time.monotonic()
+    
+    def update(self, *session_objs):
+        """Re-index sessions after they were created, edited or changed status"""
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            for session_obj in session_objs:
+                self._discard(session_obj.id)
+                if session_obj.status == 'active' and session_obj.latitude and session_obj.longitude:
+                    self._add(self.geofences.build(session_obj))
+    
+    def locate(self, student_id, latitude, longitude, accuracy=None):
+        """
+        Return the nearest active session the student is enrolled in and within
+        range of, as (geofence, distance), or (None, None) if there is none.
+        """
+        self._ensure_loaded()
+        latitude = float(latitude)
+        longitude = float(longitude)
+        course_ids = {row[0] for row in db.session.query(enrollments.c.course_id).filter(
+            enrollments.c.student_id == student_id
+        )}
+        if not course_ids:
+            return None, None
+    
+        # Search every cell a matching geofence could reach into
+        reach = self._max_radius + float(accuracy or 0)
+        cell_meters = self.cell_degrees * METERS_PER_DEGREE
+        lat_rings = math.ceil(reach / cell_meters)
+        # One extra ring of longitude since cells narrow towards the poles
+        lon_rings = math.ceil(reach / (cell_meters * max(math.cos(math.radians(latitude)), 0.01))) + 1
+        lon_rings = min(lon_rings, self._lon_cells // 2)
+        row, col = self._cell(latitude, longitude)
+    
+        best, best_distance = None, None
+        with self._lock:
+            for i in range(row - lat_rings, row + lat_rings + 1):
+                for j in range(col - lon_rings, col + lon_rings + 1):
+                    for session_id in self._cells.get((i, j % self._lon_cells), ()):
+                        geofence = self._sessions[session_id]
+                        if geofence.course_id not in course_ids:
+                            continue
+                        within_range, distance = geofence.check_location(latitude, longitude, accuracy)
+                        if within_range and (best is None or distance < best_distance):
+                            best, best_distance = geofence, distance
+        return best, best_distance
@@ -0,0 +1,176 @@
+"""
+Reminders to enrolled students shortly before a session starts.
+
+Sessions due for a reminder in the next SESSION_REMINDER_HORIZON seconds are
+loaded into a heap ordered by reminder time (starts_at minus
+SESSION_REMINDER_LEAD_MINUTES), and a scheduler thread sleeps until the
+earliest one is due. The heap is reloaded when the horizon runs out and
+whenever a committed change adds, edits or removes a session, so a session
+created ten minutes before it starts is still reminded.
+
+Each reminder is claimed by setting the session's reminder_sent_at with a
+conditional UPDATE, and queued for the enrolled students in the notification
+outbox in the same transaction, so it goes out once even with several app
+processes running schedulers. Rescheduling a session clears reminder_sent_at
+(Session.schedule) so the new time gets its own reminder.
+"""
+import atexit
+import heapq
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, update
+from sqlalchemy.orm import object_session
+
+from database import db, Course, Session
+
+
+class ReminderScheduler:
+    """Timer heap of upcoming session reminders, fired from a background thread"""
+    
+    def __init__(self, app=None, outbox=None):
+        self.app = None
+        self.outbox = outbox
+        self._heap = []
+        self._horizon_end = None
+        self._reload = True
+        self._stopped = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('SESSION_REMINDERS_ENABLED', True)
+        app.config.setdefault('SESSION_REMINDER_LEAD_MINUTES', 15)
+        app.config.setdefault('SESSION_REMINDER_HORIZON', 3600)
+        app.extensions['session_reminders'] = self
+        app.before_request(self._start_scheduler)
+        event.listen(Session, 'after_insert', self._session_changed)
+        event.listen(Session, 'after_update', self._session_changed)
+        event.listen(Session, 'after_delete', self._session_changed)
+        event.listen(db.session, 'after_commit', self._committed)
+        self.app = app
+        atexit.register(self.stop)
+    
+    @property
+    def lead(self):
+        return timedelta(minutes=self.app.config['SESSION_REMINDER_LEAD_MINUTES'])
+    
+    def rearm(self):
+        """Reload the heap before the next reminder is due"""
+        with self._lock:
+            self._reload = True
+            self._wakeup.notify()
+    
+    def _session_changed(self, mapper, connection, target):
+        object_session(target).info['sessions_changed'] = True
+    
+    def _committed(self, session):
+        if session.info.pop('sessions_changed', False):
+            self.rearm()
+    
+    def due_sessions(self, now, until):
+        """(reminder time, session id) of unreminded upcoming sessions reminded before until"""
+        return [(starts_at - self.lead, session_id) for session_id, starts_at in db.session.query(
+            Session.id, Session.starts_at
+        ).filter(
+            Session.status == 'upcoming',
+            Session.starts_at > now,
+            Session.starts_at <= until + self.lead,
+            Session.reminder_sent_at.is_(None)
+        )]
+    
+    def _load(self, now):
+        horizon_end = now + timedelta(seconds=self.app.config['SESSION_REMINDER_HORIZON'])
+        heap = self.due_sessions(now, horizon_end)
+        heapq.heapify(heap)
+        with self._lock:
+            self._heap = heap
+            self._horizon_end = horizon_end
+    
+    def claim(self, session_id, now):
+        """Mark a session's reminder as sent; False if it is not due or was already sent"""
+        result = db.session.execute(
+            update(Session).where(
+                Session.id == session_id,
+                Session.status == 'upcoming',
+                Session.starts_at > now,
+                Session.starts_at <= now + self.lead,
+                Session.reminder_sent_at.is_(None)
+            ).values(reminder_sent_at=now),
+            execution_options={'synchronize_session': False}
+        )
+        return result.rowcount == 1
+    
+    def fire(self, session_id, now=None):
+        """Send a session's reminder if it is due and no one has sent it yet. Needs an app context."""
+        now = now or datetime.now()
+        try:
+            if self.claim(session_id, now):
+                self.send(session_id)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    
+    def send(self, session_id):
+        """Queue a reminder for every student enrolled in the session's course"""
+        course_name, session_name, starts_at, location = db.session.query(
+            Course.name, Session.name, Session.starts_at, Session.location
+        ).join(Course, Session.course_id == Course.id).filter(Session.id == session_id).one()
+        body = (f"{course_name} ({session_name}) starts in {self.app.config['SESSION_REMINDER_LEAD_MINUTES']} "
+                f"minutes at {starts_at:%H:%M}" + (f" in {location}." if location else "."))
+        self.outbox.notify_enrolled(session_id, 'reminder', f'Upcoming: {course_name} ({session_name})', body)
+    
+    def _next_due(self):
+        """Pop the reminders that are due, waiting until there are some or the heap needs reloading"""
+        with self._lock:
+            while not self._stopped and not self._reload:
+                now = datetime.now()
+                if now >= self._horizon_end:
+                    break
+                if self._heap and self._heap[0][0] <= now:
+                    due = []
+                    while self._heap and self._heap[0][0] <= now:
+                        due.append(heapq.heappop(self._heap)[1])
+                    return due
+                wake_at = min(self._heap[0][0], self._horizon_end) if self._heap else self._horizon_end
+                self._wakeup.wait((wake_at - now).total_seconds())
+            self._reload = False
+            return []
+    
+    def _run(self):
+        while not self._stopped:
+            due = self._next_due()
+            if self._stopped:
+                break
+            with self.app.app_context():
+                try:
+                    if not due:
+                        self._load(datetime.now())
+                    for session_id in due:
+                        self.fire(session_id)
+                except Exception as e:
+                    self.app.logger.warning('Session reminders failed: %s', e)
+                    # Back off and reload, rather than retry in a tight loop
+                    with self._lock:
+                        self._wakeup.wait(5)
+                        self._reload = True
+    
+    def _start_scheduler(self):
+        if self._thread is not None or not self.app.config['SESSION_REMINDERS_ENABLED']:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='session-reminders', daemon=True)
+                self._thread.start()
+    
+    def stop(self):
+        """Stop the scheduler thread"""
+        with self._lock:
+            self._stopped = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join()
@@ -50,30 +50,93 @@ function addStudentToCourse(courseId, studentId) {
     });
 }
 
+// POST a check-in, backing off when the server sheds load with 429 + Retry-After.
+// Retries are jittered so a whole lecture hall does not come back at the same instant.
+function postCheckIn(url, payload, attempt = 0) {
+    const maxAttempts = 6;
+    return fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(payload)
+    })
+    .then(response => {
+        if (response.status !== 429 || attempt + 1 >= maxAttempts) {
+            return response;
+        }
+        return response.json().then(data => {
+            const header = parseFloat(response.headers.get('Retry-After'));
+            const base = data.retry_after || (isNaN(header) ? 1 : header);
+            // Wait at least the hinted time, plus up to the same again (growing per attempt)
+            const delay = base * 1000 * (1 + Math.random() * Math.min(attempt + 1, 4));
+            return new Promise(resolve => setTimeout(resolve, delay))
+                .then(() => postCheckIn(url, payload, attempt + 1));
+        });
+    });
+}
+
 // Mark Attendance
 function markAttendance(sessionId) {
     if (navigator.geolocation) {
         navigator.geolocation.getCurrentPosition(
             (position) => {
-                fetch('/api/attendance/mark', {
+                postCheckIn('/api/attendance/mark', {
+                    session_id: sessionId,
+                    latitude: position.coords.latitude,
+                    longitude: position.coords.longitude,
+                    // The server widens the allowed distance by the reported GPS accuracy
+                    accuracy: position.coords.accuracy
+                })
+                .then(response => response.json())
+                .then(data => {
+                    if (data.success) {
+                        alert('Attendance marked successfully!');
+                        location.reload();
+                    } else {
+                        alert('Failed to mark attendance');
+                        alert(data.message)
+                    }
+                })
+                .catch(error => {
+                    console.error('Error:', error);
+                    alert('An error occurred');
+                });
+            },
+            (error) => {
+                alert('Please enable location services to mark attendance');
+                console.error('Geolocation error:', error);
+            }
+        );
+    } else {
+        alert('Geolocation is not supported by your browser');
+    }
+}
+
+// Find the active session at the student's location and mark attendance for it
+function locateAndMarkAttendance() {
+    if (navigator.geolocation) {
+        navigator.geolocation.getCurrentPosition(
+            (position) => {
+                fetch('/api/attendance/locate', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
                     },
                     body: JSON.stringify({
-                        session_id: sessionId,
                         latitude: position.coords.latitude,
-                        longitude: position.coords.longitude
+                        longitude: position.coords.longitude,
+                        accuracy: position.coords.accuracy
                     })
                 })
                 .then(response => response.json())
                 .then(data => {
                     if (data.success) {
-                        alert('Attendance marked successfully!');
-                        location.reload();
+                        if (confirm(`Mark attendance for ${data.session.course_name} - ${data.session.name}?`)) {
+                            markAttendance(data.session.id);
+                        }
                     } else {
-                        alert('Failed to mark attendance');
-                        alert(data.message)
+                        alert(data.message);
                     }
                 })
                 .catch(error => {
@@ -0,0 +1,325 @@
+"""
+Bulk user import from CSV.
+
+The file is read as a stream and handled in batches of IMPORT_BATCH_SIZE
+rows. For each batch:
+
+* rows are validated, and usernames, emails, student IDs and employee IDs
+  are checked against the file so far and against the database with one
+  IN query per column, instead of a lookup per row
+* passwords are hashed in a process pool (hashing is deliberately slow and
+  CPU bound, so it is the bulk of an import)
+* users and their admin, lecturer or student profiles are inserted with one
+  executemany per table and committed together
+
+Rows that fail validation are reported with their line number and skipped;
+the rest of the file is still imported. If a batch fails outright (the
+database goes away, or the file turns out not to be valid CSV or UTF-8
+halfway through), the import stops there: the batches before it stay
+committed, and the report says how many rows were imported, skipped and
+failed along with the error. A dry run validates the whole file without
+hashing or writing anything.
+
+Columns: username, name, user_type (admin, lecturer or student) are
+required; email, password and the profile columns (student_id,
+enrollment_year, major; employee_id, department, office_location,
+office_hours; role) are optional.
+
+    python user_import.py users.csv [--dry-run]
+"""
+import csv
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+
+from database import db, User, Admin, Lecturer, Student
+from search_index import index_users
+
+REQUIRED_COLUMNS = ('username', 'name', 'user_type')
+
+USER_TYPES = ('admin', 'lecturer', 'student')
+
+# Passwords handed to a pool worker at a time
+HASH_CHUNK_SIZE = 32
+
+
+def hash_passwords(passwords):
+    """Hash a chunk of passwords; runs in a pool worker"""
+    return [generate_password_hash(password) for password in passwords]
+
+
+class ImportReport:
+    """Outcome of an import: counts per user type, the rows that were skipped, and what stopped it"""
+    
+    def __init__(self, dry_run=False, max_errors=200):
+        self.dry_run = dry_run
+        self.max_errors = max_errors
+        self.rows = 0
+        self.imported = {user_type: 0 for user_type in USER_TYPES}
+        self.error_count = 0
+        self.errors = []
+        # Rows lost with the batch that was being imported when the import stopped
+        self.failed = 0
+        # Why the import stopped before the end of the file, if it did
+        self.aborted = None
+    
+    @property
+    def imported_count(self):
+        return sum(self.imported.values())
+    
+    def error(self, line, username, message):
+        """Record a skipped row; only the first max_errors are kept"""
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'username': username, 'message': message})
+
+
+class UserImporter:
+    """Streams CSV files of users into the database in batches"""
+    
+    def __init__(self, app=None, search=None):
+        self.app = None
+        self.search = search
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('IMPORT_BATCH_SIZE', 500)
+        # Password hashing processes; None uses every CPU, 0 hashes in the request
+        app.config.setdefault('IMPORT_HASH_WORKERS', None)
+        app.config.setdefault('IMPORT_DEFAULT_PASSWORD', 'password123')
+        app.config.setdefault('IMPORT_MAX_REPORTED_ERRORS', 200)
+        app.extensions['user_importer'] = self
+        self.app = app
+    
+    def import_csv(self, stream, dry_run=False):
+        """
+        Import users from a text stream of CSV. Returns an ImportReport,
+        whose aborted is set if a batch failed and the import stopped there.
+        Raises ValueError if the header lacks a required column.
+        """
+        config = self.app.config
+        reader = csv.DictReader(stream)
+        missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"Missing column(s): {', '.join(missing)}")
+    
+        report = ImportReport(dry_run=dry_run, max_errors=config['IMPORT_MAX_REPORTED_ERRORS'])
+        # Unique values already taken by earlier rows of the file
+        seen = {'username': set(), 'email': set(), 'student_id': set(), 'employee_id': set()}
+        pool = None
+        try:
+            batch = []
+            for row in reader:
+                report.rows += 1
+                batch.append((reader.line_num, row))
+                if len(batch) >= config['IMPORT_BATCH_SIZE']:
+                    pool = self._import_batch(batch, seen, report, dry_run, pool)
+                    batch = []
+            if batch:
+                pool = self._import_batch(batch, seen, report, dry_run, pool)
+        except Exception as e:
+            # Earlier batches are committed, so report how far the import got rather than just failing
+            self.app.logger.exception('User import stopped after %d rows', report.rows)
+            db.session.rollback()
+            # Every row read so far was imported, skipped, or lost with the failed batch
+            report.failed = report.rows - report.imported_count - report.error_count
+            report.aborted = str(e)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return report
+    
+    def _import_batch(self, batch, seen, report, dry_run, pool):
+        rows = self._validate(batch, seen, report)
+        if dry_run or not rows:
+            for row in rows:
+                report.imported[row['user_type']] += 1
+            return pool
+    
+        passwords = [row.pop('password') for row in rows]
+        pool = self._hash_pool(pool, len(passwords))
+        if pool is None:
+            hashes = hash_passwords(passwords)
+        else:
+            chunks = [passwords[i:i + HASH_CHUNK_SIZE] for i in range(0, len(passwords), HASH_CHUNK_SIZE)]
+            hashes = [password_hash for chunk in pool.map(hash_passwords, chunks) for password_hash in chunk]
+        for row, password_hash in zip(rows, hashes):
+            row['password_hash'] = password_hash
+    
+        try:
+            self._insert(rows)
+        except IntegrityError:
+            # Something changed under us since validation; fall back to one transaction per row
+            db.session.rollback()
+            for row in rows:
+                try:
+                    self._insert([row])
+                except IntegrityError as e:
+                    db.session.rollback()
+                    report.error(row['line'], row['username'], f'Rejected by the database: {e.orig}')
+                    continue
+                report.imported[row['user_type']] += 1
+        else:
+            for row in rows:
+                report.imported[row['user_type']] += 1
+        return pool
+    
+    def _hash_pool(self, pool, count):
+        """The hashing pool, started on first need; None to hash inline"""
+        workers = self.app.config['IMPORT_HASH_WORKERS']
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if pool is not None or workers <= 1 or count <= HASH_CHUNK_SIZE:
+            return pool
+        # spawn: forking would copy the app's threads and open database connections
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    
+    def _validate(self, batch, seen, report):
+        """Clean rows that can be imported; the others are reported and dropped"""
+        default_password = self.app.config['IMPORT_DEFAULT_PASSWORD']
+        cleaned = []
+        for line, row in batch:
+            value = {key: (row.get(key) or '').strip() for key in (
+                'username', 'name', 'email', 'user_type', 'student_id', 'enrollment_year', 'major',
+                'employee_id', 'department', 'office_location', 'office_hours', 'role'
+            )}
+            username = value['username']
+            user_type = value['user_type'].lower()
+    
+            message = None
+            if not username:
+                message = 'Username is required'
+            elif len(username) > User.username.type.length:
+                message = f'Username is longer than {User.username.type.length} characters'
+            elif not value['name']:
+                message = 'Name is required'
+            elif user_type not in USER_TYPES:
+                message = f"User type must be one of {', '.join(USER_TYPES)}"
+            elif value['enrollment_year'] and not value['enrollment_year'].isdigit():
+                message = 'Enrollment year must be a number'
+            if message:
+                report.error(line, username, message)
+                continue
+    
+            cleaned.append({
+                'line': line,
+                'username': username,
+                'name': value['name'],
+                'email': value['email'] or None,
+                'user_type': user_type,
+                'password': row.get('password') or default_password,
+                'student_id': (value['student_id'] or None) if user_type == 'student' else None,
+                'enrollment_year': int(value['enrollment_year']) if value['enrollment_year'] else None,
+                'major': value['major'] or None,
+                'employee_id': (value['employee_id'] or None) if user_type == 'lecturer' else None,
+                'department': value['department'] or None,
+                'office_location': value['office_location'] or None,
+                'office_hours': value['office_hours'] or None,
+                'role': value['role'] or 'administrator',
+            })
+    
+        # Values of this batch that already exist, one query per unique column
+        taken = {
+            'username': self._existing(User.username, [row['username'] for row in cleaned]),
+            'email': self._existing(User.email, [row['email'] for row in cleaned]),
+            'student_id': self._existing(Student.student_id, [row['student_id'] for row in cleaned]),
+            'employee_id': self._existing(Lecturer.employee_id, [row['employee_id'] for row in cleaned]),
+        }
+        labels = {'username': 'Username', 'email': 'Email', 'student_id': 'Student ID', 'employee_id': 'Employee ID'}
+    
+        rows = []
+        for row in cleaned:
+            conflict = None
+            for column, label in labels.items():
+                if row[column] is None:
+                    continue
+                if row[column] in taken[column]:
+                    conflict = f'{label} {row[column]} already exists'
+                elif row[column] in seen[column]:
+                    conflict = f'{label} {row[column]} appears earlier in the file'
+                if conflict:
+                    break
+            if conflict:
+                report.error(row['line'], row['username'], conflict)
+                continue
+            for column in labels:
+                if row[column] is not None:
+                    seen[column].add(row[column])
+            rows.append(row)
+        return rows
+    
+    @staticmethod
+    def _existing(column, values):
+        values = [value for value in values if value is not None]
+        if not values:
+            return set()
+        return set(db.session.execute(select(column).where(column.in_(values))).scalars())
+    
+    def _insert(self, rows):
+        """Insert users and their profiles in one transaction"""
+        connection = db.session.connection()
+        user_ids = connection.execute(
+            insert(User).returning(User.id, sort_by_parameter_order=True),
+            [{
+                'username': row['username'],
+                'name': row['name'],
+                'email': row['email'],
+                'user_type': row['user_type'],
+                'password_hash': row['password_hash'],
+                'is_active': True
+            } for row in rows]
+        ).scalars().all()
+    
+        profiles = {Admin: [], Lecturer: [], Student: []}
+        for user_id, row in zip(user_ids, rows):
+            if row['user_type'] == 'student':
+                profiles[Student].append({
+                    'user_id': user_id,
+                    'student_id': row['student_id'],
+                    'enrollment_year': row['enrollment_year'],
+                    'major': row['major']
+                })
+            elif row['user_type'] == 'lecturer':
+                profiles[Lecturer].append({
+                    'user_id': user_id,
+                    'employee_id': row['employee_id'],
+                    'department': row['department'],
+                    'office_location': row['office_location'],
+                    'office_hours': row['office_hours']
+                })
+            else:
+                profiles[Admin].append({'user_id': user_id, 'role': row['role']})
+        for model, profile_rows in profiles.items():
+            if profile_rows:
+                connection.execute(insert(model), profile_rows)
+    
+        # Core inserts skip the ORM events that keep the search index current
+        if self.search is not None and self.search.enabled(connection):
+            index_users(connection, user_ids)
+        db.session.commit()
+
+
+if __name__ == '__main__':
+    import sys
+    
+    from app import app, user_importer
+    
+    if len(sys.argv) < 2:
+        sys.exit('usage: python user_import.py users.csv [--dry-run]')
+    dry_run = '--dry-run' in sys.argv[2:]
+    with app.app_context(), open(sys.argv[1], encoding='utf-8-sig', newline='') as f:
+        report = user_importer.import_csv(f, dry_run=dry_run)
+    verb = 'Would import' if dry_run else 'Imported'
+    print(f"{verb} {report.imported_count} of {report.rows} rows "
+          f"({', '.join(f'{count} {user_type}' for user_type, count in report.imported.items())})")
+    for error in report.errors:
+        print(f"  line {error['line']}: {error['username'] or '-'}: {error['message']}")
+    if report.error_count > len(report.errors):
+        print(f"  ... and {report.error_count - len(report.errors)} more")
+    if report.aborted:
+        sys.exit(f"Import stopped after {report.rows} rows, {report.failed} of them not imported: {report.aborted}")